@@ -0,0 +1,50 @@
+"""
+Compare the size and decode time of cached id lists encoded with
+``forums.codec`` against pickled lists.
+
+    python -m benchmarks.codec
+"""
+import pickle
+import random
+import timeit
+
+from forums.codec import decode_ids, encode_ids
+
+SIZES = (1_000, 100_000, 1_000_000)
+
+
+def cases(size):
+    rng = random.Random(size)
+    sorted_ids = sorted(rng.sample(range(size * 20), size))
+    yield 'sorted', sorted_ids
+    yield 'dense', list(range(1, size + 1))
+    shuffled = list(sorted_ids)
+    rng.shuffle(shuffled)
+    yield 'unsorted', shuffled
+
+
+def measure(function, data):
+    timer = timeit.Timer(lambda: function(data))
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=3, number=number)) / number
+
+
+def main():
+    print(
+        f'{"ids":>9} {"list":>9} {"pickle B":>10} {"codec B":>10} '
+        f'{"pickle ms":>10} {"codec ms":>10}'
+    )
+    for size in SIZES:
+        for name, ids in cases(size):
+            pickled = pickle.dumps(ids, pickle.HIGHEST_PROTOCOL)
+            encoded = encode_ids(ids)
+            assert decode_ids(encoded) == ids
+            print(
+                f'{size:>9} {name:>9} {len(pickled):>10} {len(encoded):>10} '
+                f'{measure(pickle.loads, pickled) * 1000:>10.3f} '
+                f'{measure(decode_ids, encoded) * 1000:>10.3f}'
+            )
+
+
+if __name__ == '__main__':
+    main()
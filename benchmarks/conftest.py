@@ -0,0 +1,18 @@
+import os
+
+import forums
+from core.conftest import *  # noqa: F401, F403
+from core.conftest import PLUGINS, POPULATORS
+from forums.test_data import ForumsGenerator
+
+PLUGINS.append(forums)
+POPULATORS.append(ForumsGenerator)
+
+# Override with BENCHMARK_CATEGORIES, BENCHMARK_FORUMS, BENCHMARK_THREADS and
+# BENCHMARK_POSTS to benchmark other forum sizes.
+SIZES = {'categories': 5, 'forums': 50, 'threads': 5_000, 'posts': 100_000}
+
+ForumsGenerator.sizes = {
+    name: int(os.environ.get(f'BENCHMARK_{name.upper()}', default))
+    for name, default in SIZES.items()
+}
@@ -0,0 +1,253 @@
+"""
+Benchmark the forum endpoints with the Flask test client, against a forum
+generated by ``forums.test_data.ForumsGenerator``. For each endpoint, report
+the latency percentiles and the SQL statements and shared cache calls per
+request, as counted by ``forums.instrumentation``, and save the results as
+JSON so runs can be compared.
+
+    make benchmarks
+    BENCHMARK_POSTS=10000000 BENCHMARK_THREADS=500000 make benchmarks
+
+``BENCHMARK_REQUESTS`` sets the requests per endpoint, and
+``BENCHMARK_OUTPUT`` the results file, which defaults to a timestamped file
+in ``benchmarks/results``.
+"""
+import json
+import math
+import os
+import random
+import time
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Tuple
+
+from core import db
+from core.conftest import add_permissions
+from forums.instrumentation import Counter
+from forums.test_data import ForumsGenerator
+
+REQUESTS = int(os.environ.get('BENCHMARK_REQUESTS', 200))
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(__file__), 'results')
+
+# The live threads, polls and forums of the forums the user can access, and
+# the polls and threads the user has not voted on or subscribed to yet.
+ACCESSIBLE_THREADS = """
+    SELECT t.id FROM forums_threads AS t
+    JOIN users_permissions AS p
+      ON p.permission = 'forumaccess_forum_' || t.forum_id
+    WHERE p.user_id = :user_id AND p.granted
+      AND NOT t.deleted AND NOT t.locked
+    ORDER BY t.id"""
+OPEN_POLL_CHOICES = f"""
+    SELECT MIN(c.id) FROM forums_polls_choices AS c
+    JOIN forums_polls AS p ON p.id = c.poll_id
+    WHERE NOT p.closed AND p.thread_id IN ({ACCESSIBLE_THREADS})
+      AND NOT EXISTS (
+        SELECT 1 FROM forums_polls_answers AS a
+        WHERE a.poll_id = p.id AND a.user_id = :user_id)
+    GROUP BY p.id
+    ORDER BY p.id"""
+UNSUBSCRIBED_THREADS = f"""
+    SELECT id FROM ({ACCESSIBLE_THREADS}) AS t
+    WHERE NOT EXISTS (
+        SELECT 1 FROM forums_threads_subscriptions AS s
+        WHERE s.thread_id = t.id AND s.user_id = :user_id)
+    ORDER BY id"""
+ACCESSIBLE_FORUMS = """
+    SELECT f.id FROM forums AS f
+    JOIN users_permissions AS p ON p.permission = 'forumaccess_forum_' || f.id
+    WHERE p.user_id = :user_id AND p.granted AND NOT f.deleted
+    ORDER BY f.id"""
+
+Request = Tuple[str, str, dict]
+
+
+class Sample(NamedTuple):
+    status: int
+    seconds: float
+    queries: int
+    cache_operations: int
+
+
+def _ids(statement: str) -> List[int]:
+    return [pk for pk, in db.session.execute(statement, {'user_id': 1})]
+
+
+def scenarios(rng: random.Random) -> Dict[str, List[Request]]:
+    """
+    Build the requests of each benchmarked endpoint, the first of which warms
+    it up. Reads are spread over the accessible forums and threads. Votes and
+    subscriptions each use a different poll or thread, as they can only
+    succeed once per user, so those endpoints get at most one request per
+    valid target and are skipped without two of them.
+    """
+    forum_ids = _ids(ACCESSIBLE_FORUMS)
+    thread_ids = _ids(ACCESSIBLE_THREADS)
+    choice_ids = _ids(OPEN_POLL_CHOICES)
+    unsubscribed = _ids(UNSUBSCRIBED_THREADS)
+    rng.shuffle(choice_ids)
+    rng.shuffle(unsubscribed)
+    numbers = range(REQUESTS + 1)
+    choice_ids = choice_ids[: len(numbers)]
+    unsubscribed = unsubscribed[: len(numbers)]
+
+    requests = {
+        'view_categories': [
+            ('GET', '/forums/categories', {}) for i in numbers
+        ],
+        'view_forum': [
+            (
+                'GET',
+                f'/forums/{rng.choice(forum_ids)}',
+                {'page': 1, 'limit': 50},
+            )
+            for i in numbers
+        ],
+        'view_thread': [
+            (
+                'GET',
+                f'/forums/threads/{rng.choice(thread_ids)}',
+                {'page': 1, 'limit': 50},
+            )
+            for i in numbers
+        ],
+        'create_post': [
+            (
+                'POST',
+                '/forums/posts',
+                {'thread_id': rng.choice(thread_ids), 'contents': f'Post {i}'},
+            )
+            for i in numbers
+        ],
+        'create_thread': [
+            (
+                'POST',
+                '/forums/threads',
+                {
+                    'forum_id': rng.choice(forum_ids),
+                    'topic': f'Thread {i}',
+                    'contents': f'Post {i}',
+                },
+            )
+            for i in numbers
+        ],
+        'vote_on_poll': [
+            ('POST', f'/polls/votes/{choice_id}', {})
+            for choice_id in choice_ids
+        ],
+        'subscribe_thread': [
+            ('POST', f'/subscriptions/threads/{thread_id}', {})
+            for thread_id in unsubscribed
+        ],
+        # Runs after subscribe_thread, so every thread is subscribed to.
+        'unsubscribe_thread': [
+            ('DELETE', f'/subscriptions/threads/{thread_id}', {})
+            for thread_id in unsubscribed
+        ],
+        'view_thread_subscriptions': [
+            ('GET', '/subscriptions/threads', {}) for i in numbers
+        ],
+        'view_forum_subscriptions': [
+            ('GET', '/subscriptions/forums', {}) for i in numbers
+        ],
+    }
+    return {name: r for name, r in requests.items() if len(r) > 1}
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """
+    :return: The nearest-rank percentile of the values
+    """
+    ordered = sorted(values)
+    return ordered[max(math.ceil(len(ordered) * percent / 100) - 1, 0)]
+
+
+def measure(client, request: Request) -> Sample:
+    method, path, data = request
+    with Counter() as counter:
+        start = time.perf_counter()
+        if method == 'GET':
+            response = client.get(path, query_string=data)
+        else:
+            response = client.open(path, method=method, data=json.dumps(data))
+        seconds = time.perf_counter() - start
+    return Sample(
+        response.status_code,
+        seconds,
+        len(counter.statements),
+        len(counter.cache_calls),
+    )
+
+
+def summarize(samples: List[Sample]) -> dict:
+    milliseconds = [s.seconds * 1000 for s in samples]
+    statuses: Dict[str, int] = {}
+    for sample in samples:
+        statuses[str(sample.status)] = statuses.get(str(sample.status), 0) + 1
+    return {
+        'requests': len(samples),
+        'statuses': statuses,
+        'p50_ms': percentile(milliseconds, 50),
+        'p95_ms': percentile(milliseconds, 95),
+        'p99_ms': percentile(milliseconds, 99),
+        'queries': sum(s.queries for s in samples) / len(samples),
+        'max_queries': max(s.queries for s in samples),
+        'cache_operations': sum(s.cache_operations for s in samples)
+        / len(samples),
+    }
+
+
+def report(results: Dict[str, dict]) -> None:
+    print(
+        f'\n{"endpoint":<27} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} '
+        f'{"queries":>8} {"cache ops":>10}  statuses'
+    )
+    for name, r in results.items():
+        print(
+            f'{name:<27} {r["p50_ms"]:>8.2f} {r["p95_ms"]:>8.2f} '
+            f'{r["p99_ms"]:>8.2f} {r["queries"]:>8.1f} '
+            f'{r["cache_operations"]:>10.1f}  {r["statuses"]}'
+        )
+
+
+def save(results: Dict[str, dict]) -> str:
+    now = datetime.utcnow()
+    path = os.environ.get('BENCHMARK_OUTPUT') or os.path.join(
+        RESULTS_DIRECTORY, f'endpoints-{now:%Y%m%dT%H%M%S}.json'
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(
+            {
+                'time': now.isoformat(),
+                'sizes': ForumsGenerator.sizes,
+                'endpoints': results,
+            },
+            f,
+            indent=2,
+        )
+    return path
+
+
+def test_endpoints(app, authed_client):
+    add_permissions(
+        app,
+        'forums_view',
+        'forums_posts_create',
+        'forums_threads_create',
+        'forums_polls_vote',
+        'forums_subscriptions_modify',
+        'forums_view_subscriptions',
+    )
+    rng = random.Random(0)
+    results = {}
+    failed = {}
+    for name, requests in scenarios(rng).items():
+        samples = [measure(authed_client, r) for r in requests]
+        results[name] = summarize(samples[1:])  # The first warms up.
+        statuses = [s.status for s in samples if not 200 <= s.status < 300]
+        if statuses:
+            failed[name] = statuses
+    report(results)
+    # Error responses would time the error paths instead of the endpoints.
+    assert not failed, f'Requests failed: {failed}'
+    print(f'Saved the results to {save(results)}.')
@@ -1,7 +1,12 @@
 from werkzeug import find_modules, import_string
 
 from forums import routes
+from forums.commands import forums_cli
+from forums.metrics import instrument
 from forums.modifications import modify_core
+from forums.profiling import instrument_profiling
+from forums.search import MemorySearchBackend, set_search_backend
+from forums.slow_queries import SLOW_QUERY_SECONDS, slow_queries
 
 
 def init_app(app):
@@ -9,6 +14,16 @@ def init_app(app):
         for name in find_modules('forums', recursive=True):
             import_string(name)
         app.register_blueprint(routes.bp)
+    instrument(app, routes.bp)
+    instrument_profiling(app, routes.bp)
+    slow_queries.threshold = app.config.get(
+        'FORUMS_SLOW_QUERY_SECONDS', SLOW_QUERY_SECONDS
+    )
+    app.cli.add_command(forums_cli)
+    if app.config.get('FORUMS_SEARCH_BACKEND') == 'memory':
+        backend = MemorySearchBackend()
+        set_search_backend(backend)
+        app.before_first_request(backend.load)
 
 
 modify_core()
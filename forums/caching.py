@@ -0,0 +1,705 @@
+import copy
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Pattern,
+    Tuple,
+)
+
+import flask
+from sqlalchemy import event
+
+from core import cache, db
+from forums.codec import decode_ids, encode_ids, is_encoded
+
+GENERATION_KEY = 'forums_local_cache_generation'
+INVALIDATIONS_KEY = 'forums_invalidations'
+
+# Cached in place of the ID of a row that does not exist, so that absent rows
+# are distinguishable from cache misses. IDs start at 1, so 0 is never a real
+# one. Negative entries expire on their own in case a row is created by a path
+# that does not invalidate them.
+NOT_FOUND = 0
+NOT_FOUND_TIMEOUT = 60 * 10
+
+CHUNK_SIZE = 1000
+
+
+def key_pattern(template: str) -> Pattern:
+    """
+    Compile a cache key template, such as ``forums_{id}_thread_count``, into a
+    regular expression that matches the keys formatted from it.
+
+    :param template: The cache key template
+    :return:         The compiled pattern
+    """
+    escaped = re.escape(template)
+    return re.compile('^' + re.sub(r'\\{\w+\\}', r'\\d+', escaped) + '$')
+
+
+class KeyFamilies:
+    """
+    A set of cache key templates, which handles the keys formatted from them.
+    """
+
+    def __init__(self, templates: Iterable[str] = ()) -> None:
+        self.patterns: List[Pattern] = []
+        self.register(*templates)
+
+    def register(self, *templates: str) -> None:
+        self.patterns += [key_pattern(t) for t in templates]
+
+    def handles(self, key: str) -> bool:
+        return any(p.match(key) for p in self.patterns)
+
+
+class CacheTier(KeyFamilies):
+    """
+    A layer consulted before the shared cache. Tiers see every read and write of
+    the keys they handle, and can answer reads without a round trip.
+    """
+
+    backend: SimpleNamespace
+
+    def lookup(self, key: str) -> Tuple[bool, Any]:
+        return False, None
+
+    def fill(self, key: str, value: Any) -> None:
+        """Called with values read from the shared cache."""
+
+    def miss(self, key: str) -> Tuple[bool, Any]:
+        """Called when a key is absent from the shared cache."""
+        return False, None
+
+    def retire(self, keys: Iterable[str]) -> None:
+        """Called before keys are deleted from the shared cache."""
+
+    def write(self, key: str, value: Any) -> None:
+        """Called after a value is written to the shared cache."""
+
+    def invalidate(self, keys: Iterable[str]) -> None:
+        """Called after keys are deleted from the shared cache."""
+
+    def clear(self) -> None:
+        """Called when the shared cache is cleared."""
+
+
+class LocalCache(CacheTier):
+    """
+    A bounded, per-process LRU cache for rarely-changing keys. Entries expire after
+    a short timeout. Deleting a handled key bumps a generation counter in the
+    shared cache; other processes notice the new generation at most
+    ``check_interval`` seconds later and drop their entries. Writes only replace
+    the local entry, as changed values are deleted before they are rewritten.
+    """
+
+    def __init__(
+        self,
+        templates: Iterable[str] = (),
+        maxsize: int = 1024,
+        timeout: float = 10,
+        check_interval: float = 1,
+    ) -> None:
+        super().__init__(templates)
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[str, Tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = None
+        self._checked_at = 0.0
+
+    def lookup(self, key: str) -> Tuple[bool, Any]:
+        if not self.handles(key):
+            return False, None
+        self._check_generation()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)  # type: ignore
+            self.hits += 1
+        return True, copy.copy(entry[1])
+
+    def fill(self, key: str, value: Any) -> None:
+        if not self.handles(key):
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.timeout, value)
+            self._entries.move_to_end(key)  # type: ignore
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)  # type: ignore
+
+    def write(self, key: str, value: Any) -> None:
+        self.fill(key, value)
+
+    def invalidate(self, keys: Iterable[str]) -> None:
+        keys = [k for k in keys if self.handles(k)]
+        if not keys:
+            return
+        previous = self._generation
+        generation = self.backend.inc(GENERATION_KEY)
+        with self._lock:
+            if previous is None or generation != previous + 1:
+                # Another process bumped the generation since the last check.
+                self._entries.clear()
+            else:
+                for key in keys:
+                    self._entries.pop(key, None)
+        self._generation = generation
+        self._checked_at = time.monotonic()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        self._generation = None
+        self._checked_at = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': len(self._entries),
+        }
+
+    def _check_generation(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        generation = self.backend.get(GENERATION_KEY)
+        if generation != self._generation:
+            with self._lock:
+                self._entries.clear()
+            self._generation = generation
+
+
+class RequestCache(CacheTier):
+    """
+    A request-local copy of the cached row data of models. Every handled key is
+    read from the shared cache and unpickled at most once per request; later
+    lookups of the same object, such as the user of many posts, are served from
+    the request. Instances are still built per lookup, so callers never share
+    them. Outside of a request this tier does nothing.
+    """
+
+    environ_key = 'forums.request_cache'
+
+    def lookup(self, key: str) -> Tuple[bool, Any]:
+        entries = self._entries()
+        if entries is None or key not in entries:
+            return False, None
+        return True, copy.copy(entries[key])
+
+    def fill(self, key: str, value: Any) -> None:
+        entries = self._entries()
+        if entries is not None and self.handles(key):
+            entries[key] = value
+
+    def write(self, key: str, value: Any) -> None:
+        self.fill(key, value)
+
+    def invalidate(self, keys: Iterable[str]) -> None:
+        entries = self._entries()
+        if entries is not None:
+            for key in keys:
+                entries.pop(key, None)
+
+    def clear(self) -> None:
+        entries = self._entries()
+        if entries is not None:
+            entries.clear()
+
+    def _entries(self) -> Optional[Dict[str, Any]]:
+        if not flask.has_request_context():
+            return None
+        return flask.request.environ.setdefault(self.environ_key, {})
+
+
+class SingleFlight(CacheTier):
+    """
+    Protects hot, expensive keys from cache stampedes. When such a key is deleted,
+    its last value is kept as a stale copy for a short while. On a miss, only the
+    reader that acquires a short lock rebuilds the value; concurrent readers are
+    served the stale copy, or wait briefly for the rebuilt value if there is none.
+    Writing the rebuilt value releases the lock.
+    """
+
+    def __init__(
+        self,
+        templates: Iterable[str] = (),
+        lock_timeout: int = 5,
+        stale_timeout: int = 60,
+        wait: float = 0.5,
+        poll_interval: float = 0.05,
+    ) -> None:
+        super().__init__(templates)
+        self.lock_timeout = lock_timeout
+        self.stale_timeout = stale_timeout
+        self.wait = wait
+        self.poll_interval = poll_interval
+
+    def miss(self, key: str) -> Tuple[bool, Any]:
+        if not self.handles(key):
+            return False, None
+        if self.backend.add(f'{key}_lock', 1, timeout=self.lock_timeout):
+            return False, None  # This reader rebuilds the value.
+        stale = self.backend.get(f'{key}_stale')
+        if stale is not None:
+            return True, stale
+        deadline = time.monotonic() + self.wait
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            value = self.backend.get(key)
+            if value is not None:
+                return True, value
+        return False, None
+
+    def retire(self, keys: Iterable[str]) -> None:
+        keys = [k for k in keys if self.handles(k)]
+        if keys:
+            self.backend.set_many(
+                {
+                    f'{key}_stale': value
+                    for key, value in zip(keys, self.backend.get_many(*keys))
+                    if value is not None
+                },
+                timeout=self.stale_timeout,
+            )
+
+    def write(self, key: str, value: Any) -> None:
+        if self.handles(key):
+            self.backend.delete(f'{key}_lock')
+
+
+class CacheMetrics:
+    """
+    Counters of the shared cache's traffic, grouped by the key template each key
+    was formatted from. Keys that match no registered template are counted under
+    ``other``. Hits answered by a tier before the shared cache are counted as
+    ``tier_hits``, and ``seconds`` is the time spent waiting on the shared cache.
+    ``bytes`` estimates the size of the values written: encoded values are
+    measured as they are, while values the backend pickles are only pickled for
+    one write in ``sample_rate`` of each family, and counted for all of them.
+    Observers are called with the key, event and seconds of every call recorded.
+    """
+
+    fields = ('hits', 'tier_hits', 'misses', 'sets', 'deletes', 'bytes')
+    sample_rate = 16
+
+    def __init__(self, templates: Iterable[str] = ()) -> None:
+        self.templates: List[str] = []
+        self._pattern: Optional[Pattern] = None
+        self._families: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self.observers: List[Callable[[str, str, float], None]] = []
+        self.register(*templates)
+
+    def register(self, *templates: str) -> None:
+        self.templates += [t for t in templates if t not in self.templates]
+        self._pattern = re.compile(
+            '|'.join(
+                f'(?P<t{i}>{key_pattern(t).pattern})'
+                for i, t in enumerate(self.templates)
+            )
+        )
+
+    def handles(self, key: str) -> bool:
+        return bool(self.templates) and self._pattern.match(key) is not None
+
+    def family(self, key: str) -> str:
+        match = self._pattern.match(key) if self.templates else None
+        if match is None:
+            return 'other'
+        return self.templates[int(match.lastgroup[1:])]
+
+    def record(
+        self, key: str, event: str, size: int = 0, seconds: float = 0.0
+    ) -> None:
+        family = self.family(key)
+        with self._lock:
+            counters = self._families.get(family)
+            if counters is None:
+                counters = self._families[family] = dict.fromkeys(
+                    self.fields + ('seconds',), 0
+                )
+            counters[event] += 1
+            counters['bytes'] += size
+            counters['seconds'] += seconds
+        for observer in self.observers:
+            observer(key, event, seconds)
+
+    def record_write(
+        self, key: str, stored: Any, seconds: float = 0.0
+    ) -> None:
+        """
+        Record a write to the shared cache.
+
+        :param key:     The key written
+        :param stored:  The value as it was passed to the shared cache
+        :param seconds: The time spent waiting on the shared cache
+        """
+        if isinstance(stored, bytes):
+            size = len(stored)
+        else:
+            counters = self._families.get(self.family(key))
+            sets = counters['sets'] if counters else 0
+            size = (
+                0
+                if sets % self.sample_rate
+                else len(pickle.dumps(stored, pickle.HIGHEST_PROTOCOL))
+                * self.sample_rate
+            )
+        self.record(key, 'sets', size=size, seconds=seconds)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {f: dict(c) for f, c in self._families.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._families.clear()
+
+
+class IdListCodec(KeyFamilies):
+    """
+    Stores the id lists of the key families it handles in the shared cache with
+    the compact encoding of ``forums.codec``. Values that are not lists of ids,
+    such as lists of strings, are stored as they are.
+    """
+
+    def encode(self, key: str, value: Any) -> Any:
+        if self.handles(key):
+            encoded = encode_ids(value)
+            if encoded is not None:
+                return encoded
+        return value
+
+    def decode(self, value: Any) -> Any:
+        return decode_ids(value) if is_encoded(value) else value
+
+
+request_cache = RequestCache()
+local_cache = LocalCache()
+single_flight = SingleFlight()
+cache_metrics = CacheMetrics()
+id_lists = IdListCodec()
+
+
+def install_tiers(tiers: List[CacheTier]) -> None:
+    """
+    Route the reads and writes of the shared cache through the given tiers,
+    ordered from the closest (consulted first) to the furthest. Only the keys of
+    the families registered in ``cache_metrics`` are routed; other keys, such as
+    those of core, reach the shared cache directly. Every routed call that
+    reaches the shared cache is recorded in ``cache_metrics``, and id lists are
+    stored in the shared cache encoded by ``id_lists``; tiers only see decoded
+    values.
+
+    :param tiers: The cache tiers to install
+    """
+    backend = SimpleNamespace(
+        get=cache.get,
+        get_many=cache.get_many,
+        set=cache.set,
+        set_many=cache.set_many,
+        delete=cache.delete,
+        delete_many=cache.delete_many,
+        add=cache.add,
+        inc=cache.inc,
+        clear=cache.clear,
+    )
+    for tier in tiers:
+        tier.backend = backend
+
+    def lookup(key: str) -> Tuple[bool, Any]:
+        for i, tier in enumerate(tiers):
+            found, value = tier.lookup(key)
+            if found:
+                for closer in tiers[:i]:
+                    closer.fill(key, value)
+                return True, value
+        return False, None
+
+    def fill(key: str, value: Any) -> Any:
+        if value is None:
+            for tier in tiers:
+                found, value = tier.miss(key)
+                if found:
+                    return id_lists.decode(value)
+            return None
+        for tier in tiers:
+            tier.fill(key, value)
+        return value
+
+    def read(key: str, value: Any, seconds: float) -> Any:
+        cache_metrics.record(
+            key, 'misses' if value is None else 'hits', seconds=seconds
+        )
+        return fill(key, id_lists.decode(value))
+
+    def written(key: str, value: Any, stored: Any, seconds: float) -> None:
+        cache_metrics.record_write(key, stored, seconds=seconds)
+        for tier in tiers:
+            tier.write(key, value)
+
+    def get(key: str) -> Any:
+        if not cache_metrics.handles(key):
+            return backend.get(key)
+        found, value = lookup(key)
+        if found:
+            cache_metrics.record(key, 'tier_hits')
+            return value
+        start = time.perf_counter()
+        value = backend.get(key)
+        return read(key, value, time.perf_counter() - start)
+
+    def get_many(*keys: str) -> List[Any]:
+        values: Dict[str, Any] = {}
+        routed = {k for k in keys if cache_metrics.handles(k)}
+        for key in routed:
+            found, value = lookup(key)
+            if found:
+                cache_metrics.record(key, 'tier_hits')
+                values[key] = value
+        missing = [k for k in keys if k not in values]
+        if missing:
+            start = time.perf_counter()
+            fetched = backend.get_many(*missing)
+            seconds = (time.perf_counter() - start) / len(missing)
+            for key, value in zip(missing, fetched):
+                values[key] = (
+                    read(key, value, seconds) if key in routed else value
+                )
+        return [values[k] for k in keys]
+
+    def set(key: str, value: Any, timeout: int = None) -> bool:
+        if not cache_metrics.handles(key):
+            return backend.set(key, value, timeout=timeout)
+        stored = id_lists.encode(key, value)
+        start = time.perf_counter()
+        result = backend.set(key, stored, timeout=timeout)
+        written(key, value, stored, time.perf_counter() - start)
+        return result
+
+    def set_many(mapping: Dict[str, Any], timeout: int = None) -> bool:
+        encoded = {k: id_lists.encode(k, v) for k, v in mapping.items()}
+        start = time.perf_counter()
+        result = backend.set_many(encoded, timeout=timeout)
+        seconds = (time.perf_counter() - start) / max(len(mapping), 1)
+        for key, value in mapping.items():
+            if cache_metrics.handles(key):
+                written(key, value, encoded[key], seconds)
+        return result
+
+    def delete(key: str) -> bool:
+        return delete_many(key)
+
+    def delete_many(*keys: str) -> bool:
+        routed = [k for k in keys if cache_metrics.handles(k)]
+        for tier in tiers:
+            tier.retire(routed)
+        start = time.perf_counter()
+        result = backend.delete_many(*keys)
+        seconds = (time.perf_counter() - start) / max(len(keys), 1)
+        for key in routed:
+            cache_metrics.record(key, 'deletes', seconds=seconds)
+        for tier in tiers:
+            tier.invalidate(routed)
+        return result
+
+    def clear() -> bool:
+        result = backend.clear()
+        for tier in tiers:
+            tier.clear()
+        return result
+
+    cache.get = get
+    cache.get_many = get_many
+    cache.set = set
+    cache.set_many = set_many
+    cache.delete = delete
+    cache.delete_many = delete_many
+    cache.clear = clear
+
+
+def invalidate(*keys: str) -> None:
+    """
+    Queue cache keys for deletion when the current transaction commits. The keys
+    queued during a transaction are deleted together with one ``delete_many`` after
+    the commit succeeds, and are dropped if the transaction is rolled back, so
+    readers cannot repopulate the cache with data from before the commit.
+
+    :param keys: The cache keys to delete
+    """
+    db.session.info.setdefault(INVALIDATIONS_KEY, set()).update(keys)
+
+
+def _delete_invalidated_keys(session) -> None:
+    keys = session.info.pop(INVALIDATIONS_KEY, None)
+    if keys:
+        cache.delete_many(*keys)
+
+
+def _drop_invalidated_keys(session, previous_transaction) -> None:
+    # Rolling back a savepoint leaves the enclosing transaction, and the keys
+    # it queued, in place.
+    if previous_transaction.parent is None:
+        session.info.pop(INVALIDATIONS_KEY, None)
+
+
+def listen_for_invalidations() -> None:
+    event.listen(db.session, 'after_commit', _delete_invalidated_keys)
+    event.listen(db.session, 'after_soft_rollback', _drop_invalidated_keys)
+
+
+class ChunkedIdList:
+    """
+    An ascending list of ids cached in fixed-size chunks, so that paging fetches
+    only the chunks it needs and appending an id touches only the tail. The header
+    holds the number of ids in full chunks and their boundaries: chunk ``i`` holds
+    the ids from ``boundaries[i]`` up to ``boundaries[i + 1]``, and the tail holds
+    the ids from the last boundary onwards. Once the tail outgrows a chunk, it is
+    split when it is next rebuilt. Removing an id shifts the positions of every
+    later id, so the header must be deleted with it; a refetched chunk that no
+    longer fills up rebuilds the whole list as well.
+    """
+
+    def __init__(
+        self,
+        *,
+        key: str,
+        chunk_key: str,
+        tail_key: str,
+        query: Callable[[int, Optional[int]], List[int]],
+        chunk_size: int = CHUNK_SIZE,
+    ) -> None:
+        """
+        :param key:        The cache key of the header
+        :param chunk_key:  The cache key of a chunk, formatted with ``chunk``
+        :param tail_key:   The cache key of the tail
+        :param query:      Returns the ascending ids from an inclusive lower
+                           bound up to an optional exclusive upper bound
+        :param chunk_size: The number of ids in a full chunk
+        """
+        self.key = key
+        self.chunk_key = chunk_key
+        self.tail_key = tail_key
+        self.query = query
+        self.chunk_size = chunk_size
+
+    def slice(self, start: int, stop: int) -> List[int]:
+        """
+        Get the ids between two positions of the list.
+
+        :param start: The position of the first id
+        :param stop:  The position after the last id
+        :return:      The ids between the positions
+        """
+        if stop <= start:
+            return []
+        offset, ids = self._read(
+            start // self.chunk_size, (stop - 1) // self.chunk_size
+        )
+        return ids[start - offset : stop - offset]
+
+    def all(self) -> List[int]:
+        """
+        :return: Every id of the list
+        """
+        return self._read(0, None)[1]
+
+    def _read(self, first: int, last: Optional[int]) -> Tuple[int, List[int]]:
+        """
+        Read the chunks between two chunk indexes; indexes past the full chunks
+        are served by the tail.
+
+        :return: The position of the first id read, and the ids
+        """
+        header = cache.get(self.key)
+        if not isinstance(header, dict):
+            return 0, self._build()
+        boundaries = header['boundaries']
+        full = len(boundaries) - 1
+        first = min(first, full)
+        last = full if last is None else last
+        ids: List[int] = []
+        indexes = list(range(first, min(last + 1, full)))
+        chunks = self._chunks(boundaries, indexes)
+        if chunks is None:
+            return 0, self._build()
+        for chunk in chunks:
+            ids.extend(chunk)
+        if last >= full:
+            ids.extend(self._tail(boundaries))
+        return first * self.chunk_size, ids
+
+    def _chunks(
+        self, boundaries: List[int], indexes: List[int]
+    ) -> Optional[List[list]]:
+        """
+        :return: The chunks, or ``None`` if a refetched chunk is no longer full
+        """
+        keys = [self.chunk_key.format(chunk=i) for i in indexes]
+        chunks = cache.get_many(*keys) if keys else []
+        missing = {}
+        for i, (index, chunk) in enumerate(zip(indexes, chunks)):
+            if chunk is None:
+                lower, upper = boundaries[index], boundaries[index + 1]
+                chunk = self.query(lower, upper)
+                if len(chunk) != self.chunk_size:
+                    return None
+                chunks[i] = missing[keys[i]] = chunk
+        if missing:
+            cache.set_many(missing)
+        return chunks
+
+    def _tail(self, boundaries: List[int]) -> List[int]:
+        ids = cache.get(self.tail_key)
+        if ids is None:
+            ids = self.query(boundaries[-1], None)
+            self._store(boundaries, ids)
+        return ids
+
+    def _build(self) -> List[int]:
+        ids = self.query(0, None)
+        self._store([0], ids, new=True)
+        return ids
+
+    def _store(
+        self, boundaries: List[int], ids: List[int], new: bool = False
+    ) -> None:
+        """
+        Cache the ids that follow the last boundary, splitting full chunks off
+        them. The header is only rewritten when it is new or gains chunks.
+        """
+        boundaries = list(boundaries)
+        mapping: Dict[str, Any] = {}
+        full = len(ids) // self.chunk_size
+        for i in range(full):
+            chunk = ids[i * self.chunk_size : (i + 1) * self.chunk_size]
+            mapping[self.chunk_key.format(chunk=len(boundaries) - 1)] = chunk
+            boundaries.append(chunk[-1] + 1)
+        mapping[self.tail_key] = ids[full * self.chunk_size :]
+        if new or full:
+            mapping[self.key] = {
+                'count': (len(boundaries) - 1) * self.chunk_size,
+                'boundaries': boundaries,
+            }
+        cache.set_many(mapping)
@@ -0,0 +1,70 @@
+import operator
+import struct
+import sys
+from array import array
+from itertools import accumulate, chain, islice
+from typing import Any, List, Optional
+
+MAGIC = b'\x00id'
+DELTA = b'd'
+ABSOLUTE = b'a'
+
+# Magic, mode, array typecode, and the first id of a delta-encoded list.
+HEADER = struct.Struct('<3sccQ')
+
+# The narrowest array typecode of each item size, from smallest to largest.
+TYPECODES = sorted({array(t).itemsize: t for t in 'QLIHB'}.items())
+
+
+def encode_ids(ids: Any) -> Optional[bytes]:
+    """
+    Encode a list of non-negative integers into a compact binary string. Sorted
+    lists are stored as the differences between consecutive ids, which usually
+    fit in one or two bytes; other lists are stored as they are. Either way, the
+    values are packed into an array of the narrowest item size that fits them.
+
+    :param ids: The list to encode
+    :return:    The encoded list, or ``None`` if the value cannot be encoded
+    """
+    if (
+        not isinstance(ids, list)
+        or not ids
+        or not all(type(i) is int for i in ids)
+        or min(ids) < 0
+        or max(ids) >> 64
+    ):
+        return None
+    deltas = list(map(operator.sub, islice(ids, 1, None), ids))
+    if all(d >= 0 for d in deltas):
+        mode, first, values = DELTA, ids[0], deltas
+    else:
+        mode, first, values = ABSOLUTE, 0, ids
+    largest = max(values, default=0)
+    typecode = next(t for s, t in TYPECODES if largest < 1 << (8 * s))
+    packed = array(typecode, values)
+    if sys.byteorder == 'big':  # pragma: no cover
+        packed.byteswap()
+    return (
+        HEADER.pack(MAGIC, mode, typecode.encode(), first) + packed.tobytes()
+    )
+
+
+def decode_ids(data: bytes) -> List[int]:
+    """
+    Decode a list of ids encoded with ``encode_ids``.
+
+    :param data: The encoded list
+    :return:     The list of ids
+    """
+    _, mode, typecode, first = HEADER.unpack_from(data)
+    values = array(typecode.decode())
+    values.frombytes(memoryview(data)[HEADER.size :])
+    if sys.byteorder == 'big':  # pragma: no cover
+        values.byteswap()
+    if mode == DELTA:
+        return list(accumulate(chain((first,), values)))
+    return values.tolist()
+
+
+def is_encoded(value: Any) -> bool:
+    return isinstance(value, bytes) and value[:3] == MAGIC
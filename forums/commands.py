@@ -0,0 +1,251 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List
+
+import click
+import flask
+from flask.cli import AppGroup, with_appcontext
+from sqlalchemy import func
+
+from core import cache, db
+from core.users.models import User
+from forums.models import (
+    Forum,
+    ForumCategory,
+    ForumPost,
+    ForumThread,
+    ForumUserStats,
+)
+from forums.search import BACKFILL_CHECKPOINT_KEY, backfill_posts
+from forums.test_data import ForumsGenerator
+
+forums_cli = AppGroup('forums', help='Forums maintenance commands.')
+
+
+@forums_cli.command('recompute-stats')
+@click.option(
+    '--chunk-size',
+    default=1000,
+    show_default=True,
+    help='Number of users recounted per statement.',
+)
+@with_appcontext
+def recompute_stats(chunk_size: int) -> None:
+    """
+    Recount the forum post and thread counts of every user. This repairs
+    the counters kept in the forums_users_stats table.
+    """
+    last_id = 0
+    recomputed = 0
+    while True:
+        user_ids = [
+            user_id
+            for user_id, in db.session.query(User.id)
+            .filter(User.id > last_id)
+            .order_by(User.id.asc())
+            .limit(chunk_size)
+        ]
+        if not user_ids:
+            break
+        ForumUserStats.recompute(user_ids)
+        db.session.commit()
+        last_id = user_ids[-1]
+        recomputed += len(user_ids)
+        click.echo(f'Recomputed forum stats of {recomputed} users.')
+
+
+@forums_cli.command('search-backfill')
+@click.option(
+    '--chunk-size',
+    default=1000,
+    show_default=True,
+    help='Number of posts indexed per transaction.',
+)
+@click.option(
+    '--restart', is_flag=True, help='Ignore the saved progress and start over.'
+)
+@with_appcontext
+def search_backfill(chunk_size: int, restart: bool) -> None:
+    """
+    Index the search documents of every post, in ID order. Progress is saved
+    after each chunk, so an interrupted backfill resumes where it stopped.
+    """
+    last_id = 0 if restart else cache.get(BACKFILL_CHECKPOINT_KEY) or 0
+    if last_id:
+        click.echo(f'Resuming after post {last_id}.')
+    while True:
+        indexed_id = backfill_posts(last_id, limit=chunk_size)
+        if indexed_id is None:
+            break
+        db.session.commit()
+        last_id = indexed_id
+        cache.set(BACKFILL_CHECKPOINT_KEY, last_id, timeout=0)
+        click.echo(f'Indexed posts up to {last_id}.')
+    cache.delete(BACKFILL_CHECKPOINT_KEY)
+    click.echo('Search backfill complete.')
+
+
+@forums_cli.command('generate')
+@click.option('--categories', default=10, show_default=True)
+@click.option('--forums', default=100, show_default=True)
+@click.option('--threads', default=100_000, show_default=True)
+@click.option('--posts', default=1_000_000, show_default=True)
+@click.option(
+    '--seed', default=0, show_default=True, help='Seed of the generator.'
+)
+@with_appcontext
+def generate(
+    categories: int, forums: int, threads: int, posts: int, seed: int
+) -> None:
+    """
+    Generate a large forum for the existing users, for benchmarks and local
+    testing. The same options always generate the same forum. Run
+    search-backfill and recompute-stats afterwards, and flush the cache.
+    """
+    try:
+        ForumsGenerator.generate(
+            categories=categories,
+            forums=forums,
+            threads=threads,
+            posts=posts,
+            seed=seed,
+            progress=click.echo,
+        )
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    db.session.commit()
+    click.echo('Generation complete.')
+
+
+@forums_cli.command('warmup')
+@click.option(
+    '--top-forums',
+    default=10,
+    show_default=True,
+    help='Number of the busiest forums to preload thread pages of.',
+)
+@click.option(
+    '--top-threads',
+    default=50,
+    show_default=True,
+    help='Number of the busiest threads to preload post pages of.',
+)
+@click.option(
+    '--pages', default=2, show_default=True, help='Pages to preload per list.'
+)
+@click.option(
+    '--workers', default=4, show_default=True, help='Parallel workers.'
+)
+@with_appcontext
+def warmup(
+    top_forums: int, top_threads: int, pages: int, workers: int
+) -> None:
+    """
+    Preload the cache after a deploy or cache flush: the category tree, every
+    forum with its thread count and last updated thread, and the first pages
+    of the busiest forums and threads.
+    """
+    click.echo('Loading forum categories.')
+    ForumCategory.get_all()
+
+    thread_counts = _count_by(
+        ForumThread.forum_id,
+        ForumThread.id,
+        ForumThread.deleted == 'f',
+        Forum.__cache_key_thread_count__,
+    )
+    forum_ids = [
+        forum_id
+        for forum_id, in db.session.query(Forum.id).filter(
+            Forum.deleted == 'f'
+        )
+    ]
+    Forum.get_many(pks=forum_ids)
+    cache.set_many(
+        {
+            Forum.__cache_key_thread_count__.format(id=fid): 0
+            for fid in forum_ids
+            if fid not in thread_counts
+        }
+    )
+    click.echo(f'Loaded {len(forum_ids)} forums and their thread counts.')
+
+    last_updated = dict(
+        db.session.query(ForumThread.forum_id, ForumThread.id)
+        .filter(ForumThread.forum_id.in_(forum_ids))
+        .distinct(ForumThread.forum_id)
+        .order_by(ForumThread.forum_id, ForumThread.last_updated.desc())
+    )
+    ForumThread.get_many(pks=list(last_updated.values()))
+    cache.set_many(
+        {
+            Forum.__cache_key_last_updated__.format(id=fid): tid
+            for fid, tid in last_updated.items()
+        }
+    )
+    click.echo(
+        f'Loaded the last updated threads of {len(last_updated)} forums.'
+    )
+
+    post_counts = _count_by(
+        ForumPost.thread_id,
+        ForumPost.id,
+        ForumPost.deleted == 'f',
+        ForumThread.__cache_key_post_count__,
+        limit=top_threads,
+    )
+    busiest_forums = sorted(
+        thread_counts, key=thread_counts.__getitem__, reverse=True
+    )[:top_forums]
+
+    tasks: List[Callable] = [
+        (lambda fid=fid, page=page: ForumThread.from_forum(fid, page))
+        for fid in busiest_forums
+        for page in range(1, pages + 1)
+    ]
+    tasks += [
+        (lambda tid=tid, page=page: ForumPost.from_thread(tid, page))
+        for tid in post_counts
+        for page in range(1, pages + 1)
+    ]
+    _run_in_parallel(tasks, workers)
+
+
+def _count_by(
+    group: db.Column, counted: db.Column, filter, key: str, limit: int = None
+) -> Dict[int, int]:
+    """
+    Count rows grouped by a column in one query, largest groups first, and
+    cache each count under the given key template.
+    """
+    query = (
+        db.session.query(group, func.count(counted))
+        .filter(filter)
+        .group_by(group)
+        .order_by(func.count(counted).desc())
+    )
+    if limit is not None:
+        query = query.limit(limit)
+    counts = dict(query.all())
+    cache.set_many({key.format(id=id_): c for id_, c in counts.items()})
+    return counts
+
+
+def _run_in_parallel(tasks: List[Callable], workers: int) -> None:
+    """
+    Run the tasks in a bounded pool of threads, each inside its own application
+    context. Tasks run without a user, as the cache is shared by all users.
+    """
+    app = flask.current_app._get_current_object()
+
+    def run(task: Callable) -> None:
+        with app.app_context():
+            flask.g.user = None
+            task()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run, task) for task in tasks]
+        with click.progressbar(
+            as_completed(futures), length=len(futures), label='Preloading'
+        ) as completed:
+            for future in completed:
+                future.result()
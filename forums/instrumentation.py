@@ -0,0 +1,193 @@
+import itertools
+import threading
+import time
+from collections import deque
+from functools import wraps
+from json import JSONEncoder
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple, Type
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from forums.caching import cache_metrics
+
+STATEMENT_STARTS_KEY = 'forums_statement_starts'
+
+# Called with the statement, parameters, executemany flag and duration of
+# every SQL statement.
+statement_observers: List[Callable[[str, Any, bool, float], None]] = []
+
+_local = threading.local()
+
+
+class Counter:
+    """
+    Counts the SQL statements and shared cache calls made in the current thread
+    while it is active, such as during a request, and the time spent on SQL, on
+    the shared cache and on JSON serialization. The time spent in the functions
+    decorated with ``timed`` is collected by phase. Counters can be nested; each
+    counts every call made while it is active.
+
+    With ``keep_calls``, the statements and the events and keys of the cache
+    calls are also listed, to report what a block did. Counters on the request
+    path only need the numbers, and leave it off.
+    """
+
+    def __init__(self, keep_calls: bool = True) -> None:
+        self.keep_calls = keep_calls
+        self.statement_count = 0
+        self.cache_call_count = 0
+        self.statements: List[str] = []
+        self.cache_calls: List[Tuple[str, str]] = []
+        self.sql_seconds = 0.0
+        self.cache_seconds = 0.0
+        self.serialization_seconds = 0.0
+        self.phases: Dict[str, float] = {}
+
+    def __enter__(self) -> 'Counter':
+        _active().append(self)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        _active().remove(self)
+
+
+class ReportBuffer:
+    """
+    A ring buffer of the latest reports of this worker process, such as request
+    profiles. Each report is given an increasing ID.
+    """
+
+    def __init__(self, size: int) -> None:
+        self._reports: Deque[dict] = deque(maxlen=size)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def add(self, report: dict) -> int:
+        with self._lock:
+            report['id'] = next(self._ids)
+            self._reports.append(report)
+            return report['id']
+
+    def get(self, id: int) -> Optional[dict]:
+        with self._lock:
+            return next((r for r in self._reports if r['id'] == id), None)
+
+    def all(self) -> List[dict]:
+        """
+        :return: The reports, newest first
+        """
+        with self._lock:
+            return list(reversed(self._reports))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._reports.clear()
+
+
+def timed(phase: str) -> Callable[[Callable], Callable]:
+    """
+    Decorate a function to count the time spent in it in the active counters,
+    under the given phase. Without active counters, it only costs a lookup.
+
+    :param phase: The name of the phase
+    :return:      The decorator
+    """
+
+    def decorator(function: Callable) -> Callable:
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            counters = _active()
+            if not counters:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                for counter in counters:
+                    counter.phases[phase] = (
+                        counter.phases.get(phase, 0.0) + seconds
+                    )
+
+        return wrapper
+
+    return decorator
+
+
+def timed_json_encoder(encoder: Type[JSONEncoder]) -> Type[JSONEncoder]:
+    """
+    Subclass a JSON encoder to count the time spent encoding in the active
+    counters. The time spent serializing objects, such as models, into JSON
+    types is also counted as the ``serialization`` phase.
+
+    :param encoder: The JSON encoder to subclass
+    :return:        The timed JSON encoder
+    """
+
+    class TimedJSONEncoder(encoder):  # type: ignore
+        default = timed('serialization')(encoder.default)
+
+        def encode(self, o: Any) -> str:
+            start = time.perf_counter()
+            try:
+                return super().encode(o)
+            finally:
+                seconds = time.perf_counter() - start
+                for counter in _active():
+                    counter.serialization_seconds += seconds
+
+    return TimedJSONEncoder
+
+
+def _active() -> List[Counter]:
+    try:
+        return _local.counters
+    except AttributeError:
+        _local.counters = []
+        return _local.counters
+
+
+def _start_statement(
+    connection, cursor, statement, parameters, context, executemany
+) -> None:
+    connection.info.setdefault(STATEMENT_STARTS_KEY, []).append(
+        time.perf_counter()
+    )
+    for counter in _active():
+        counter.statement_count += 1
+        if counter.keep_calls:
+            counter.statements.append(statement)
+
+
+def _finish_statement(
+    connection, cursor, statement, parameters, context, executemany
+) -> None:
+    starts = connection.info.get(STATEMENT_STARTS_KEY)
+    if starts:
+        seconds = time.perf_counter() - starts.pop()
+        for counter in _active():
+            counter.sql_seconds += seconds
+        for observer in statement_observers:
+            observer(statement, parameters, executemany, seconds)
+
+
+def _fail_statement(context) -> None:
+    starts = context.connection.info.get(STATEMENT_STARTS_KEY)
+    if starts:
+        starts.pop()
+
+
+def _count_cache_call(key: str, event: str, seconds: float) -> None:
+    for counter in _active():
+        counter.cache_call_count += 1
+        counter.cache_seconds += seconds
+        if counter.keep_calls:
+            counter.cache_calls.append((event, key))
+
+
+def listen_for_counts() -> None:
+    event.listen(Engine, 'before_cursor_execute', _start_statement)
+    event.listen(Engine, 'after_cursor_execute', _finish_statement)
+    event.listen(Engine, 'handle_error', _fail_statement)
+    cache_metrics.observers.append(_count_cache_call)
@@ -0,0 +1,216 @@
+import threading
+import time
+from bisect import bisect_left
+from functools import partial
+from typing import Dict, Iterable, List, Tuple
+
+import flask
+
+from forums.caching import cache_metrics
+from forums.instrumentation import Counter, timed_json_encoder
+
+# The upper bounds of the latency histogram buckets, in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """
+    A Prometheus histogram of observations, grouped by their labels.
+    """
+
+    def __init__(
+        self, name: str, help: str, buckets: Tuple[float, ...] = BUCKETS
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series: Dict[Labels, List[float]] = {}
+
+    def observe(self, labels: Labels, value: float) -> None:
+        """
+        Record an observation. Not thread-safe; the caller holds a lock.
+
+        :param labels: The label names and values of the observation
+        :param value:  The observed value
+        """
+        series = self._series.get(labels)
+        if series is None:
+            # A count per bucket and the +Inf bucket, then the sum.
+            series = self._series[labels] = [0.0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, series in sorted(self._series.items()):
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                yield (
+                    f'{self.name}_bucket'
+                    f'{_labels(labels + (("le", str(bound)),))} '
+                    f'{cumulative:g}'
+                )
+            yield f'{self.name}_sum{_labels(labels)} {series[-1]!r}'
+            yield f'{self.name}_count{_labels(labels)} {cumulative:g}'
+
+    def reset(self) -> None:
+        self._series.clear()
+
+
+class RequestMetrics:
+    """
+    Latency histograms of the requests to a blueprint, by endpoint and status:
+    the total time, and the time spent on SQL, on the shared cache and on JSON
+    serialization, along with the number of SQL statements and cache calls.
+    """
+
+    def __init__(self) -> None:
+        self.histograms = {
+            'total': Histogram(
+                'forums_request_seconds', 'Forum request latency.'
+            ),
+            'sql': Histogram(
+                'forums_request_sql_seconds',
+                'Time spent on SQL statements per forum request.',
+            ),
+            'cache': Histogram(
+                'forums_request_cache_seconds',
+                'Time spent on the shared cache per forum request.',
+            ),
+            'serialization': Histogram(
+                'forums_request_serialization_seconds',
+                'Time spent serializing responses per forum request.',
+            ),
+        }
+        self.statements: Dict[Labels, int] = {}
+        self.cache_calls: Dict[Labels, int] = {}
+        self._lock = threading.Lock()
+
+    def observe(
+        self, endpoint: str, status: int, seconds: float, counter: Counter
+    ) -> None:
+        labels = (('endpoint', endpoint), ('status', str(status)))
+        with self._lock:
+            self.histograms['total'].observe(labels, seconds)
+            self.histograms['sql'].observe(labels, counter.sql_seconds)
+            self.histograms['cache'].observe(labels, counter.cache_seconds)
+            self.histograms['serialization'].observe(
+                labels, counter.serialization_seconds
+            )
+            self.statements[labels] = (
+                self.statements.get(labels, 0) + counter.statement_count
+            )
+            self.cache_calls[labels] = (
+                self.cache_calls.get(labels, 0) + counter.cache_call_count
+            )
+
+    def render(self) -> str:
+        """
+        :return: The metrics, and the cache traffic of ``cache_metrics``, in
+                 the Prometheus text format
+        """
+        lines: List[str] = []
+        with self._lock:
+            for histogram in self.histograms.values():
+                lines += histogram.render()
+            lines += _counter(
+                'forums_request_sql_statements_total',
+                'SQL statements of forum requests.',
+                self.statements,
+            )
+            lines += _counter(
+                'forums_request_cache_calls_total',
+                'Shared cache calls of forum requests.',
+                self.cache_calls,
+            )
+        lines += _counter(
+            'forums_cache_calls_total',
+            'Shared cache calls, by key template and event.',
+            {
+                (('family', family), ('event', event)): counters[event]
+                for family, counters in cache_metrics.snapshot().items()
+                for event in ('hits', 'tier_hits', 'misses', 'sets', 'deletes')
+            },
+        )
+        return '\n'.join(lines) + '\n'
+
+    def reset(self) -> None:
+        with self._lock:
+            for histogram in self.histograms.values():
+                histogram.reset()
+            self.statements.clear()
+            self.cache_calls.clear()
+
+
+request_metrics = RequestMetrics()
+
+
+def instrument(app: flask.Flask, blueprint: flask.Blueprint) -> None:
+    """
+    Record the metrics of every request to a blueprint in ``request_metrics``.
+    Time spent in ``before_request`` functions registered earlier, such as
+    authentication, is not included. Instrumenting a blueprint of an application
+    again does nothing.
+
+    :param app:       The application, whose JSON encoder is timed
+    :param blueprint: The blueprint to instrument
+    """
+    instrumented = app.extensions.setdefault('forums_metrics', set())
+    if blueprint.name in instrumented:
+        return
+    if not instrumented:
+        app.json_encoder = timed_json_encoder(app.json_encoder)
+    instrumented.add(blueprint.name)
+    app.before_request(partial(_start_request, blueprint.name))
+    app.after_request(partial(_finish_request, blueprint.name))
+    app.teardown_request(_stop_counting)
+
+
+def _start_request(blueprint: str) -> None:
+    if flask.request.blueprint == blueprint:
+        flask.g.forums_counter = Counter(keep_calls=False).__enter__()
+        flask.g.forums_request_start = time.perf_counter()
+
+
+def _finish_request(
+    blueprint: str, response: flask.Response
+) -> flask.Response:
+    counter = flask.g.get('forums_counter')
+    if counter is not None and flask.request.blueprint == blueprint:
+        request_metrics.observe(
+            flask.request.endpoint,
+            response.status_code,
+            time.perf_counter() - flask.g.forums_request_start,
+            counter,
+        )
+    return response
+
+
+def _stop_counting(exception: BaseException = None) -> None:
+    counter = flask.g.pop('forums_counter', None)
+    if counter is not None:
+        counter.__exit__(None, None, None)
+
+
+def _labels(labels: Labels) -> str:
+    escaped = (
+        (
+            name,
+            value.replace('\\', r'\\')
+            .replace('"', r'\"')
+            .replace('\n', r'\n'),
+        )
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{n}="{v}"' for n, v in escaped) + '}'
+
+
+def _counter(name: str, help: str, values: Dict[Labels, int]) -> List[str]:
+    return [f'# HELP {name} {help}', f'# TYPE {name} counter'] + [
+        f'{name}{_labels(labels)} {value}'
+        for labels, value in sorted(values.items())
+    ]
@@ -1,8 +1,9 @@
 from datetime import datetime
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Union
 
 import flask
-from sqlalchemy import and_, func, select
+from sqlalchemy import DDL, and_, event, func, inspect, literal, select
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.sql.elements import BinaryExpression
@@ -12,6 +13,12 @@ from core.mixins import MultiPKMixin, SinglePKMixin
 from core.permissions.models import UserPermission
 from core.users.models import User
 from core.utils import cached_property
+from forums.caching import (
+    NOT_FOUND,
+    NOT_FOUND_TIMEOUT,
+    ChunkedIdList,
+    invalidate,
+)
 from forums.notifications import (
     check_post_contents_for_mentions,
     check_post_contents_for_quotes,
@@ -116,7 +123,7 @@ class Forum(db.Model, SinglePKMixin):
         position: int = 0,
     ) -> Optional['Forum']:
         ForumCategory.is_valid(category_id, error=True)
-        cache.delete(cls.__cache_key_of_category__.format(id=category_id))
+        invalidate(cls.__cache_key_of_category__.format(id=category_id))
         return super()._new(
             name=name,
             category_id=category_id,
@@ -236,7 +243,19 @@ class ForumThread(db.Model, SinglePKMixin):
 
     @declared_attr
     def __table_args__(cls):
-        return (db.Index('ix_forums_threads_topic', func.lower(cls.topic)),)
+        return (
+            db.Index(
+                'ix_forums_threads_topic',
+                func.lower(cls.topic).label('lower_topic'),
+                postgresql_ops={'lower_topic': 'text_pattern_ops'},
+            ),
+            db.Index(
+                'ix_forums_threads_topic_trgm',
+                cls.topic,
+                postgresql_using='gin',
+                postgresql_ops={'topic': 'gin_trgm_ops'},
+            ),
+        )
 
     @classmethod
     def from_forum(
@@ -261,7 +280,8 @@ class ForumThread(db.Model, SinglePKMixin):
     ) -> Optional['ForumThread']:
         Forum.is_valid(forum_id, error=True)
         User.is_valid(creator_id, error=True)
-        cache.delete(cls.__cache_key_of_forum__.format(id=forum_id))
+        invalidate(cls.__cache_key_of_forum__.format(id=forum_id))
+        ForumUserStats.adjust(creator_id, threads=1)
         thread = super()._new(
             topic=topic, forum_id=forum_id, creator_id=creator_id
         )
@@ -406,11 +426,21 @@ class ForumThread(db.Model, SinglePKMixin):
         return False
 
 
+# The trigram index on thread topics needs the pg_trgm extension.
+event.listen(
+    ForumThread.__table__,
+    'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm'),
+)
+
+
 class ForumPost(db.Model, SinglePKMixin):
     __tablename__ = 'forums_posts'
     __serializer__ = ForumPostSerializer
     __cache_key__ = 'forums_posts_{id}'
     __cache_key_of_thread__ = 'forums_posts_threads_{id}'
+    __cache_key_of_thread_chunk__ = 'forums_posts_threads_{id}_chunk_{chunk}'
+    __cache_key_of_thread_tail__ = 'forums_posts_threads_{id}_tail'
     __deletion_attr__ = 'deleted'
 
     id: int = db.Column(db.Integer, primary_key=True)
@@ -444,21 +474,56 @@ class ForumPost(db.Model, SinglePKMixin):
         limit: int = 50,
         include_dead: bool = False,
     ) -> List['ForumPost']:
-        return cls.get_many(
-            key=cls.__cache_key_of_thread__.format(id=thread_id),
-            filter=cls.thread_id == thread_id,
-            order=cls.id.asc(),  # type: ignore
-            page=page,
-            limit=limit,
-            include_dead=include_dead,
-        )
+        if include_dead:
+            pks = [
+                pk
+                for pk, in db.session.query(cls.id)
+                .filter(cls.thread_id == thread_id)
+                .order_by(cls.id.asc())
+                .offset((page - 1) * limit)
+                .limit(limit)
+            ]
+        else:
+            pks = cls.thread_id_list(thread_id).slice(
+                (page - 1) * limit, page * limit
+            )
+        if not pks:
+            return []
+        return cls.get_many(pks=pks, include_dead=include_dead)
 
     @classmethod
     def get_ids_from_thread(cls, id):
-        return cls.get_pks_of_many(
-            key=cls.__cache_key_of_thread__.format(id=id),
-            filter=cls.thread_id == id,
-            order=cls.id.asc(),
+        return cls.thread_id_list(id).all()
+
+    @classmethod
+    def thread_id_list(cls, thread_id: int) -> ChunkedIdList:
+        """
+        The ids of a thread's live posts, cached in chunks so that paging through
+        a long thread does not fetch every id. Deleted posts are left out, so that
+        pages stay full; pages including them are queried directly.
+
+        :param thread_id: The ID of the thread
+        :return:          The chunked id list of the thread
+        """
+
+        def query(lower: int, upper: Optional[int]) -> List[int]:
+            filter = and_(
+                cls.thread_id == thread_id, cls.deleted == 'f', cls.id >= lower
+            )
+            if upper is not None:
+                filter = and_(filter, cls.id < upper)
+            rows = (
+                db.session.query(cls.id).filter(filter).order_by(cls.id.asc())
+            )
+            return [pk for pk, in rows]
+
+        return ChunkedIdList(
+            key=cls.__cache_key_of_thread__.format(id=thread_id),
+            chunk_key=cls.__cache_key_of_thread_chunk__.format(
+                id=thread_id, chunk='{chunk}'
+            ),
+            tail_key=cls.__cache_key_of_thread_tail__.format(id=thread_id),
+            query=query,
         )
 
     @classmethod
@@ -467,7 +532,8 @@ class ForumPost(db.Model, SinglePKMixin):
     ) -> Optional['ForumPost']:
         ForumThread.is_valid(thread_id, error=True)
         User.is_valid(user_id, error=True)
-        cache.delete(cls.__cache_key_of_thread__.format(id=thread_id))
+        invalidate(cls.__cache_key_of_thread_tail__.format(id=thread_id))
+        ForumUserStats.adjust(user_id, posts=1)
         post = super()._new(
             thread_id=thread_id, user_id=user_id, contents=contents
         )
@@ -493,6 +559,29 @@ class ForumPost(db.Model, SinglePKMixin):
         return ForumPostEditHistory.from_post(self.id)
 
 
+def _invalidate_thread_post_ids(mapper, connection, post: ForumPost) -> None:
+    """Drop a thread's cached post ids when one of its posts is (un)deleted."""
+    history = inspect(post).attrs.deleted.history
+    if history.added and history.added != history.deleted:
+        invalidate(ForumPost.__cache_key_of_thread__.format(id=post.thread_id))
+
+
+event.listen(ForumPost, 'after_update', _invalidate_thread_post_ids)
+
+# The search document of a post is kept out of the mapped table, so that
+# loading and caching posts never carries it. It is maintained by
+# ``forums.search`` and only read by search queries.
+event.listen(
+    ForumPost.__table__,
+    'after_create',
+    DDL(
+        'ALTER TABLE forums_posts ADD COLUMN search_document tsvector; '
+        'CREATE INDEX ix_forums_posts_search_document ON forums_posts '
+        'USING gin (search_document)'
+    ),
+)
+
+
 class ForumPostEditHistory(db.Model, SinglePKMixin):
     __tablename__ = 'forums_posts_edit_history'
     __serializer__ = ForumPostEditHistorySerializer
@@ -523,7 +612,7 @@ class ForumPostEditHistory(db.Model, SinglePKMixin):
     ) -> Optional[ForumPost]:
         ForumPost.is_valid(post_id, error=True)
         User.is_valid(editor_id, error=True)
-        cache.delete(cls.__cache_key_of_post__.format(id=post_id))
+        invalidate(cls.__cache_key_of_post__.format(id=post_id))
         return super()._new(
             post_id=post_id, editor_id=editor_id, contents=contents, time=time
         )
@@ -551,15 +640,15 @@ class ForumLastViewedPost(db.Model):
             thread_id=thread_id, user_id=user_id
         )
         post_id = cache.get(cache_key)
-        if not post_id:
+        if post_id == NOT_FOUND:
+            return None
+        if post_id is None:
             last_viewed = cls.query.filter(
                 and_((cls.thread_id == thread_id), (cls.user_id == user_id))
             ).scalar()
             post_id = last_viewed.post_id if last_viewed else None
         post = ForumPost.from_pk(post_id, include_dead=True)
-        if not post:
-            return None
-        if post.deleted:  # Get the last non-deleted and read post.
+        if post and post.deleted:  # Get the last non-deleted and read post.
             post = ForumPost.from_query(
                 filter=and_(
                     (ForumPost.thread_id == thread_id),
@@ -568,7 +657,10 @@ class ForumLastViewedPost(db.Model):
                 ),
                 order=ForumPost.id.desc(),
             )  # type: ignore
-        cache.set(cache_key, post.id if post else None)
+        if not post:
+            cache.set(cache_key, NOT_FOUND, timeout=NOT_FOUND_TIMEOUT)
+            return None
+        cache.set(cache_key, post.id)
         return post
 
 
@@ -590,8 +682,10 @@ class ForumSubscription(db.Model, MultiPKMixin):
     ) -> Optional['ForumSubscription']:
         Forum.is_valid(forum_id, error=True)
         User.is_valid(user_id, error=True)
-        cache.delete(cls.__cache_key_users__.format(forum_id=forum_id))
-        cache.delete(cls.__cache_key_of_user__.format(user_id=user_id))
+        invalidate(
+            cls.__cache_key_users__.format(forum_id=forum_id),
+            cls.__cache_key_of_user__.format(user_id=user_id),
+        )
         return super()._new(user_id=user_id, forum_id=forum_id)
 
     @classmethod
@@ -621,8 +715,10 @@ class ForumThreadSubscription(db.Model, MultiPKMixin):
     ) -> Optional['ForumThreadSubscription']:
         ForumThread.is_valid(thread_id, error=True)
         User.is_valid(user_id, error=True)
-        cache.delete(cls.__cache_key_users__.format(thread_id=thread_id))
-        cache.delete(cls.__cache_key_of_user__.format(user_id=user_id))
+        invalidate(
+            cls.__cache_key_users__.format(thread_id=thread_id),
+            cls.__cache_key_of_user__.format(user_id=user_id),
+        )
         return super()._new(user_id=user_id, thread_id=thread_id)
 
     @classmethod
@@ -648,10 +744,10 @@ class ForumThreadSubscription(db.Model, MultiPKMixin):
             user_ids or []
         )  # Don't put a mutable object as default kwarg!
         if thread_id:
-            cache.delete(cls.__cache_key_users__.format(thread_id=thread_id))
+            invalidate(cls.__cache_key_users__.format(thread_id=thread_id))
             user_ids += cls.user_ids_from_thread(thread_id)
         if user_ids:
-            cache.delete_many(
+            invalidate(
                 *(
                     cls.__cache_key_of_user__.format(user_id=uid)
                     for uid in user_ids
@@ -705,6 +801,7 @@ class ForumPoll(db.Model, SinglePKMixin):
     __cache_key__ = 'forums_polls_{id}'
     __cache_key_featured__ = 'forums_polls_featured'
     __cache_key_of_thread__ = 'forums_polls_threads_{thread_id}'
+    __cache_key_results__ = 'forums_polls_{id}_results'
 
     id: int = db.Column(db.Integer, primary_key=True)
     thread_id: int = db.Column(
@@ -727,10 +824,20 @@ class ForumPoll(db.Model, SinglePKMixin):
 
     @classmethod
     def from_thread(cls, thread_id: int) -> Optional['ForumPoll']:
-        return cls.from_query(
-            key=cls.__cache_key_of_thread__.format(thread_id=thread_id),
-            filter=cls.thread_id == thread_id,
-        )
+        cache_key = cls.__cache_key_of_thread__.format(thread_id=thread_id)
+        poll_id = cache.get(cache_key)
+        if poll_id is None:
+            poll_id = db.session.query(cls.id).filter(
+                cls.thread_id == thread_id
+            ).scalar()
+            if poll_id is None:
+                poll_id = NOT_FOUND
+                cache.set(cache_key, poll_id, timeout=NOT_FOUND_TIMEOUT)
+            else:
+                cache.set(cache_key, poll_id)
+        if poll_id == NOT_FOUND:
+            return None
+        return cls.from_pk(poll_id)
 
     @classmethod
     def get_featured(cls) -> Optional['ForumPoll']:
@@ -741,6 +848,7 @@ class ForumPoll(db.Model, SinglePKMixin):
     @classmethod
     def new(cls, *, thread_id: int, question: str) -> 'ForumPoll':
         ForumThread.is_valid(thread_id, error=True)
+        invalidate(cls.__cache_key_of_thread__.format(thread_id=thread_id))
         return cls._new(thread_id=thread_id, question=question)
 
     @classmethod
@@ -748,17 +856,71 @@ class ForumPoll(db.Model, SinglePKMixin):
         poll = cls.get_featured()
         if poll:
             poll.featured = False
+            invalidate(cls.__cache_key_featured__)
             db.session.commit()
-            cache.delete(cls.__cache_key_featured__)
 
     @cached_property
-    def choices(self):
-        return ForumPollChoice.from_poll(self.id)
+    def choices(self) -> List['ForumPollChoice']:
+        choices = ForumPollChoice.from_poll(self.id)
+        if self.closed:
+            tallies = {c['id']: c['answers'] for c in self.results['choices']}
+            for choice in choices:
+                choice.answers = tallies.get(choice.id, 0)
+        else:
+            ForumPollChoice.populate_answers(choices)
+        return choices
+
+    @cached_property
+    def results(self) -> Optional[dict]:
+        """
+        The frozen results of a closed poll. Open polls have no results, as their
+        tallies can still change.
+        """
+        if not self.closed:
+            return None
+        results = cache.get(self.__cache_key_results__.format(id=self.id))
+        if results is None:
+            results = self.freeze_results()
+        return results
+
+    def freeze_results(self) -> dict:
+        """
+        Snapshot the question, choices, and tallies of the poll. As votes cannot be
+        cast on a closed poll, the snapshot is cached without a timeout.
+
+        :return: The results snapshot
+        """
+        choices = ForumPollChoice.from_poll(self.id)
+        ForumPollChoice.populate_answers(choices)
+        results = {
+            'question': self.question,
+            'choices': [
+                {'id': c.id, 'choice': c.choice, 'answers': c.answers}
+                for c in choices
+            ],
+            'total': sum(c.answers for c in choices),
+        }
+        cache.set(
+            self.__cache_key_results__.format(id=self.id), results, timeout=0
+        )
+        return results
+
+    def clear_results(self) -> None:
+        """Discard the results snapshot, e.g. after the poll is reopened."""
+        cache.delete(self.__cache_key_results__.format(id=self.id))
 
     @cached_property
     def thread(self):
         return ForumThread.from_pk(self.thread_id)
 
+    @cached_property
+    def voted_choice_id(self) -> Optional[int]:
+        return (
+            ForumPollAnswer.voted_choices(flask.g.user.id).get(self.id)
+            if flask.g.user
+            else None
+        )
+
     def can_access(self, permission: str = None, error: bool = False) -> bool:
         access = self.thread is not None
         if not access and error:
@@ -790,9 +952,39 @@ class ForumPollChoice(db.Model, SinglePKMixin):
     @classmethod
     def new(cls, *, poll_id: int, choice: str) -> 'ForumPollChoice':
         ForumPoll.is_valid(poll_id, error=True)
-        cache.delete(cls.__cache_key_of_poll__.format(poll_id=poll_id))
+        invalidate(cls.__cache_key_of_poll__.format(poll_id=poll_id))
         return cls._new(poll_id=poll_id, choice=choice)
 
+    @classmethod
+    def populate_answers(cls, choices: List['ForumPollChoice']) -> None:
+        """
+        Populate the ``answers`` property of many poll choices at once. Cached
+        tallies are fetched in one round trip, and if any of them are missing,
+        the tallies of every passed choice are counted in a single grouped query.
+
+        :param choices: The poll choices whose answer counts should be populated
+        """
+        if not choices:
+            return
+        keys = [cls.__cache_key_answers__.format(id=c.id) for c in choices]
+        tallies = cache.get_many(*keys)
+        if any(t is None for t in tallies):
+            counts = dict(
+                db.session.query(
+                    ForumPollAnswer.choice_id,
+                    func.count(ForumPollAnswer.user_id),
+                )
+                .filter(
+                    ForumPollAnswer.choice_id.in_([c.id for c in choices])
+                )
+                .group_by(ForumPollAnswer.choice_id)
+                .all()
+            )
+            tallies = [counts.get(c.id, 0) for c in choices]
+            cache.set_many(dict(zip(keys, tallies)))
+        for choice, answers in zip(choices, tallies):
+            choice.answers = answers
+
     @classmethod
     def is_valid_choice(
         cls, pk: int, poll_id: int, error: bool = False
@@ -819,17 +1011,10 @@ class ForumPollChoice(db.Model, SinglePKMixin):
             filter=ForumPollAnswer.choice_id == self.id,
         )
 
-    def delete_answers(self):
-        db.session.execute(
-            ForumPollAnswer.__table__.delete().where(
-                ForumPollAnswer.choice_id == self.id
-            )
-        )
-        cache.delete(self.__cache_key_answers__.format(id=self.id))
-
 
 class ForumPollAnswer(db.Model, MultiPKMixin):
     __tablename__ = 'forums_polls_answers'
+    __cache_key_of_user__ = 'forums_polls_answers_users_{user_id}'
 
     poll_id = db.Column(
         db.Integer, db.ForeignKey('forums_polls.id'), primary_key=True
@@ -851,7 +1036,182 @@ class ForumPollAnswer(db.Model, MultiPKMixin):
         if cls.from_attrs(poll_id=poll_id, user_id=user_id):
             raise APIException('You have already voted for this poll.')
 
-        cache.delete(
-            ForumPollChoice.__cache_key_answers__.format(id=choice_id)
+        invalidate(
+            ForumPollChoice.__cache_key_answers__.format(id=choice_id),
+            cls.__cache_key_of_user__.format(user_id=user_id),
         )
         return cls._new(poll_id=poll_id, user_id=user_id, choice_id=choice_id)
+
+    @classmethod
+    def voted_choices(cls, user_id: int) -> Dict[int, int]:
+        """
+        Get the polls a user has voted on, mapped to the choices they voted for.
+
+        :param user_id: The ID of the user
+        :return:        A dictionary of poll IDs to choice IDs
+        """
+        cache_key = cls.__cache_key_of_user__.format(user_id=user_id)
+        voted = cache.get(cache_key)
+        if voted is None:
+            voted = dict(
+                db.session.query(cls.poll_id, cls.choice_id).filter(
+                    cls.user_id == user_id
+                )
+            )
+            cache.set(cache_key, voted)
+        return voted
+
+    @classmethod
+    def vote(cls, *, user_id: int, choice_id: int) -> int:
+        """
+        Record a user's vote in a single statement. The choice and its poll are
+        loaded first, so that the user must be able to access the poll's thread.
+        The (poll_id, user_id) primary key rejects duplicate votes, so concurrent
+        requests cannot both succeed. Votes on closed polls are not inserted, as
+        their results are frozen. The poll is only looked up again when nothing
+        was inserted, to tell a poll closed in the meantime apart from a duplicate
+        vote.
+
+        :param user_id:   The ID of the voting user
+        :param choice_id: The ID of the poll choice being voted for
+        :return:          The ID of the poll that was voted on
+        :raises _403Exception: If the user cannot access the poll
+        :raises _404Exception: If the poll choice or poll does not exist
+        :raises APIException:  If the poll is closed or the user has already voted
+        """
+        choice = ForumPollChoice.from_pk(choice_id, _404=True)
+        poll = ForumPoll.from_pk(choice.poll_id, error=True, _404=True)
+        if poll.closed:
+            raise APIException('You cannot vote on a closed poll.')
+        choices = ForumPollChoice.__table__
+        polls = ForumPoll.__table__
+        inserted = db.session.execute(
+            insert(cls.__table__)
+            .from_select(
+                ['poll_id', 'user_id', 'choice_id'],
+                select([choices.c.poll_id, literal(user_id), choices.c.id])
+                .select_from(
+                    choices.join(polls, polls.c.id == choices.c.poll_id)
+                )
+                .where(and_(choices.c.id == choice_id, polls.c.closed == 'f')),
+            )
+            .on_conflict_do_nothing(index_elements=['poll_id', 'user_id'])
+        ).rowcount
+        if not inserted:
+            if db.session.query(ForumPoll.closed).filter(
+                ForumPoll.id == poll.id
+            ).scalar():
+                raise APIException('You cannot vote on a closed poll.')
+            raise APIException('You have already voted on this poll.')
+        invalidate(
+            ForumPollChoice.__cache_key_answers__.format(id=choice_id),
+            cls.__cache_key_of_user__.format(user_id=user_id),
+        )
+        db.session.commit()
+        return poll.id
+
+
+class ForumUserStats(db.Model):
+    __tablename__ = 'forums_users_stats'
+    __cache_key__ = 'forums_users_stats_{user_id}'
+
+    user_id: int = db.Column(
+        db.Integer, db.ForeignKey('users.id'), primary_key=True
+    )
+    post_count: int = db.Column(
+        db.Integer, nullable=False, server_default='0'
+    )
+    thread_count: int = db.Column(
+        db.Integer, nullable=False, server_default='0'
+    )
+
+    @classmethod
+    def from_user(cls, user_id: int) -> Dict[str, int]:
+        """
+        Get the forum post and thread counts of a user. If the user does not have
+        a stats row yet, the counts are read from the posts and threads tables
+        without creating one; rows are created by ``adjust`` and ``recompute``.
+
+        :param user_id: The ID of the user
+        :return:        A dictionary with ``post_count`` and ``thread_count`` keys
+        """
+        cache_key = cls.__cache_key__.format(user_id=user_id)
+        stats = cache.get(cache_key)
+        if stats is None:
+            row = db.session.execute(
+                select([cls.post_count, cls.thread_count]).where(
+                    cls.user_id == user_id
+                )
+            ).first()
+            if row is None:
+                row = db.session.execute(cls._counts([user_id])).first()
+            stats = {
+                'post_count': row.post_count if row else 0,
+                'thread_count': row.thread_count if row else 0,
+            }
+            cache.set(cache_key, stats)
+        return stats
+
+    @classmethod
+    def adjust(cls, user_id: int, posts: int = 0, threads: int = 0) -> None:
+        """
+        Increment or decrement the counters of a user inside the current transaction.
+        Users without a stats row get one computed first. The caller must call this
+        before the post or thread is inserted, and then commit.
+
+        :param user_id: The ID of the user
+        :param posts:   The change to the user's post count
+        :param threads: The change to the user's thread count
+        """
+        update = (
+            cls.__table__.update()
+            .where(cls.user_id == user_id)
+            .values(
+                post_count=cls.post_count + posts,
+                thread_count=cls.thread_count + threads,
+            )
+        )
+        if not db.session.execute(update).rowcount:
+            cls.recompute([user_id])
+            db.session.execute(update)
+        invalidate(cls.__cache_key__.format(user_id=user_id))
+
+    @classmethod
+    def recompute(cls, user_ids: List[int]) -> None:
+        """
+        Recount the posts and threads of many users in a single statement and
+        upsert their stats rows. This does not commit.
+
+        :param user_ids: The IDs of the users to recompute
+        """
+        if not user_ids:
+            return
+        stmt = insert(cls.__table__).from_select(
+            ['user_id', 'post_count', 'thread_count'], cls._counts(user_ids)
+        )
+        db.session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=['user_id'],
+                set_={
+                    'post_count': stmt.excluded.post_count,
+                    'thread_count': stmt.excluded.thread_count,
+                },
+            )
+        )
+        invalidate(
+            *(cls.__cache_key__.format(user_id=uid) for uid in user_ids)
+        )
+
+    @staticmethod
+    def _counts(user_ids: List[int]):
+        return select(
+            [
+                User.id,
+                select([func.count(ForumPost.id)])
+                .where(ForumPost.user_id == User.id)
+                .label('post_count'),
+                select([func.count(ForumThread.id)])
+                .where(ForumThread.creator_id == User.id)
+                .label('thread_count'),
+            ]
+        ).where(User.id.in_(user_ids))
@@ -7,25 +7,42 @@ from core.permissions import Permissions
 from core.users.models import User
 from core.users.serializers import UserSerializer
 from core.utils import cached_property
-from forums.models import ForumPost, ForumThread
+from forums import models
+from forums.caching import (
+    cache_metrics,
+    id_lists,
+    install_tiers,
+    listen_for_invalidations,
+    local_cache,
+    request_cache,
+    single_flight,
+)
+from forums.instrumentation import listen_for_counts, timed
+from forums.models import (
+    Forum,
+    ForumCategory,
+    ForumPoll,
+    ForumPollChoice,
+    ForumPost,
+    ForumPostEditHistory,
+    ForumSubscription,
+    ForumThread,
+    ForumThreadNote,
+    ForumThreadSubscription,
+    ForumUserStats,
+)
+from forums.search import listen_for_indexing
+from forums.slow_queries import listen_for_slow_queries
 
 
 @cached_property
 def forum_post_count(self) -> int:
-    return self.count(
-        key=self.__cache_key_forum_post_count__.format(id=self.id),
-        attribute=ForumPost.id,
-        filter=ForumPost.user_id == self.id,
-    )
+    return ForumUserStats.from_user(self.id)['post_count']
 
 
 @cached_property
 def forum_thread_count(self) -> int:
-    return self.count(
-        key=self.__cache_key_forum_thread_count__.format(id=self.id),
-        attribute=ForumThread.id,
-        filter=ForumThread.creator_id == self.id,
-    )
+    return ForumUserStats.from_user(self.id)['thread_count']
 
 
 @cached_property
@@ -35,11 +52,10 @@ def forum_permissions(self) -> Set[str]:
 
 def modify_core():
     User.assign_attrs(
-        __cache_key_forum_post_count__='users_{id}_forum_post_count',
-        __cache_key_forum_thread_count__='users_{id}_forum_thread_count',
         forum_thread_count=forum_thread_count,
         forum_post_count=forum_post_count,
         forum_permissions=forum_permissions,
+        has_permission=timed('permissions')(User.has_permission),
     )
     UserSerializer.assign_attrs(
         forum_permissions=Attribute(permission='users_moderate', nested=False)
@@ -52,3 +68,64 @@ def modify_core():
         'forums_posts_create',
         'forums_threads_create',
     ]
+    modify_cache()
+
+
+def modify_cache():
+    request_cache.register(
+        User.__cache_key__,
+        *(
+            model.__cache_key__
+            for model in (
+                ForumCategory,
+                Forum,
+                ForumThread,
+                ForumPost,
+                ForumPostEditHistory,
+                ForumThreadNote,
+                ForumPoll,
+                ForumPollChoice,
+            )
+        ),
+    )
+    local_cache.register(
+        ForumCategory.__cache_key__,
+        ForumCategory.__cache_key_all__,
+        Forum.__cache_key__,
+        Forum.__cache_key_of_category__,
+        ForumPoll.__cache_key__,
+        ForumPoll.__cache_key_featured__,
+    )
+    single_flight.register(
+        ForumThread.__cache_key_of_forum__,
+        ForumPost.__cache_key_of_thread_tail__,
+    )
+    id_lists.register(
+        ForumCategory.__cache_key_all__,
+        Forum.__cache_key_of_category__,
+        ForumThread.__cache_key_of_forum__,
+        ForumPost.__cache_key_of_thread_chunk__,
+        ForumPost.__cache_key_of_thread_tail__,
+        ForumPostEditHistory.__cache_key_of_post__,
+        ForumSubscription.__cache_key_users__,
+        ForumSubscription.__cache_key_of_user__,
+        ForumThreadSubscription.__cache_key_users__,
+        ForumThreadSubscription.__cache_key_of_user__,
+        ForumThreadNote.__cache_key_of_thread__,
+        ForumPollChoice.__cache_key_of_poll__,
+    )
+    cache_metrics.register(
+        User.__cache_key__,
+        *(
+            template
+            for model in vars(models).values()
+            if isinstance(model, type) and model.__module__ == models.__name__
+            for name, template in vars(model).items()
+            if name.startswith('__cache_key') and isinstance(template, str)
+        ),
+    )
+    install_tiers([request_cache, local_cache, single_flight])
+    listen_for_invalidations()
+    listen_for_indexing()
+    listen_for_counts()
+    listen_for_slow_queries()
@@ -14,3 +14,6 @@ class ForumPermissions(PermissionsEnum):
     MODIFY_FORUMS = 'forums_forums_modify'
     MODIFY_POLLS = 'forums_polls_vote'
     VIEW_SUBSCRIPTIONS = 'forums_view_subscriptions'
+    VIEW_STATS = 'forums_view_stats'
+    PROFILE_REQUESTS = 'forums_profile_requests'
+    VIEW_SLOW_QUERIES = 'forums_view_slow_queries'
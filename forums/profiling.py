@@ -0,0 +1,101 @@
+import cProfile
+import io
+import pstats
+import time
+from datetime import datetime
+from functools import partial
+
+import flask
+
+from forums.instrumentation import Counter, ReportBuffer
+
+PROFILE_HEADER = 'X-Forums-Profile'
+PROFILE_ID_HEADER = 'X-Forums-Profile-Id'
+PROFILE_PERMISSION = 'forums_profile_requests'
+PROFILE_REPORTS = 20
+PROFILE_LINES = 60
+
+profile_reports = ReportBuffer(PROFILE_REPORTS)
+
+
+def instrument_profiling(app: flask.Flask, blueprint: flask.Blueprint) -> None:
+    """
+    Profile the requests to a blueprint sent with the ``X-Forums-Profile``
+    header by users with the ``forums_profile_requests`` permission. Each
+    request runs under ``cProfile``; its report is stored in
+    ``profile_reports``, and its ID returned in the ``X-Forums-Profile-Id``
+    response header. The header is ignored for other users. Instrumenting a
+    blueprint of an application again does nothing.
+
+    :param app:       The application
+    :param blueprint: The blueprint to profile
+    """
+    profiled = app.extensions.setdefault('forums_profiling', set())
+    if blueprint.name in profiled:
+        return
+    profiled.add(blueprint.name)
+    app.before_request(partial(_start_profile, blueprint.name))
+    app.after_request(_finish_profile)
+    app.teardown_request(_stop_profile)
+
+
+def _start_profile(blueprint: str) -> None:
+    if (
+        flask.request.blueprint != blueprint
+        or PROFILE_HEADER not in flask.request.headers
+    ):
+        return
+    user = flask.g.get('user')
+    if not user or not user.has_permission(PROFILE_PERMISSION):
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:  # Another profiler is active in this thread.
+        return
+    counter = Counter(keep_calls=False).__enter__()
+    flask.g.forums_profile = (profiler, counter, time.perf_counter())
+
+
+def _finish_profile(response: flask.Response) -> flask.Response:
+    state = flask.g.pop('forums_profile', None)
+    if state is None:
+        return response
+    profiler, counter, start = state
+    profiler.disable()
+    counter.__exit__(None, None, None)
+    seconds = time.perf_counter() - start
+
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats('cumulative').print_stats(PROFILE_LINES)
+    serialization = counter.phases.get('serialization', 0.0)
+    report = {
+        'endpoint': flask.request.endpoint,
+        'method': flask.request.method,
+        'path': flask.request.full_path,
+        'status': response.status_code,
+        'user_id': flask.g.user.id,
+        'time': datetime.utcnow().isoformat(),
+        'seconds': seconds,
+        'statements': counter.statement_count,
+        'cache_calls': counter.cache_call_count,
+        'phases': {
+            'permissions': counter.phases.get('permissions', 0.0),
+            'sql': counter.sql_seconds,
+            'cache': counter.cache_seconds,
+            'serialization': serialization,
+            'json_encode': counter.serialization_seconds - serialization,
+        },
+        'stats': stream.getvalue(),
+    }
+    response.headers[PROFILE_ID_HEADER] = str(profile_reports.add(report))
+    return response
+
+
+def _stop_profile(exception: BaseException = None) -> None:
+    state = flask.g.pop('forums_profile', None)
+    if state is not None:
+        profiler, counter, _ = state
+        profiler.disable()
+        counter.__exit__(None, None, None)
@@ -8,6 +8,7 @@ from core import db
 from core.utils import require_permission, validate_data
 from core.validators import BoolGET
 from forums.models import Forum, ForumCategory, ForumThread
+from forums.search import index_threads
 
 from . import bp
 
@@ -222,7 +223,8 @@ def delete_forum(id: int) -> flask.Response:
     """
     forum = Forum.from_pk(id, _404=True)
     forum.deleted = True
-    ForumThread.update_many(
-        pks=ForumThread.get_ids_from_forum(forum.id), update={'deleted': True}
-    )
+    thread_ids = ForumThread.get_ids_from_forum(forum.id)
+    ForumThread.update_many(pks=thread_ids, update={'deleted': True})
+    index_threads(*thread_ids)
+    db.session.commit()
     return flask.jsonify(f'Forum {id} ({forum.name}) has been deleted.')
@@ -3,9 +3,10 @@ from typing import Dict, List  # type: ignore
 import flask
 from voluptuous import Optional, Schema
 
-from core import APIException, cache, db
+from core import APIException, db
 from core.utils import require_permission, validate_data
 from core.validators import BoolGET
+from forums.caching import invalidate
 from forums.models import ForumPoll, ForumPollAnswer, ForumPollChoice
 
 from . import bp
@@ -114,6 +115,11 @@ def modify_poll(
     if choices:
         change_poll_choices(poll, choices['add'], choices['delete'])
     db.session.commit()
+    if closed is not None or choices:
+        if poll.closed:
+            poll.freeze_results()
+        else:
+            poll.clear_results()
     return flask.jsonify(poll)
 
 
@@ -122,11 +128,13 @@ def change_poll_choices(
 ) -> None:
     """
     Change the choices to a poll. Create new choices or delete existing ones.
-    The choices parameter should contain a dictionary of answer name keys and
-    their status as booleans. True = Add, False = Delete.
+    The deleted choices and their answers are removed with one statement each,
+    and the new choices are inserted in bulk. The changes are committed by the
+    caller.
 
-    :param poll:    The forum poll to alter
-    :param choices: The choices to edit
+    :param poll:   The forum poll to alter
+    :param add:    The names of the choices to add
+    :param delete: The IDs of the choices to delete
     """
     poll_choice_choices = {c.choice for c in poll.choices}
     poll_choice_ids = {c.id for c in poll.choices}
@@ -151,15 +159,42 @@ def change_poll_choices(
     if error_message:
         raise APIException(' '.join(error_message))
 
-    for choice in delete:
-        choice = ForumPollChoice.from_pk(choice)
-        choice.delete_answers()  # type: ignore
-        db.session.delete(choice)
-    for choice_new in add:
-        db.session.add(ForumPollChoice(poll_id=poll.id, choice=choice_new))
-    cache.delete(ForumPollChoice.__cache_key_of_poll__.format(poll_id=poll.id))
+    voter_ids: List[int] = []
+    if delete:
+        voter_ids = [
+            user_id
+            for user_id, in db.session.execute(
+                ForumPollAnswer.__table__.delete()
+                .where(ForumPollAnswer.choice_id.in_(delete))
+                .returning(ForumPollAnswer.user_id)
+            )
+        ]
+        db.session.execute(
+            ForumPollChoice.__table__.delete().where(
+                ForumPollChoice.id.in_(delete)
+            )
+        )
+    if add:
+        db.session.execute(
+            ForumPollChoice.__table__.insert(),
+            [{'poll_id': poll.id, 'choice': choice} for choice in add],
+        )
+    invalidate(
+        ForumPollChoice.__cache_key_of_poll__.format(poll_id=poll.id),
+        *(
+            key.format(id=choice_id)
+            for choice_id in delete
+            for key in (
+                ForumPollChoice.__cache_key__,
+                ForumPollChoice.__cache_key_answers__,
+            )
+        ),
+        *(
+            ForumPollAnswer.__cache_key_of_user__.format(user_id=user_id)
+            for user_id in voter_ids
+        ),
+    )
     poll.del_property_cache('choices')
-    db.session.commit()
 
 
 @bp.route('/polls/votes/<int:choice_id>', methods=['POST'])
@@ -184,16 +219,10 @@ def vote_on_poll(choice_id: int) -> flask.Response:
 
     :statuscode 200: Voting successful
     :statuscode 400: Voting unsuccessful
+    :statuscode 403: User does not have permission to view the poll
     :statuscode 404: Poll or poll choice
     """
-    choice = ForumPollChoice.from_pk(choice_id, _404=True)
-    if ForumPollAnswer.from_attrs(
-        poll_id=choice.poll.id, user_id=flask.g.user.id
-    ):
-        raise APIException('You have already voted on this poll.')
-    ForumPollAnswer.new(
-        poll_id=choice.poll.id, user_id=flask.g.user.id, choice_id=choice.id
-    )
+    ForumPollAnswer.vote(user_id=flask.g.user.id, choice_id=choice_id)
     return flask.jsonify(
-        f'You have successfully voted for choice {choice.id}.'
+        f'You have successfully voted for choice {choice_id}.'
     )
@@ -0,0 +1,139 @@
+import flask
+from voluptuous import All, In, Length, Range, Required, Schema
+
+from core.utils import require_permission, validate_data
+from forums.search import search_posts, search_threads
+
+from . import bp
+
+SEARCH_POSTS_SCHEMA = Schema(
+    {
+        Required('query'): All(str, Length(min=1, max=256)),
+        'forum_id': All(int, Range(min=0, max=2147483648)),
+        'thread_id': All(int, Range(min=0, max=2147483648)),
+        'user_id': All(int, Range(min=0, max=2147483648)),
+        'cursor': All(str, Length(max=64)),
+        'limit': All(int, In((10, 25, 50))),
+    }
+)
+
+
+@bp.route('/forums/search', methods=['GET'])
+@require_permission('forums_view')
+@validate_data(SEARCH_POSTS_SCHEMA)
+def search_forum_posts(
+    query: str,
+    forum_id: int = None,
+    thread_id: int = None,
+    user_id: int = None,
+    cursor: str = None,
+    limit: int = 25,
+) -> flask.Response:
+    """
+    This endpoint searches the contents of the forum posts the user can access.
+    Results are ordered by relevance; the ``cursor`` of a response fetches the
+    next page of results.
+
+    .. :quickref: ForumPost; Search forum posts.
+
+    **Example request**:
+
+    .. parsed-literal::
+
+       GET /forums/search?query=yacht%20funding&forum_id=5 HTTP/1.1
+       Host: pul.sar
+       Accept: application/json
+
+    **Example response**:
+
+    .. parsed-literal::
+
+       HTTP/1.1 200 OK
+       Vary: Accept
+       Content-Type: application/json
+
+       {
+         "status": "success",
+         "response": {
+           "results": [
+             {
+               "post": "<ForumPost>",
+               "rank": 0.1,
+               "snippet": "Since we need a new <mark>yacht</mark>!"
+             }
+           ],
+           "cursor": "0.1_4"
+         }
+       }
+
+    :>json dict response: The search results and the next page's cursor
+
+    :statuscode 200: Search successful
+    :statuscode 400: Invalid search parameters
+    :statuscode 403: User does not have permission to view forums
+    """
+    results, next_cursor = search_posts(
+        query,
+        forum_id=forum_id,
+        thread_id=thread_id,
+        user_id=user_id,
+        cursor=cursor,
+        limit=limit,
+    )
+    return flask.jsonify({'results': results, 'cursor': next_cursor})
+
+
+SEARCH_THREADS_SCHEMA = Schema(
+    {
+        Required('query'): All(str, Length(min=1, max=150)),
+        'mode': In(('prefix', 'fuzzy')),
+        'limit': All(int, In((10, 25, 50))),
+    }
+)
+
+
+@bp.route('/forums/search/threads', methods=['GET'])
+@require_permission('forums_view')
+@validate_data(SEARCH_THREADS_SCHEMA)
+def search_forum_threads(
+    query: str, mode: str = 'prefix', limit: int = 25
+) -> flask.Response:
+    """
+    This endpoint searches the topics of the forum threads the user can access.
+    The ``prefix`` mode matches topics starting with the query, and the ``fuzzy``
+    mode matches topics similar to the query, most similar first.
+
+    .. :quickref: ForumThread; Search forum thread topics.
+
+    **Example request**:
+
+    .. parsed-literal::
+
+       GET /forums/search/threads?query=donatoins&mode=fuzzy HTTP/1.1
+       Host: pul.sar
+       Accept: application/json
+
+    **Example response**:
+
+    .. parsed-literal::
+
+       HTTP/1.1 200 OK
+       Vary: Accept
+       Content-Type: application/json
+
+       {
+         "status": "success",
+         "response": [
+           "<ForumThread>"
+         ]
+       }
+
+    :>json list response: The matching forum threads
+
+    :statuscode 200: Search successful
+    :statuscode 400: Invalid search parameters
+    :statuscode 403: User does not have permission to view forums
+    """
+    return flask.jsonify(
+        search_threads(query, fuzzy=mode == 'fuzzy', limit=limit)
+    )
@@ -0,0 +1,260 @@
+import flask
+
+from core import _404Exception
+from core.utils import require_permission
+from forums.caching import cache_metrics, local_cache
+from forums.metrics import request_metrics
+from forums.profiling import profile_reports
+from forums.slow_queries import public, slow_queries
+
+from . import bp
+
+
+@bp.route('/forums/stats/cache', methods=['GET'])
+@require_permission('forums_view_stats')
+def view_cache_stats() -> flask.Response:
+    """
+    This endpoint shows the cache traffic of this worker process, grouped by
+    cache key template. The ``forums_view_stats`` permission is required to
+    access this endpoint.
+
+    .. :quickref: Stats; View forum cache statistics.
+
+    **Example response**:
+
+    .. parsed-literal::
+
+       {
+         "status": "success",
+         "response": {
+           "families": {
+             "forums_posts_threads_{id}": {
+               "hits": 1201,
+               "tier_hits": 0,
+               "misses": 12,
+               "sets": 12,
+               "deletes": 9,
+               "bytes": 40213,
+               "seconds": 0.731
+             }
+           },
+           "local_cache": {
+             "hits": 9210,
+             "misses": 311,
+             "hit_rate": 0.967,
+             "size": 45
+           }
+         }
+       }
+
+    :>json dict response: The cache statistics
+
+    :statuscode 200: View successful
+    :statuscode 403: User does not have permission to view statistics
+    """
+    return flask.jsonify(
+        {
+            'families': cache_metrics.snapshot(),
+            'local_cache': local_cache.stats(),
+        }
+    )
+
+
+@bp.route('/forums/stats/metrics', methods=['GET'])
+@require_permission('forums_view_stats')
+def view_metrics() -> flask.Response:
+    """
+    This endpoint shows the request latency histograms of this worker process,
+    by endpoint and status, in the Prometheus text format: the total time, and
+    the time spent on SQL, on the shared cache and on JSON serialization. The
+    ``forums_view_stats`` permission is required to access this endpoint.
+
+    .. :quickref: Stats; View forum request metrics.
+
+    **Example response**:
+
+    .. parsed-literal::
+
+       # HELP forums_request_seconds Forum request latency.
+       # TYPE forums_request_seconds histogram
+       forums_request_seconds_bucket{endpoint="forums.view_thread",status="200",le="0.005"} 0
+       forums_request_seconds_bucket{endpoint="forums.view_thread",status="200",le="0.01"} 12
+       ...
+       forums_request_seconds_sum{endpoint="forums.view_thread",status="200"} 0.341
+       forums_request_seconds_count{endpoint="forums.view_thread",status="200"} 40
+
+    :statuscode 200: View successful
+    :statuscode 403: User does not have permission to view statistics
+    """
+    return flask.Response(
+        request_metrics.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
+
+
+@bp.route('/forums/stats/profiles', methods=['GET'])
+@require_permission('forums_profile_requests')
+def view_profiles() -> flask.Response:
+    """
+    This endpoint lists the latest request profiles of this worker process,
+    newest first, without their profiler statistics. Requests to the forums
+    are profiled when sent with the ``X-Forums-Profile`` header by a user with
+    the ``forums_profile_requests`` permission, which is also required to
+    access this endpoint. Timings are inflated by the profiler's overhead, and
+    SQL and cache time spent while serializing also counts as serialization.
+
+    .. :quickref: Stats; View forum request profiles.
+
+    **Example response**:
+
+    .. parsed-literal::
+
+       {
+         "status": "success",
+         "response": [
+           {
+             "id": 3,
+             "endpoint": "forums.view_thread",
+             "method": "GET",
+             "path": "/forums/threads/1?page=2",
+             "status": 200,
+             "user_id": 1,
+             "time": "2019-04-01T12:00:00.000000",
+             "seconds": 0.213,
+             "statements": 9,
+             "cache_calls": 112,
+             "phases": {
+               "permissions": 0.002,
+               "sql": 0.041,
+               "cache": 0.018,
+               "serialization": 0.094,
+               "json_encode": 0.006
+             }
+           }
+         ]
+       }
+
+    :>json list response: The request profiles
+
+    :statuscode 200: View successful
+    :statuscode 403: User does not have permission to view profiles
+    """
+    return flask.jsonify(
+        [
+            {k: v for k, v in r.items() if k != 'stats'}
+            for r in profile_reports.all()
+        ]
+    )
+
+
+@bp.route('/forums/stats/profiles/<int:id>', methods=['GET'])
+@require_permission('forums_profile_requests')
+def view_profile(id: int) -> flask.Response:
+    """
+    This endpoint shows a request profile, with the ``cProfile`` statistics of
+    the request sorted by cumulative time. Its ID is returned in the
+    ``X-Forums-Profile-Id`` header of the profiled request.
+
+    .. :quickref: Stats; View a forum request profile.
+
+    **Example response**:
+
+    .. parsed-literal::
+
+       {
+         "status": "success",
+         "response": {
+           "id": 3,
+           "endpoint": "forums.view_thread",
+           "seconds": 0.213,
+           "phases": {"sql": 0.041},
+           "stats": "   48213 function calls (46001 primitive calls) ..."
+         }
+       }
+
+    :>json dict response: The request profile
+
+    :statuscode 200: View successful
+    :statuscode 403: User does not have permission to view profiles
+    :statuscode 404: The profile does not exist, or was dropped
+    """
+    report = profile_reports.get(id)
+    if report is None:
+        raise _404Exception
+    return flask.jsonify(report)
+
+
+@bp.route('/forums/stats/slow-queries', methods=['GET'])
+@require_permission('forums_view_slow_queries')
+def view_slow_queries() -> flask.Response:
+    """
+    This endpoint lists the latest SQL statements on forums tables of this
+    worker process that ran slower than the ``FORUMS_SLOW_QUERY_SECONDS``
+    setting, newest first, with the model method that ran them. The ``forums_view_slow_queries``
+    permission is required to access this endpoint.
+
+    .. :quickref: Stats; View slow forum queries.
+
+    **Example response**:
+
+    .. parsed-literal::
+
+       {
+         "status": "success",
+         "response": [
+           {
+             "id": 12,
+             "sql": "SELECT forums_threads.id FROM forums_threads WHERE ...",
+             "parameters": "{'forum_id_1': 4}",
+             "executemany": false,
+             "seconds": 0.812,
+             "caller": "ForumThread.from_forum (forums/models.py:301)",
+             "time": "2019-04-01T12:00:00.000000",
+             "explain": null
+           }
+         ]
+       }
+
+    :>json list response: The slow queries
+
+    :statuscode 200: View successful
+    :statuscode 403: User does not have permission to view slow queries
+    """
+    return flask.jsonify([public(q) for q in slow_queries.queries.all()])
+
+
+@bp.route('/forums/stats/slow-queries/<int:id>/explain', methods=['POST'])
+@require_permission('forums_view_slow_queries')
+def explain_slow_query(id: int) -> flask.Response:
+    """
+    This endpoint captures the ``EXPLAIN (ANALYZE, BUFFERS)`` plan of a slow
+    ``SELECT`` query, which runs the query again, and attaches it to the slow
+    query. The ``forums_view_slow_queries`` permission is required to access
+    this endpoint.
+
+    .. :quickref: Stats; Explain a slow forum query.
+
+    **Example response**:
+
+    .. parsed-literal::
+
+       {
+         "status": "success",
+         "response": {
+           "id": 12,
+           "sql": "SELECT forums_threads.id FROM forums_threads WHERE ...",
+           "explain": "Limit  (cost=0.43..25.87 rows=50 width=4) ..."
+         }
+       }
+
+    :>json dict response: The slow query, with its plan
+
+    :statuscode 200: Explain successful
+    :statuscode 400: The query is not a single SELECT statement taking no locks
+    :statuscode 403: User does not have permission to view slow queries
+    :statuscode 404: The slow query does not exist, or was dropped
+    """
+    query = slow_queries.explain(id)
+    if query is None:
+        raise _404Exception
+    return flask.jsonify(public(query))
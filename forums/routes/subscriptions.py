@@ -1,7 +1,8 @@
 import flask
 
-from core import APIException, cache, db
+from core import APIException, db
 from core.utils import require_permission
+from forums.caching import invalidate
 from forums.models import (
     Forum,
     ForumSubscription,
@@ -56,17 +57,15 @@ def alter_thread_subscription(thread_id: int) -> flask.Response:
                 f'You are not subscribed to thread {thread_id}.'
             )
         db.session.delete(subscription)
-        db.session.commit()
-        cache.delete(
+        invalidate(
             ForumThreadSubscription.__cache_key_users__.format(
                 thread_id=thread_id
-            )
-        )
-        cache.delete(
+            ),
             ForumThreadSubscription.__cache_key_of_user__.format(
                 user_id=flask.g.user.id
-            )
+            ),
         )
+        db.session.commit()
         return flask.jsonify(
             f'Successfully unsubscribed from thread {thread_id}.'
         )
@@ -112,15 +111,13 @@ def alter_forum_subscription(forum_id: int) -> flask.Response:
         if not subscription:
             raise APIException(f'You are not subscribed to forum {forum_id}.')
         db.session.delete(subscription)
-        db.session.commit()
-        cache.delete(
-            ForumSubscription.__cache_key_users__.format(forum_id=forum_id)
-        )
-        cache.delete(
+        invalidate(
+            ForumSubscription.__cache_key_users__.format(forum_id=forum_id),
             ForumSubscription.__cache_key_of_user__.format(
                 user_id=flask.g.user.id
-            )
+            ),
         )
+        db.session.commit()
         return flask.jsonify(
             f'Successfully unsubscribed from forum {forum_id}.'
         )
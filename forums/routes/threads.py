@@ -4,6 +4,7 @@ from voluptuous import All, In, Length, Range, Schema
 from core import db
 from core.utils import require_permission, validate_data
 from core.validators import BoolGET
+from forums.caching import invalidate
 from forums.models import Forum, ForumPost, ForumThread, ForumThreadNote
 
 from . import bp
@@ -261,6 +262,8 @@ def delete_thread(id: int) -> flask.Response:
     ForumPost.update_many(
         pks=ForumPost.get_ids_from_thread(thread.id), update={'deleted': True}
     )
+    invalidate(ForumPost.__cache_key_of_thread__.format(id=thread.id))
+    db.session.commit()
     return flask.jsonify(
         f'ForumThread {id} ({thread.topic}) has been deleted.'
     )
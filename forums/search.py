@@ -0,0 +1,675 @@
+import abc
+import hashlib
+import math
+import re
+import threading
+from array import array
+from bisect import insort
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import flask
+from sqlalchemy import (
+    REAL,
+    and_,
+    case,
+    cast,
+    event,
+    func,
+    inspect,
+    literal,
+    literal_column,
+    or_,
+    text,
+)
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import object_session
+from sqlalchemy.sql.elements import BooleanClauseList
+
+from core import APIException, cache, db
+from core.permissions.models import UserPermission
+from forums.models import ForumPost, ForumThread
+from forums.tokenizer import WORD, strip_bbcode, tokenize
+
+SEARCH_CONFIG = 'english'
+SEARCH_DOCUMENT = literal_column(
+    'forums_posts.search_document', type_=TSVECTOR
+)
+SNIPPET_WORDS = 35
+SNIPPET_OPTIONS = (
+    f'StartSel=<mark>, StopSel=</mark>, MaxWords={SNIPPET_WORDS}, '
+    'MinWords=15, MaxFragments=2, FragmentDelimiter=" ... "'
+)
+
+INDEX_POSTS_KEY = 'forums_search_index_posts'
+INDEX_THREADS_KEY = 'forums_search_index_threads'
+BACKFILL_CHECKPOINT_KEY = 'forums_search_backfill_checkpoint'
+
+THREAD_SEARCH_CACHE_KEY = 'forums_threads_search_{digest}'
+THREAD_SEARCH_TIMEOUT = 60
+
+FORUM_PERMISSION = re.compile(r'forumaccess_forum_(\d+)$')
+THREAD_PERMISSION = re.compile(r'forumaccess_thread_(\d+)$')
+
+
+class Access(NamedTuple):
+    """
+    The forums and threads granted to a user, and the threads ungranted to them.
+    """
+
+    forum_ids: Tuple[int, ...]
+    thread_ids: Tuple[int, ...]
+    ungranted_ids: Tuple[int, ...]
+
+
+class SearchDocument(NamedTuple):
+    """
+    A post as seen by a search backend. The contents of posts that can no longer
+    be found, such as deleted posts, are ``None``.
+    """
+
+    post_id: int
+    thread_id: int
+    forum_id: int
+    user_id: int
+    contents: Optional[str]
+
+
+class SearchBackend(abc.ABC):
+    """
+    Stores the search documents of posts and answers post searches. Documents are
+    built from the words ``forums.tokenizer`` finds in the posts.
+    """
+
+    @abc.abstractmethod
+    def index(self, documents: List[SearchDocument]) -> None:
+        """
+        Replace the search documents of posts, removing those of posts without
+        contents.
+
+        :param documents: The posts to index
+        """
+
+    @abc.abstractmethod
+    def unindex_threads(self, thread_ids: List[int]) -> None:
+        """
+        Remove the search documents of every post of the given threads.
+
+        :param thread_ids: The IDs of the threads
+        """
+
+    @abc.abstractmethod
+    def search(
+        self,
+        query: str,
+        access: Access,
+        *,
+        forum_id: int = None,
+        thread_id: int = None,
+        user_id: int = None,
+        after: Tuple[float, int] = None,
+        limit: int = 25,
+    ) -> List[Tuple[int, float, str]]:
+        """
+        Search the posts in the accessible threads, from the most relevant.
+
+        :param query:     The search query
+        :param access:    The access of the searching user
+        :param forum_id:  Only search the posts of this forum
+        :param thread_id: Only search the posts of this thread
+        :param user_id:   Only search the posts of this author
+        :param after:     Only return results ranked after this rank and post ID
+        :param limit:     The number of results to return
+        :return:          The post ID, rank and highlighted snippet of each result
+        """
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    Keeps search documents in the ``search_document`` tsvector column of
+    ``forums_posts``, which is covered by a GIN index. Documents are only
+    rewritten when they change, so that unchanged posts cause no index churn.
+    """
+
+    document_sql = f"to_tsvector('{SEARCH_CONFIG}', CAST(:text AS text))"
+    index_statement = text(
+        f'UPDATE forums_posts SET search_document = {document_sql} '
+        f'WHERE id = :id AND search_document IS DISTINCT FROM {document_sql}'
+    )
+    unindex_statement = text(
+        'UPDATE forums_posts SET search_document = NULL '
+        'WHERE thread_id = ANY(:thread_ids) AND search_document IS NOT NULL'
+    )
+    # Snippets highlight the same quote-stripped text that is indexed.
+    snippet_statement = text(
+        f"SELECT ts_headline('{SEARCH_CONFIG}', t.text, "
+        f"websearch_to_tsquery('{SEARCH_CONFIG}', :query), :options) "
+        'FROM unnest(CAST(:texts AS text[])) WITH ORDINALITY AS t(text, n) '
+        'ORDER BY t.n'
+    )
+
+    def index(self, documents: List[SearchDocument]) -> None:
+        if documents:
+            db.session.execute(
+                self.index_statement,
+                [
+                    {
+                        'id': d.post_id,
+                        'text': (
+                            ' '.join(tokenize(d.contents))
+                            if d.contents is not None
+                            else None
+                        ),
+                    }
+                    for d in documents
+                ],
+            )
+
+    def unindex_threads(self, thread_ids: List[int]) -> None:
+        if thread_ids:
+            db.session.execute(
+                self.unindex_statement, {'thread_ids': list(thread_ids)}
+            )
+
+    def search(
+        self,
+        query: str,
+        access: Access,
+        *,
+        forum_id: int = None,
+        thread_id: int = None,
+        user_id: int = None,
+        after: Tuple[float, int] = None,
+        limit: int = 25,
+    ) -> List[Tuple[int, float, str]]:
+        tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, query)
+        rank = func.ts_rank_cd(SEARCH_DOCUMENT, tsquery)
+        filters = [
+            SEARCH_DOCUMENT.op('@@')(tsquery),
+            ForumPost.deleted == 'f',
+            ForumThread.deleted == 'f',
+            threads_filter(access),
+        ]
+        if forum_id is not None:
+            filters.append(ForumThread.forum_id == forum_id)
+        if thread_id is not None:
+            filters.append(ForumPost.thread_id == thread_id)
+        if user_id is not None:
+            filters.append(ForumPost.user_id == user_id)
+        if after is not None:
+            last_rank = cast(literal(after[0]), REAL)
+            filters.append(
+                or_(
+                    rank < last_rank,
+                    and_(rank == last_rank, ForumPost.id < after[1]),
+                )
+            )
+        rows = (
+            db.session.query(ForumPost.id, rank, ForumPost.contents)
+            .join(ForumThread, ForumThread.id == ForumPost.thread_id)
+            .filter(and_(*filters))
+            .order_by(rank.desc(), ForumPost.id.desc())
+            .limit(limit)
+            .all()
+        )
+        if not rows:
+            return []
+        snippets = db.session.execute(
+            self.snippet_statement,
+            {
+                'query': query,
+                'options': SNIPPET_OPTIONS,
+                'texts': [
+                    ' '.join(strip_bbcode(contents).split())
+                    for _, _, contents in rows
+                ],
+            },
+        )
+        return [
+            (post_id, post_rank, snippet)
+            for (post_id, post_rank, _), (snippet,) in zip(rows, snippets)
+        ]
+
+
+class MemoryDocument(NamedTuple):
+    thread_id: int
+    forum_id: int
+    user_id: int
+    terms: Dict[str, int]
+    length: int
+    text: str
+
+
+class MemorySearchBackend(SearchBackend):
+    """
+    Keeps search documents in an in-process inverted index, for tests and local
+    development. Each word maps to a sorted array of the IDs of the posts that
+    contain it, and posts are ranked by their number of matching words, damped
+    by their length. Queries match posts containing all of their words; unlike
+    ``PostgresSearchBackend``, words are not stemmed and web search operators
+    are not supported. The index lives in one process and is not transactional.
+    """
+
+    def __init__(self) -> None:
+        self.postings: Dict[str, array] = {}
+        self.documents: Dict[int, MemoryDocument] = {}
+        self.threads: Dict[int, Set[int]] = {}
+        self.lock = threading.Lock()
+
+    def load(self, chunk_size: int = 1000) -> None:
+        """
+        Index every post in the database.
+
+        :param chunk_size: The number of posts to read at once
+        """
+        after_id = 0
+        while True:
+            documents = _documents(ForumPost.id > after_id, limit=chunk_size)
+            if not documents:
+                return
+            self.index(documents)
+            after_id = documents[-1].post_id
+
+    def index(self, documents: List[SearchDocument]) -> None:
+        with self.lock:
+            for document in documents:
+                self._remove(document.post_id)
+                if document.contents is not None:
+                    self._add(document)
+
+    def unindex_threads(self, thread_ids: List[int]) -> None:
+        with self.lock:
+            for thread_id in thread_ids:
+                for post_id in list(self.threads.get(thread_id, ())):
+                    self._remove(post_id)
+
+    def search(
+        self,
+        query: str,
+        access: Access,
+        *,
+        forum_id: int = None,
+        thread_id: int = None,
+        user_id: int = None,
+        after: Tuple[float, int] = None,
+        limit: int = 25,
+    ) -> List[Tuple[int, float, str]]:
+        terms = set(tokenize(query))
+        with self.lock:
+            if not terms or not terms <= self.postings.keys():
+                return []
+            postings = sorted((self.postings[t] for t in terms), key=len)
+            post_ids = set(postings[0]).intersection(*postings[1:])
+            forum_ids = set(access.forum_ids)
+            thread_ids = set(access.thread_ids)
+            ungranted_ids = set(access.ungranted_ids)
+            results = []
+            for post_id in post_ids:
+                document = self.documents[post_id]
+                if (
+                    forum_id not in (None, document.forum_id)
+                    or thread_id not in (None, document.thread_id)
+                    or user_id not in (None, document.user_id)
+                ):
+                    continue
+                if document.thread_id not in thread_ids and (
+                    document.forum_id not in forum_ids
+                    or document.thread_id in ungranted_ids
+                ):
+                    continue
+                rank = sum(document.terms[t] for t in terms) / (
+                    1 + math.log(document.length)
+                )
+                if after is None or (rank, post_id) < after:
+                    results.append((rank, post_id, document.text))
+        results.sort(reverse=True)
+        return [
+            (post_id, rank, self._snippet(text, terms))
+            for rank, post_id, text in results[:limit]
+        ]
+
+    def _add(self, document: SearchDocument) -> None:
+        words = tokenize(document.contents)
+        if not words:
+            return
+        terms = Counter(words)
+        self.documents[document.post_id] = MemoryDocument(
+            thread_id=document.thread_id,
+            forum_id=document.forum_id,
+            user_id=document.user_id,
+            terms=terms,
+            length=len(words),
+            text=' '.join(strip_bbcode(document.contents).split()),
+        )
+        self.threads.setdefault(document.thread_id, set()).add(
+            document.post_id
+        )
+        for term in terms:
+            postings = self.postings.setdefault(term, array('I'))
+            insort(postings, document.post_id)
+
+    def _remove(self, post_id: int) -> None:
+        document = self.documents.pop(post_id, None)
+        if document is None:
+            return
+        self.threads[document.thread_id].discard(post_id)
+        for term in document.terms:
+            postings = self.postings[term]
+            postings.remove(post_id)
+            if not postings:
+                del self.postings[term]
+
+    @staticmethod
+    def _snippet(text: str, terms: Set[str]) -> str:
+        words = text.split()
+        first = next(
+            (
+                i
+                for i, word in enumerate(words)
+                if any(w.lower() in terms for w in WORD.findall(word))
+            ),
+            0,
+        )
+        start = max(min(first - 10, len(words) - SNIPPET_WORDS), 0)
+        return ' '.join(
+            WORD.sub(
+                lambda m: (
+                    f'<mark>{m.group()}</mark>'
+                    if m.group().lower() in terms
+                    else m.group()
+                ),
+                word,
+            )
+            for word in words[start : start + SNIPPET_WORDS]
+        )
+
+
+_backend: SearchBackend = PostgresSearchBackend()
+
+
+def get_search_backend() -> SearchBackend:
+    return _backend
+
+
+def set_search_backend(backend: SearchBackend) -> None:
+    global _backend
+    _backend = backend
+
+
+def accessible_forum_ids() -> Set[int]:
+    """
+    :return: The IDs of the forums the current user has explicit access to
+    """
+    return _permission_ids(FORUM_PERMISSION, flask.g.user.forum_permissions)
+
+
+def user_access() -> Access:
+    """
+    :return: The forum and thread access of the current user
+    """
+    ungranted = (
+        p
+        for p, g in UserPermission.from_user(
+            flask.g.user.id, prefix='forumaccess_thread'
+        ).items()
+        if g is False
+    )
+    return Access(
+        tuple(sorted(accessible_forum_ids())),
+        tuple(
+            sorted(
+                _permission_ids(
+                    THREAD_PERMISSION, flask.g.user.forum_permissions
+                )
+            )
+        ),
+        tuple(sorted(_permission_ids(THREAD_PERMISSION, ungranted))),
+    )
+
+
+def threads_filter(access: Access) -> BooleanClauseList:
+    """
+    Build a filter of the threads a user can access, mirroring
+    ``ForumThread.can_access``: threads in the user's forums, except threads
+    ungranted to them, plus the threads granted to them explicitly.
+
+    :param access: The access of the user
+    :return:       A filter on ``ForumThread``
+    """
+    in_forums = ForumThread.forum_id.in_(access.forum_ids)
+    if access.ungranted_ids:
+        in_forums = and_(in_forums, ~ForumThread.id.in_(access.ungranted_ids))
+    return or_(in_forums, ForumThread.id.in_(access.thread_ids))
+
+
+def accessible_threads_filter() -> BooleanClauseList:
+    """
+    :return: A filter of the threads the current user can access
+    """
+    return threads_filter(user_access())
+
+
+def search_posts(
+    query: str,
+    *,
+    forum_id: int = None,
+    thread_id: int = None,
+    user_id: int = None,
+    cursor: str = None,
+    limit: int = 25,
+) -> Tuple[List[dict], Optional[str]]:
+    """
+    Search the contents of the posts the current user can access, ranked by
+    relevance.
+
+    :param query:     The search query, in web search syntax
+    :param forum_id:  Only search the posts of this forum
+    :param thread_id: Only search the posts of this thread
+    :param user_id:   Only search the posts of this author
+    :param cursor:    The cursor returned with the previous page
+    :param limit:     The number of results to return
+    :return:          The results, each a dictionary of the post, its rank and
+                      its snippet, and the cursor of the next page, if any
+    """
+    rows = get_search_backend().search(
+        query,
+        user_access(),
+        forum_id=forum_id,
+        thread_id=thread_id,
+        user_id=user_id,
+        after=_parse_cursor(cursor) if cursor is not None else None,
+        limit=limit + 1,
+    )
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        post_id, rank, _ = rows[-1]
+        next_cursor = _make_cursor(rank, post_id)
+    if not rows:
+        return [], None
+    posts = {p.id: p for p in ForumPost.get_many(pks=[r[0] for r in rows])}
+    return (
+        [
+            {'post': posts[pk], 'rank': score, 'snippet': snippet}
+            for pk, score, snippet in rows
+            if pk in posts
+        ],
+        next_cursor,
+    )
+
+
+def search_threads(
+    query: str, *, fuzzy: bool = False, limit: int = 25
+) -> List[ForumThread]:
+    """
+    Search the topics of the threads the current user can access. Prefix
+    searches match the start of topics through the ``lower(topic)`` index, and
+    are ordered alphabetically. Fuzzy searches match similar topics through the
+    trigram index, and are ordered by similarity. Results are cached briefly,
+    per query and set of accessible threads.
+
+    :param query: The search query
+    :param fuzzy: Whether to match similar topics rather than prefixes
+    :param limit: The number of threads to return
+    :return:      The matching threads
+    """
+    access = user_access()
+    digest = hashlib.sha1(
+        repr((query.lower(), fuzzy, limit, access)).encode()
+    ).hexdigest()
+    cache_key = THREAD_SEARCH_CACHE_KEY.format(digest=digest)
+    thread_ids = cache.get(cache_key)
+    if thread_ids is None:
+        if fuzzy:
+            match = ForumThread.topic.op('%')(query)
+            order = func.similarity(ForumThread.topic, query).desc()
+        else:
+            match = func.lower(ForumThread.topic).like(
+                _escape_like(query.lower()) + '%'
+            )
+            order = func.lower(ForumThread.topic)
+        rows = (
+            db.session.query(ForumThread.id)
+            .filter(
+                and_(match, ForumThread.deleted == 'f', threads_filter(access))
+            )
+            .order_by(order, ForumThread.id)
+            .limit(limit)
+        )
+        thread_ids = [pk for pk, in rows]
+        cache.set(cache_key, thread_ids, timeout=THREAD_SEARCH_TIMEOUT)
+    if not thread_ids:
+        return []
+    return ForumThread.get_many(pks=thread_ids)
+
+
+def index_threads(*thread_ids: int) -> None:
+    """
+    Queue every post of the given threads to be reindexed when the current
+    transaction commits; the posts of deleted threads are removed from the index.
+    Posts and threads changed through the ORM are queued automatically, and the
+    queued posts are indexed together right before the commit. This is needed
+    for bulk updates, such as ``update_many``.
+
+    :param thread_ids: The IDs of the threads
+    """
+    db.session.info.setdefault(INDEX_THREADS_KEY, set()).update(thread_ids)
+
+
+def backfill_posts(after_id: int = 0, limit: int = 1000) -> Optional[int]:
+    """
+    Index a chunk of posts, in ID order. The caller commits.
+
+    :param after_id: Only index the posts after this ID
+    :param limit:    The number of posts to index
+    :return:         The ID of the last post indexed, or ``None`` if there were
+                     no posts left
+    """
+    documents = _documents(ForumPost.id > after_id, limit=limit)
+    get_search_backend().index(documents)
+    return documents[-1].post_id if documents else None
+
+
+def _documents(filter, limit: int = None) -> List[SearchDocument]:
+    dead = or_(ForumPost.deleted == 't', ForumThread.deleted == 't')
+    query = (
+        db.session.query(
+            ForumPost.id,
+            ForumPost.thread_id,
+            ForumThread.forum_id,
+            ForumPost.user_id,
+            case([(dead, None)], else_=ForumPost.contents),
+        )
+        .join(ForumThread, ForumThread.id == ForumPost.thread_id)
+        .filter(filter)
+        .order_by(ForumPost.id)
+    )
+    if limit is not None:
+        query = query.limit(limit)
+    return [SearchDocument(*row) for row in query]
+
+
+def _changed(target, attributes: Iterable[str]) -> bool:
+    state = inspect(target)
+    for attribute in attributes:
+        history = state.attrs[attribute].history
+        if history.added and history.added != history.deleted:
+            return True
+    return False
+
+
+def _queue_post(mapper, connection, post: ForumPost) -> None:
+    if _changed(post, ('contents', 'deleted')):
+        session = object_session(post)
+        session.info.setdefault(INDEX_POSTS_KEY, set()).add(post.id)
+
+
+def _queue_thread(mapper, connection, thread: ForumThread) -> None:
+    if _changed(thread, ('deleted', 'forum_id')):
+        session = object_session(thread)
+        session.info.setdefault(INDEX_THREADS_KEY, set()).add(thread.id)
+
+
+def _index_queued(session) -> None:
+    session.flush()  # Queue the changes flushed by this commit.
+    post_ids = session.info.pop(INDEX_POSTS_KEY, None)
+    thread_ids = session.info.pop(INDEX_THREADS_KEY, None)
+    backend = get_search_backend()
+    if thread_ids:
+        dead_ids = {
+            pk
+            for pk, in db.session.query(ForumThread.id).filter(
+                and_(
+                    ForumThread.id.in_(sorted(thread_ids)),
+                    ForumThread.deleted == 't',
+                )
+            )
+        }
+        backend.unindex_threads(sorted(dead_ids))
+        live_ids = sorted(thread_ids - dead_ids)
+        if live_ids:
+            backend.index(_documents(ForumPost.thread_id.in_(live_ids)))
+    if post_ids:
+        backend.index(_documents(ForumPost.id.in_(sorted(post_ids))))
+
+
+def _drop_queued(session, previous_transaction) -> None:
+    # Rolling back a savepoint leaves the enclosing transaction, and the posts
+    # it queued, in place.
+    if previous_transaction.parent is None:
+        session.info.pop(INDEX_POSTS_KEY, None)
+        session.info.pop(INDEX_THREADS_KEY, None)
+
+
+def listen_for_indexing() -> None:
+    event.listen(ForumPost, 'after_insert', _queue_post)
+    event.listen(ForumPost, 'after_update', _queue_post)
+    event.listen(ForumThread, 'after_update', _queue_thread)
+    event.listen(db.session, 'before_commit', _index_queued)
+    event.listen(db.session, 'after_soft_rollback', _drop_queued)
+
+
+def _escape_like(value: str) -> str:
+    return (
+        value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    )
+
+
+def _permission_ids(pattern, permissions) -> Set[int]:
+    return {
+        int(match.group(1))
+        for match in (pattern.match(p) for p in permissions)
+        if match
+    }
+
+
+def _make_cursor(rank: float, id: int) -> str:
+    return f'{rank!r}_{id}'
+
+
+def _parse_cursor(cursor: str) -> Tuple[float, int]:
+    try:
+        rank, id = cursor.split('_')
+        return float(rank), int(id)
+    except ValueError:
+        raise APIException(f'Invalid cursor: {cursor}.')
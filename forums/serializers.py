@@ -80,6 +80,7 @@ class ForumPollSerializer(Serializer):
     closed = Attribute()
     featured = Attribute()
     choices = Attribute()
+    voted_choice_id = Attribute()
 
 
 class ForumPollChoiceSerializer(Serializer):
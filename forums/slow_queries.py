@@ -0,0 +1,143 @@
+import re
+import sys
+from datetime import datetime
+from typing import Any, Optional
+
+from core import APIException, db
+from forums.instrumentation import ReportBuffer, statement_observers
+
+SLOW_QUERY_SECONDS = 0.5
+SLOW_QUERIES = 100
+PARAMETERS_LENGTH = 1000
+EXPLAIN_TIMEOUT_MS = 30_000
+SELECT = re.compile(r'\s*select\b', re.IGNORECASE)
+# Clauses that make a SELECT take locks or write a table.
+UNSAFE_SELECT = re.compile(
+    r'\bfor\s+(no\s+key\s+update|update|key\s+share|share)\b|\binto\b',
+    re.IGNORECASE,
+)
+FORUMS_TABLE = re.compile(r'\b(forums\w*|last_viewed_forum_posts)\b')
+
+# Frames of these modules are never reported as the caller of a query.
+SKIPPED_MODULES = ('forums.instrumentation', 'forums.slow_queries')
+
+
+class SlowQueryLog:
+    """
+    Records the SQL statements on forums tables slower than a threshold in a
+    ring buffer, with their parameters, duration and the model method, or other
+    forums function, that ran them. Statements on other tables only, such as
+    those of core, are never recorded, so that their parameters are not
+    exposed. Their ``EXPLAIN (ANALYZE, BUFFERS)`` plans are captured on demand,
+    as capturing a plan runs the query again.
+    """
+
+    def __init__(self, size: int = SLOW_QUERIES) -> None:
+        self.threshold: Optional[float] = SLOW_QUERY_SECONDS
+        self.queries = ReportBuffer(size)
+
+    def observe(
+        self,
+        statement: str,
+        parameters: Any,
+        executemany: bool,
+        seconds: float,
+    ) -> None:
+        if self.threshold is None or seconds < self.threshold:
+            return
+        if not FORUMS_TABLE.search(statement):
+            return
+        self.queries.add(
+            {
+                'sql': statement,
+                'parameters': repr(parameters)[:PARAMETERS_LENGTH],
+                'executemany': executemany,
+                'seconds': seconds,
+                'caller': _caller(),
+                'time': datetime.utcnow().isoformat(),
+                'explain': None,
+                '_parameters': parameters,
+            }
+        )
+
+    def explain(self, id: int) -> Optional[dict]:
+        """
+        Capture the ``EXPLAIN (ANALYZE, BUFFERS)`` plan of a slow query, in a
+        transaction that is rolled back. Only single ``SELECT`` statements that
+        take no locks can be explained, as explaining them runs them.
+
+        :param id: The ID of the slow query
+        :return:   The slow query with its plan, or ``None`` if it was dropped
+        :raises APIException: If the query is not a single, plain ``SELECT``
+                              statement
+        """
+        query = self.queries.get(id)
+        if query is None:
+            return None
+        if (
+            query['executemany']
+            or not SELECT.match(query['sql'])
+            or UNSAFE_SELECT.search(query['sql'])
+        ):
+            raise APIException('Only SELECT statements can be explained.')
+        connection = db.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(
+                f'SET LOCAL statement_timeout = {EXPLAIN_TIMEOUT_MS}'
+            )
+            cursor.execute(
+                'EXPLAIN (ANALYZE, BUFFERS) ' + query['sql'],
+                query['_parameters'],
+            )
+            query['explain'] = '\n'.join(row[0] for row in cursor.fetchall())
+        finally:
+            connection.rollback()
+            connection.close()
+        return query
+
+    def clear(self) -> None:
+        self.queries.clear()
+
+
+slow_queries = SlowQueryLog()
+
+
+def listen_for_slow_queries() -> None:
+    statement_observers.append(slow_queries.observe)
+
+
+def public(query: dict) -> dict:
+    """
+    :return: The slow query without its raw parameters, to be serialized
+    """
+    return {k: v for k, v in query.items() if not k.startswith('_')}
+
+
+def _caller() -> Optional[str]:
+    """
+    Walk the stack for the forum model method that ran the current query:
+    the first frame of a method of a class of ``forums.models``, including the
+    methods it inherits from core. Failing that, the first frame of another
+    forums module is reported.
+    """
+    fallback = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        owner = frame.f_locals.get('self', frame.f_locals.get('cls'))
+        model = owner if isinstance(owner, type) else type(owner)
+        location = f'{frame.f_code.co_filename}:{frame.f_lineno}'
+        if (
+            owner is not None
+            and getattr(model, '__module__', None) == 'forums.models'
+        ):
+            return f'{model.__name__}.{frame.f_code.co_name} ({location})'
+        if (
+            fallback is None
+            and module.startswith('forums.')
+            and module not in SKIPPED_MODULES
+        ):
+            fallback = f'{module}.{frame.f_code.co_name} ({location})'
+        frame = frame.f_back
+    return fallback
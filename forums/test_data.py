@@ -1,5 +1,24 @@
+import io
+import math
+import random
+from bisect import bisect
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate, islice
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
 from core import db
 from core.mixins import TestDataPopulator
+from forums.search import backfill_posts
+
+SYLLABLES = (
+    'ba ca da fe ga he ki lo mu na po qui ra se ta ul vo wy xe zo '
+    'an ber cor dil eth fin gor hal ist jen kol lim mor nek orp '
+).split()
+VOCABULARY_SIZE = 5000
+
+# Generated rows start at this time and span a year, so runs are deterministic.
+GENERATED_EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+GENERATED_SPAN = timedelta(days=365)
 
 
 class ForumsPopulator(TestDataPopulator):
@@ -110,6 +129,7 @@ class ForumsPopulator(TestDataPopulator):
             (1, 2, 2),
             (2, 1, 4)"""
         )
+        backfill_posts()
         db.session.commit()
 
         cls.add_permissions(
@@ -128,6 +148,7 @@ class ForumsPopulator(TestDataPopulator):
 
     @classmethod
     def unpopulate(cls):
+        db.engine.execute("DELETE FROM forums_users_stats")
         db.engine.execute("DELETE FROM forums_polls_answers")
         db.engine.execute("DELETE FROM forums_polls_choices")
         db.engine.execute("DELETE FROM forums_polls")
@@ -140,3 +161,431 @@ class ForumsPopulator(TestDataPopulator):
         db.engine.execute("DELETE FROM forums_threads")
         db.engine.execute("DELETE FROM forums")
         db.engine.execute("DELETE FROM forums_categories")
+
+
+class ForumsGenerator(ForumsPopulator):
+    """
+    Generates forums of any size on top of the hand-written test data, for
+    benchmarks and local testing. Forum activity, thread sizes, posting users and
+    words all follow Zipfian distributions, and the same seed and sizes always
+    generate the same rows. Rows are loaded with ``COPY``, bypassing the ORM, so
+    the search index, user stats and cache are not updated.
+    """
+
+    chunk_size = 100_000
+    sizes = {'categories': 2, 'forums': 5, 'threads': 50, 'posts': 500}
+
+    @classmethod
+    def populate(cls):
+        super().populate()
+        cls.generate(**cls.sizes)
+        after_id = 0
+        while after_id is not None:
+            after_id = backfill_posts(after_id)
+        db.session.commit()
+
+    @classmethod
+    def generate(
+        cls,
+        *,
+        categories: int = 10,
+        forums: int = 100,
+        threads: int = 100_000,
+        posts: int = 1_000_000,
+        seed: int = 0,
+        exponent: float = 1.1,
+        progress: Callable[[str], None] = None,
+    ) -> Dict[str, int]:
+        """
+        Generate forum rows for the existing users. The caller commits.
+
+        :param categories: The number of categories to generate
+        :param forums:     The number of forums to generate
+        :param threads:    The number of threads to generate
+        :param posts:      The number of posts to generate, at least one per
+                           thread
+        :param seed:       The seed of the random generator
+        :param exponent:   The exponent of the Zipfian distributions
+        :param progress:   A function called with a message after each table
+        :return:           The number of rows generated per table
+        :raises ValueError: If there are no users, or fewer posts than threads
+        """
+        user_ids = [
+            pk
+            for pk, in db.session.execute('SELECT id FROM users ORDER BY id')
+        ]
+        if not user_ids:
+            raise ValueError('Generating forums requires existing users.')
+        if min(categories, forums, threads) < 1 or posts < threads:
+            raise ValueError('Every thread needs a forum and a post.')
+
+        rng = random.Random(seed)
+        vocabulary = sorted(
+            {
+                ''.join(rng.choices(SYLLABLES, k=rng.randint(1, 4)))
+                for _ in range(VOCABULARY_SIZE)
+            }
+        )
+        rng.shuffle(vocabulary)
+        words = _zipf(len(vocabulary), exponent)
+        users = _zipf(len(user_ids), exponent, rng)
+        counts: Dict[str, int] = {}
+
+        def load(table: str, columns: Sequence[str], rows: Iterable) -> None:
+            counts[table] = _copy(table, columns, rows, cls.chunk_size)
+            if progress:
+                progress(f'Generated {counts[table]} rows of {table}.')
+
+        def text(low: int, high: int) -> str:
+            length = min(max(int(rng.lognormvariate(3, 0.8)), low), high)
+            return ' '.join(
+                rng.choices(vocabulary, cum_weights=words, k=length)
+            )
+
+        def user() -> int:
+            return user_ids[_draw(rng, users)]
+
+        def time(index: int, total: int) -> datetime:
+            return GENERATED_EPOCH + GENERATED_SPAN * (index / total)
+
+        category_id = _next_id('forums_categories')
+        category_ids = range(category_id, category_id + categories)
+        load(
+            'forums_categories',
+            ('id', 'name', 'description', 'position', 'deleted'),
+            (
+                (pk, f'Category {pk}', text(3, 20), i, False)
+                for i, pk in enumerate(category_ids)
+            ),
+        )
+
+        forum_id = _next_id('forums')
+        forum_ids = range(forum_id, forum_id + forums)
+        load(
+            'forums',
+            (
+                'id',
+                'name',
+                'description',
+                'category_id',
+                'position',
+                'deleted',
+            ),
+            (
+                (
+                    pk,
+                    f'Forum {pk}',
+                    text(3, 20),
+                    category_ids[i % categories],
+                    i // categories,
+                    False,
+                )
+                for i, pk in enumerate(forum_ids)
+            ),
+        )
+
+        # Thread j opens with post ceil(j * posts / threads); thread popularity
+        # is independent of age.
+        thread_id = _next_id('forums_threads')
+        thread_ids = range(thread_id, thread_id + threads)
+        popular_forums = _zipf(forums, exponent, rng)
+        popular_threads = _zipf(threads, exponent, rng, cumulative=False)
+        creators = [user() for _ in thread_ids]
+        load(
+            'forums_threads',
+            (
+                'id',
+                'topic',
+                'forum_id',
+                'creator_id',
+                'created_time',
+                'locked',
+                'sticky',
+                'deleted',
+            ),
+            (
+                (
+                    pk,
+                    text(2, 12).capitalize()[:150],
+                    forum_ids[_draw(rng, popular_forums)],
+                    creators[j],
+                    time(-(-j * posts // threads), posts),
+                    rng.random() < 0.02,
+                    rng.random() < 0.01,
+                    rng.random() < 0.01,
+                )
+                for j, pk in enumerate(thread_ids)
+            ),
+        )
+
+        post_id = _next_id('forums_posts')
+        edited: List[Tuple[int, int, datetime]] = []
+
+        def post_rows() -> Iterable[tuple]:
+            opened = 0
+            cumulative = 0.0
+            opened_weights: List[float] = []
+            for i in range(posts):
+                if opened < threads and i * threads >= opened * posts:
+                    j, user_id = opened, creators[opened]
+                    cumulative += popular_threads[opened]
+                    opened_weights.append(cumulative)
+                    opened += 1
+                else:
+                    j = bisect(opened_weights, rng.random() * cumulative)
+                    user_id = user()
+                contents = text(1, 1000)
+                if rng.random() < 0.05:
+                    contents = f'[quote]{text(1, 50)}[/quote] {contents}'
+                posted = time(i, posts)
+                edited_user_id = edited_time = None
+                if rng.random() < 0.03:
+                    edited_user_id = user_id
+                    edited_time = posted + timedelta(
+                        minutes=rng.randint(1, 60)
+                    )
+                    edited.append((post_id + i, user_id, posted))
+                yield (
+                    post_id + i,
+                    thread_ids[j],
+                    user_id,
+                    contents,
+                    posted,
+                    False,
+                    edited_user_id,
+                    edited_time,
+                    rng.random() < 0.02,
+                )
+
+        load(
+            'forums_posts',
+            (
+                'id',
+                'thread_id',
+                'user_id',
+                'contents',
+                'time',
+                'sticky',
+                'edited_user_id',
+                'edited_time',
+                'deleted',
+            ),
+            post_rows(),
+        )
+        edit_id = _next_id('forums_posts_edit_history')
+        load(
+            'forums_posts_edit_history',
+            ('id', 'post_id', 'editor_id', 'contents', 'time'),
+            (
+                (edit_id + i, pk, editor_id, text(1, 200), posted)
+                for i, (pk, editor_id, posted) in enumerate(edited)
+            ),
+        )
+
+        load(
+            'forums_forums_subscriptions',
+            ('user_id', 'forum_id'),
+            (
+                (user_id, forum_ids[i])
+                for user_id in user_ids
+                for i in _pick(rng, popular_forums, forums)
+            ),
+        )
+        load(
+            'forums_threads_subscriptions',
+            ('user_id', 'thread_id'),
+            (
+                (user_id, thread_ids[j])
+                for user_id, js in _subscribed_threads(
+                    rng, user_ids, creators, popular_threads
+                )
+                for j in js
+            ),
+        )
+
+        # A tenth of the forums are restricted to a twentieth of the users, and
+        # one user in a hundred is ungranted from a popular thread.
+        restricted = set(rng.sample(forum_ids, k=forums // 10))
+        privileged = set(
+            rng.sample(user_ids, k=math.ceil(len(user_ids) / 20))
+        )
+        hottest_id = thread_ids[
+            max(range(threads), key=popular_threads.__getitem__)
+        ]
+        load(
+            'users_permissions',
+            ('user_id', 'permission', 'granted'),
+            (
+                (user_id, permission, granted)
+                for user_id in user_ids
+                for permission, granted in _permissions(
+                    rng,
+                    forum_ids,
+                    restricted if user_id not in privileged else (),
+                    hottest_id,
+                )
+            ),
+        )
+
+        poll_id = _next_id('forums_polls')
+        choice_id = _next_id('forums_polls_choices')
+        polled = sorted(rng.sample(thread_ids, k=math.ceil(threads / 50)))
+        choices: List[Tuple[int, int, str]] = []
+        answers: List[Tuple[int, int, int]] = []
+        for i, _ in enumerate(polled):
+            poll_choices = range(choice_id, choice_id + rng.randint(2, 6))
+            choice_id += len(poll_choices)
+            choices += [(pk, poll_id + i, text(1, 8)) for pk in poll_choices]
+            voters = rng.sample(
+                user_ids,
+                k=min(len(user_ids), int(rng.paretovariate(exponent) * 2)),
+            )
+            weights = _zipf(len(poll_choices), exponent)
+            answers += [
+                (poll_id + i, voter, pk)
+                for voter, pk in zip(
+                    voters,
+                    rng.choices(
+                        poll_choices, cum_weights=weights, k=len(voters)
+                    ),
+                )
+            ]
+        load(
+            'forums_polls',
+            ('id', 'thread_id', 'closed', 'featured', 'question'),
+            (
+                (poll_id + i, pk, rng.random() < 0.2, False, text(3, 20))
+                for i, pk in enumerate(polled)
+            ),
+        )
+        load('forums_polls_choices', ('id', 'poll_id', 'choice'), choices)
+        load(
+            'forums_polls_answers',
+            ('poll_id', 'user_id', 'choice_id'),
+            answers,
+        )
+
+        for table in (
+            'forums_categories',
+            'forums',
+            'forums_threads',
+            'forums_posts',
+            'forums_posts_edit_history',
+            'forums_polls',
+            'forums_polls_choices',
+        ):
+            db.session.execute(
+                f"SELECT setval('{table}_id_seq', MAX(id)) FROM {table}"
+            )
+        return counts
+
+
+def _zipf(
+    n: int,
+    exponent: float,
+    rng: random.Random = None,
+    cumulative: bool = True,
+) -> List[float]:
+    """
+    Build the weights of a Zipfian distribution over ``n`` items, suited to
+    ``bisect`` and ``random.choices``. The first items are the most likely,
+    unless a random generator is given to shuffle the ranks.
+    """
+    weights = [1 / rank ** exponent for rank in range(1, n + 1)]
+    if rng is not None:
+        rng.shuffle(weights)
+    return list(accumulate(weights)) if cumulative else weights
+
+
+def _pick(rng: random.Random, weights: List[float], n: int) -> List[int]:
+    """
+    Pick a Pareto-distributed number of distinct items out of ``n``, weighted
+    by the given cumulative weights.
+    """
+    k = min(int(rng.paretovariate(1.5)), n)
+    return sorted({_draw(rng, weights) for _ in range(k)})
+
+
+def _draw(rng: random.Random, weights: List[float]) -> int:
+    """
+    Draw the index of an item, weighted by the given cumulative weights.
+    """
+    return bisect(weights, rng.random() * weights[-1])
+
+
+def _subscribed_threads(
+    rng: random.Random,
+    user_ids: List[int],
+    creators: List[int],
+    weights: List[float],
+) -> Iterable[Tuple[int, List[int]]]:
+    """
+    Subscribe users to the threads they created, plus a few popular threads.
+    """
+    created: Dict[int, List[int]] = {}
+    for j, creator in enumerate(creators):
+        created.setdefault(creator, []).append(j)
+    cumulative = list(accumulate(weights))
+    for user_id in user_ids:
+        picked = _pick(rng, cumulative, len(weights))
+        yield user_id, sorted(set(created.get(user_id, ())).union(picked))
+
+
+def _permissions(
+    rng: random.Random,
+    forum_ids: Sequence[int],
+    restricted: Iterable[int],
+    hottest_id: int,
+) -> Iterable[Tuple[str, bool]]:
+    restricted = set(restricted)
+    for pk in forum_ids:
+        if pk not in restricted:
+            yield f'forumaccess_forum_{pk}', True
+    if rng.random() < 0.01:
+        yield f'forumaccess_thread_{hottest_id}', False
+
+
+def _next_id(table: str) -> int:
+    return db.session.execute(
+        f'SELECT COALESCE(MAX(id), 0) + 1 FROM {table}'
+    ).scalar()
+
+
+def _copy(
+    table: str, columns: Sequence[str], rows: Iterable[tuple], chunk_size: int
+) -> int:
+    """
+    Load rows into a table with ``COPY``, a chunk at a time.
+
+    :return: The number of rows loaded
+    """
+    cursor = db.session.connection().connection.cursor()
+    statement = f'COPY {table} ({", ".join(columns)}) FROM STDIN'
+    rows = iter(rows)
+    total = 0
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return total
+        buffer = io.StringIO()
+        for row in chunk:
+            buffer.write('\t'.join(map(_copy_value, row)) + '\n')
+        buffer.seek(0)
+        cursor.copy_expert(statement, buffer)
+        total += len(chunk)
+
+
+def _copy_value(value: Any) -> str:
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('\t', '\\t')
+        .replace('\n', '\\n')
+        .replace('\r', '\\r')
+    )
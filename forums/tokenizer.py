@@ -0,0 +1,43 @@
+import re
+from typing import List
+
+BBCODE_TAG = re.compile(r'\[(/?)([a-z*]+)(?:=[^\]]*)?\]', re.IGNORECASE)
+WORD = re.compile(r'\w+')
+
+# Tags whose contents are not the post's own words: quotes repeat other posts,
+# and images and embeds only hold URLs.
+SKIPPED_TAGS = {'quote', 'img', 'youtube'}
+
+
+def strip_bbcode(contents: str) -> str:
+    """
+    Reduce BBCode post contents to their plain text. Tags are removed, along with
+    the contents of quotes and of tags that only hold URLs; tag arguments, such
+    as the URL of a ``[url=...]`` link, are dropped.
+
+    :param contents: The BBCode contents of a post
+    :return:         The plain text of the contents
+    """
+    text: List[str] = []
+    skipping = 0
+    position = 0
+    for match in BBCODE_TAG.finditer(contents):
+        if not skipping:
+            text.append(contents[position : match.start()])
+        position = match.end()
+        if match.group(2).lower() in SKIPPED_TAGS:
+            skipping = max(skipping + (-1 if match.group(1) else 1), 0)
+        text.append(' ')
+    if not skipping:
+        text.append(contents[position:])
+    return ''.join(text)
+
+
+def tokenize(contents: str) -> List[str]:
+    """
+    Split BBCode post contents, or a search query, into lowercase words.
+
+    :param contents: The text to tokenize
+    :return:         The words of the text, in order
+    """
+    return [w.lower() for w in WORD.findall(strip_bbcode(contents))]
@@ -1,7 +1,41 @@
+from contextlib import contextmanager
+from typing import Iterator
+
+import pytest
+
 import forums
 from core.conftest import *  # noqa: F401, F403
 from core.conftest import PLUGINS, POPULATORS
+from forums.caching import local_cache
+from forums.instrumentation import Counter
 from forums.test_data import ForumsPopulator
 
 PLUGINS.append(forums)
 POPULATORS.append(ForumsPopulator)
+
+
+@pytest.fixture(autouse=True)
+def clear_local_cache():
+    local_cache.clear()
+    yield
+    local_cache.clear()
+
+
+@contextmanager
+def budget(statements: int, cache_calls: int = None) -> Iterator[Counter]:
+    """
+    Fail if the block makes more SQL statements or shared cache calls than
+    budgeted, listing the calls made.
+    """
+    with Counter() as counter:
+        yield counter
+    assert len(counter.statements) <= statements, (
+        f'{len(counter.statements)} SQL statements, over the budget of '
+        f'{statements}:\n' + '\n'.join(counter.statements)
+    )
+    if cache_calls is not None:
+        assert len(counter.cache_calls) <= cache_calls, (
+            f'{len(counter.cache_calls)} cache calls, over the budget of '
+            f'{cache_calls}:\n'
+            + '\n'.join(f'{e} {k}' for e, k in counter.cache_calls)
+        )
@@ -0,0 +1,381 @@
+import pickle
+import time
+
+import pytest
+
+from conftest import add_permissions
+from core import cache, db
+from forums.caching import (
+    GENERATION_KEY,
+    CacheMetrics,
+    ChunkedIdList,
+    LocalCache,
+    SingleFlight,
+    cache_metrics,
+    id_lists,
+    invalidate,
+    key_pattern,
+    local_cache,
+    request_cache,
+    single_flight,
+)
+from forums.models import (
+    Forum,
+    ForumCategory,
+    ForumPost,
+    ForumSubscription,
+    ForumThread,
+)
+
+
+@pytest.mark.parametrize(
+    'template, key, matches',
+    [
+        ('forums_{id}', 'forums_1', True),
+        ('forums_{id}', 'forums_threads_1', False),
+        ('forums_{id}_thread_count', 'forums_12_thread_count', True),
+        ('forums_categories_all', 'forums_categories_all', True),
+        ('forums_polls_{id}_answers', 'forums_polls_1_results', False),
+    ],
+)
+def test_key_pattern(template, key, matches):
+    assert bool(key_pattern(template).match(key)) is matches
+
+
+@pytest.fixture
+def tier(app):
+    tier = LocalCache(['test_local_{id}'], maxsize=2, timeout=10)
+    tier.backend = local_cache.backend
+    return tier
+
+
+def test_local_cache_hit_and_miss(tier):
+    assert tier.lookup('test_local_1') == (False, None)
+    tier.fill('test_local_1', {'id': 1})
+    assert tier.lookup('test_local_1') == (True, {'id': 1})
+    assert tier.stats()['hits'] == 1
+    assert tier.stats()['misses'] == 1
+    assert tier.stats()['hit_rate'] == 0.5
+
+
+def test_local_cache_ignores_other_keys(tier):
+    tier.fill('test_other_1', 1)
+    assert tier.lookup('test_other_1') == (False, None)
+
+
+def test_local_cache_evicts_least_recent(tier):
+    tier.fill('test_local_1', 1)
+    tier.fill('test_local_2', 2)
+    tier.lookup('test_local_1')
+    tier.fill('test_local_3', 3)
+    assert tier.lookup('test_local_2') == (False, None)
+    assert tier.lookup('test_local_1') == (True, 1)
+
+
+def test_local_cache_expires(tier):
+    tier.timeout = 0
+    tier.fill('test_local_1', 1)
+    time.sleep(0.01)
+    assert tier.lookup('test_local_1') == (False, None)
+
+
+def test_local_cache_generation_invalidation(tier):
+    tier.check_interval = 0
+    tier.fill('test_local_1', 1)
+    assert tier.lookup('test_local_1') == (True, 1)
+    cache.inc(GENERATION_KEY)  # Another process invalidated a key.
+    assert tier.lookup('test_local_1') == (False, None)
+
+
+def test_local_cache_invalidate_sees_other_generation(tier):
+    tier.check_interval = 0
+    tier.fill('test_local_1', 1)
+    tier.fill('test_local_2', 2)
+    assert tier.lookup('test_local_1') == (True, 1)
+    tier.check_interval = 60
+    cache.inc(GENERATION_KEY)  # Another process invalidated a key.
+    tier.invalidate(['test_local_2'])
+    assert tier.lookup('test_local_1') == (False, None)
+
+
+def test_local_cache_serves_forums(app, authed_client):
+    Forum.from_pk(1)  # Populates the shared cache.
+    Forum.from_pk(1)  # Populates the local cache.
+    hits = local_cache.hits
+    assert Forum.from_pk(1).id == 1
+    assert local_cache.hits > hits
+
+
+def test_local_cache_dropped_on_write(app, authed_client):
+    key = ForumCategory.__cache_key__.format(id=1)
+    ForumCategory.from_pk(1)
+    ForumCategory.from_pk(1)
+    assert local_cache.lookup(key)[0]
+    cache.delete(key)
+    assert local_cache.lookup(key) == (False, None)
+
+
+def test_local_cache_write_keeps_generation(app, authed_client):
+    key = ForumCategory.__cache_key__.format(id=1)
+    generation = cache.get(GENERATION_KEY)
+    cache.set(key, {'id': 1, 'name': 'Site'})
+    assert cache.get(GENERATION_KEY) == generation
+    assert local_cache.lookup(key) == (True, {'id': 1, 'name': 'Site'})
+
+
+def test_request_cache_outside_request(app):
+    request_cache.fill(Forum.__cache_key__.format(id=1), {'id': 1})
+    assert request_cache.lookup(Forum.__cache_key__.format(id=1)) == (
+        False,
+        None,
+    )
+
+
+def test_request_cache_per_request(app):
+    key = ForumPost.__cache_key__.format(id=1)
+    with app.test_request_context('/forums/threads/2'):
+        assert request_cache.lookup(key) == (False, None)
+        ForumPost.from_pk(1)
+        found, data = request_cache.lookup(key)
+        assert found and data['id'] == 1
+        cache.delete(key)
+        assert request_cache.lookup(key) == (False, None)
+    with app.test_request_context('/forums/threads/2'):
+        assert request_cache.lookup(key) == (False, None)
+
+
+def test_request_cache_skips_shared_cache(app, monkeypatch):
+    key = ForumPost.__cache_key__.format(id=1)
+    with app.test_request_context('/forums/threads/2'):
+        request_cache.fill(key, {'id': 1})
+        monkeypatch.setattr(
+            local_cache.backend, 'get', lambda key: pytest.fail(key)
+        )
+        assert cache.get(key) == {'id': 1}
+
+
+@pytest.fixture
+def flight(app):
+    flight = SingleFlight(['test_flight_{id}'], wait=0.1, poll_interval=0.01)
+    flight.backend = single_flight.backend
+    return flight
+
+
+def test_single_flight_first_reader_rebuilds(flight):
+    assert flight.miss('test_flight_1') == (False, None)
+    assert cache.get('test_flight_1_lock')
+
+
+def test_single_flight_serves_stale(flight):
+    cache.set('test_flight_1', [1, 2, 3])
+    flight.retire(['test_flight_1'])
+    cache.delete('test_flight_1')
+    assert flight.miss('test_flight_1') == (False, None)  # Takes the lock.
+    assert flight.miss('test_flight_1') == (True, [1, 2, 3])
+
+
+def test_single_flight_waits_without_stale(flight):
+    cache.add('test_flight_1_lock', 1)
+    assert flight.miss('test_flight_1') == (False, None)
+
+
+def test_single_flight_write_releases_lock(flight):
+    flight.miss('test_flight_1')
+    flight.write('test_flight_1', [1])
+    assert not cache.get('test_flight_1_lock')
+
+
+def test_single_flight_thread_list(app, authed_client):
+    key = ForumPost.__cache_key_of_thread_tail__.format(id=3)
+    ForumPost.get_ids_from_thread(3)
+    ForumPost.new(thread_id=3, user_id=1, contents='NewForumPost')
+    assert id_lists.decode(cache.get(f'{key}_stale')) == [2]
+    assert ForumPost.get_ids_from_thread(3) == [2, 9]
+    assert not cache.get(f'{key}_lock')
+
+
+@pytest.fixture
+def chunked(app):
+    ids = list(range(1, 12))
+    queries = []
+
+    def query(lower, upper):
+        queries.append((lower, upper))
+        return [i for i in ids if i >= lower and (upper is None or i < upper)]
+
+    chunked = ChunkedIdList(
+        key='test_chunked',
+        chunk_key='test_chunked_chunk_{chunk}',
+        tail_key='test_chunked_tail',
+        query=query,
+        chunk_size=4,
+    )
+    chunked.ids, chunked.queries = ids, queries
+    return chunked
+
+
+def test_chunked_id_list_build(chunked):
+    assert chunked.all() == list(range(1, 12))
+    assert cache.get('test_chunked') == {
+        'count': 8,
+        'boundaries': [0, 5, 9],
+    }
+    assert cache.get('test_chunked_chunk_0') == [1, 2, 3, 4]
+    assert cache.get('test_chunked_chunk_1') == [5, 6, 7, 8]
+    assert cache.get('test_chunked_tail') == [9, 10, 11]
+    assert chunked.queries == [(0, None)]
+
+
+@pytest.mark.parametrize(
+    'start, stop, expected',
+    [(0, 3, [1, 2, 3]), (3, 6, [4, 5, 6]), (6, 20, [7, 8, 9, 10, 11])],
+)
+def test_chunked_id_list_slice(chunked, start, stop, expected):
+    chunked.all()
+    cache.delete('test_chunked_chunk_0')
+    assert chunked.slice(start, stop) == expected
+    assert chunked.slice(20, 30) == []
+
+
+def test_chunked_id_list_refetches_chunk(chunked):
+    chunked.all()
+    cache.delete('test_chunked_chunk_1')
+    assert chunked.slice(4, 6) == [5, 6]
+    assert chunked.queries == [(0, None), (5, 9)]
+    assert cache.get('test_chunked_chunk_1') == [5, 6, 7, 8]
+
+
+def test_chunked_id_list_rebuilds_short_chunk(chunked):
+    chunked.all()
+    chunked.ids.remove(6)
+    cache.delete('test_chunked_chunk_1')
+    assert chunked.slice(4, 6) == [5, 7]
+    assert chunked.queries == [(0, None), (5, 9), (0, None)]
+    assert cache.get('test_chunked')['boundaries'] == [0, 5, 10]
+
+
+def test_chunked_id_list_append_touches_tail(chunked):
+    chunked.all()
+    chunked.ids.append(12)
+    cache.delete('test_chunked_tail')
+    assert chunked.slice(8, 12) == [9, 10, 11, 12]
+    assert chunked.queries == [(0, None), (9, None)]
+    assert cache.get('test_chunked_tail') == []
+    assert cache.get('test_chunked_chunk_2') == [9, 10, 11, 12]
+    assert cache.get('test_chunked')['boundaries'] == [0, 5, 9, 13]
+    assert chunked.all() == list(range(1, 13))
+
+
+def test_chunked_id_list_ignores_legacy_value(chunked):
+    cache.set('test_chunked', [1, 2, 3])
+    assert chunked.slice(0, 2) == [1, 2]
+    assert chunked.queries == [(0, None)]
+
+
+def test_thread_post_list_new_post_keeps_chunks(app, authed_client):
+    ForumPost.get_ids_from_thread(3)
+    header = cache.get(ForumPost.__cache_key_of_thread__.format(id=3))
+    ForumPost.new(thread_id=3, user_id=1, contents='NewForumPost')
+    assert header == cache.get(ForumPost.__cache_key_of_thread__.format(id=3))
+    posts = ForumPost.from_thread(3, page=1, limit=50)
+    assert [p.id for p in posts] == [2, 9]
+
+
+def test_invalidate_after_commit(app, authed_client):
+    cache.set('test_invalidate_1', 1)
+    cache.set('test_invalidate_2', 2)
+    invalidate('test_invalidate_1', 'test_invalidate_2')
+    invalidate('test_invalidate_1')
+    assert cache.get('test_invalidate_1') == 1
+    db.session.commit()
+    assert cache.get('test_invalidate_1') is None
+    assert cache.get('test_invalidate_2') is None
+
+
+def test_invalidate_dropped_on_rollback(app, authed_client):
+    cache.set('test_invalidate_1', 1)
+    invalidate('test_invalidate_1')
+    db.session.rollback()
+    db.session.commit()
+    assert cache.get('test_invalidate_1') == 1
+
+
+def test_invalidate_kept_on_savepoint_rollback(app, authed_client):
+    cache.set('test_invalidate_1', 1)
+    invalidate('test_invalidate_1')
+    db.session.begin_nested().rollback()
+    db.session.commit()
+    assert cache.get('test_invalidate_1') is None
+
+
+def test_invalidate_model_keys_on_commit(app, authed_client):
+    key = ForumSubscription.__cache_key_users__.format(forum_id=2)
+    assert ForumSubscription.user_ids_from_forum(2) == [1]
+    ForumSubscription.new(user_id=2, forum_id=2)
+    assert not cache.get(key)
+    assert set(ForumSubscription.user_ids_from_forum(2)) == {1, 2}
+
+
+def test_cache_metrics_family():
+    metrics = CacheMetrics(['forums_{id}', 'forums_{id}_thread_count'])
+    assert metrics.family('forums_1') == 'forums_{id}'
+    assert (
+        metrics.family('forums_1_thread_count') == 'forums_{id}_thread_count'
+    )
+    assert metrics.family('users_1') == 'other'
+
+
+def test_cache_metrics_record():
+    metrics = CacheMetrics(['forums_{id}'])
+    metrics.record('forums_1', 'hits', seconds=0.5)
+    metrics.record('forums_2', 'sets', size=10)
+    counters = metrics.snapshot()['forums_{id}']
+    assert counters['hits'] == 1
+    assert counters['sets'] == 1
+    assert counters['bytes'] == 10
+    assert counters['seconds'] == 0.5
+    metrics.reset()
+    assert metrics.snapshot() == {}
+
+
+def test_cache_metrics_sample_write_sizes():
+    metrics = CacheMetrics(['forums_{id}'])
+    metrics.sample_rate = 2
+    metrics.record_write('forums_1', b'abcd')
+    for _ in range(3):
+        metrics.record_write('forums_2', {'id': 2})
+    counters = metrics.snapshot()['forums_{id}']
+    assert counters['sets'] == 4
+    assert counters['bytes'] == 4 + 2 * len(
+        pickle.dumps({'id': 2}, pickle.HIGHEST_PROTOCOL)
+    )
+
+
+def test_cache_metrics_installed(app, authed_client):
+    cache_metrics.reset()
+    ForumThread.from_pk(1)
+    ForumThread.from_pk(1)
+    counters = cache_metrics.snapshot()[ForumThread.__cache_key__]
+    assert counters['sets'] == 1
+    assert counters['hits'] + counters['tier_hits'] >= 1
+
+
+def test_cache_metrics_skip_other_keys(app, authed_client):
+    cache_metrics.reset()
+    cache.set('test_other_key', [1, 2])
+    assert cache.get('test_other_key') == [1, 2]
+    cache.delete('test_other_key')
+    assert cache_metrics.snapshot() == {}
+
+
+def test_view_cache_stats(app, authed_client):
+    add_permissions(app, 'forums_view_stats')
+    ForumThread.from_pk(1)
+    response = authed_client.get('/forums/stats/cache').get_json()
+    assert ForumThread.__cache_key__ in response['response']['families']
+    assert 'hit_rate' in response['response']['local_cache']
+
+
+def test_view_cache_stats_no_permission(app, authed_client):
+    response = authed_client.get('/forums/stats/cache')
+    assert response.status_code == 403
@@ -0,0 +1,49 @@
+import pytest
+
+from core import cache
+from forums.caching import single_flight
+from forums.codec import ABSOLUTE, DELTA, HEADER, decode_ids, encode_ids
+from forums.models import ForumThread
+
+
+@pytest.mark.parametrize(
+    'ids, mode',
+    [
+        ([1, 2, 3], DELTA),
+        ([7], DELTA),
+        ([4, 4, 9], DELTA),
+        ([9, 2, 5], ABSOLUTE),
+        ([2 ** 40, 2 ** 40 + 300], DELTA),
+        ([2 ** 40, 3], ABSOLUTE),
+        (list(range(0, 3_000_000, 3)), DELTA),
+    ],
+)
+def test_encode_ids_round_trip(ids, mode):
+    encoded = encode_ids(ids)
+    assert encoded[3:4] == mode
+    assert decode_ids(encoded) == ids
+
+
+def test_encode_ids_sorted_uses_narrow_items():
+    ids = list(range(1_000_000, 1_001_000))
+    assert len(encode_ids(ids)) == HEADER.size + len(ids) - 1
+
+
+@pytest.mark.parametrize(
+    'value', [[], ['1', '6'], [True], [-1], [2 ** 64], (1, 2), None, 5]
+)
+def test_encode_ids_unsupported(value):
+    assert encode_ids(value) is None
+
+
+def test_id_list_stored_encoded(app, authed_client):
+    key = ForumThread.__cache_key_of_forum__.format(id=1)
+    ForumThread.get_ids_from_forum(1)
+    assert isinstance(single_flight.backend.get(key), bytes)
+    assert cache.get(key) == ForumThread.get_ids_from_forum(1)
+
+
+def test_id_list_strings_stored_as_is(app, authed_client):
+    key = ForumThread.__cache_key_of_forum__.format(id=1)
+    cache.set(key, ['1', '5'])
+    assert cache.get(key) == ['1', '5']
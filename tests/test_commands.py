@@ -0,0 +1,117 @@
+from core import cache, db
+from forums.models import Forum, ForumPost, ForumThread, ForumUserStats
+from forums.search import BACKFILL_CHECKPOINT_KEY
+from forums.test_data import ForumsGenerator
+
+
+def test_recompute_stats(app, client):
+    ForumUserStats.recompute([1])
+    db.session.commit()
+    db.engine.execute('UPDATE forums_users_stats SET post_count = 99')
+    result = app.test_cli_runner().invoke(
+        args=['forums', 'recompute-stats', '--chunk-size', '2']
+    )
+    assert result.exit_code == 0
+    assert 'Recomputed forum stats of' in result.output
+    assert ForumUserStats.from_user(1) == {'post_count': 4, 'thread_count': 4}
+
+
+def test_warmup(app, client):
+    result = app.test_cli_runner().invoke(
+        args=['forums', 'warmup', '--workers', '2', '--pages', '1']
+    )
+    assert result.exit_code == 0
+    assert 'Loaded 5 forums' in result.output
+    assert cache.get(Forum.__cache_key_thread_count__.format(id=1)) == 1
+    assert cache.get(Forum.__cache_key_thread_count__.format(id=4)) == 0
+    assert cache.get(ForumThread.__cache_key_post_count__.format(id=4)) == 2
+    assert cache.get(ForumThread.__cache_key_of_forum__.format(id=2))
+    assert cache.get(Forum.__cache_key_last_updated__.format(id=1)) == (
+        ForumThread.from_query(
+            filter=ForumThread.forum_id == 1,
+            order=ForumThread.last_updated.desc(),
+        ).id
+    )
+
+
+def _indexed_post_ids():
+    return [
+        id
+        for id, in db.engine.execute(
+            'SELECT id FROM forums_posts WHERE search_document IS NOT NULL '
+            'ORDER BY id'
+        )
+    ]
+
+
+def test_search_backfill(app, client):
+    db.engine.execute('UPDATE forums_posts SET search_document = NULL')
+    result = app.test_cli_runner().invoke(
+        args=['forums', 'search-backfill', '--chunk-size', '3']
+    )
+    assert result.exit_code == 0
+    assert 'Indexed posts up to 3.' in result.output
+    assert 'Search backfill complete.' in result.output
+    assert _indexed_post_ids() == [2, 3, 7, 8]  # The others are deleted.
+    assert cache.get(BACKFILL_CHECKPOINT_KEY) is None
+
+
+def test_search_backfill_resumes(app, client):
+    db.engine.execute('UPDATE forums_posts SET search_document = NULL')
+    cache.set(BACKFILL_CHECKPOINT_KEY, 5)
+    result = app.test_cli_runner().invoke(args=['forums', 'search-backfill'])
+    assert result.exit_code == 0
+    assert 'Resuming after post 5.' in result.output
+    assert _indexed_post_ids() == [7, 8]
+
+
+def _generated_posts():
+    return db.session.execute(
+        'SELECT id, thread_id, user_id, contents, time FROM forums_posts '
+        'WHERE id > 8 ORDER BY id'
+    ).fetchall()
+
+
+def test_generate(app, client):
+    result = app.test_cli_runner().invoke(
+        args=[
+            'forums',
+            'generate',
+            '--categories',
+            '2',
+            '--forums',
+            '4',
+            '--threads',
+            '10',
+            '--posts',
+            '100',
+        ]
+    )
+    assert result.exit_code == 0
+    assert 'Generated 100 rows of forums_posts.' in result.output
+    posts = _generated_posts()
+    assert len(posts) == 100
+    assert len({p.thread_id for p in posts}) == 10
+    forums = db.session.execute('SELECT id FROM forums WHERE id > 6')
+    assert len(forums.fetchall()) == 4
+    ForumPost.new(thread_id=posts[0].thread_id, user_id=1, contents='New')
+    assert ForumPost.from_pk(109).contents == 'New'
+
+
+def test_generate_deterministic(app, client):
+    ForumsGenerator.generate(forums=4, threads=10, posts=100, seed=3)
+    first = _generated_posts()
+    db.session.rollback()
+    ForumsGenerator.generate(forums=4, threads=10, posts=100, seed=3)
+    assert _generated_posts() == first
+    db.session.rollback()
+    ForumsGenerator.generate(forums=4, threads=10, posts=100, seed=4)
+    assert _generated_posts() != first
+
+
+def test_generate_requires_posts(app, client):
+    result = app.test_cli_runner().invoke(
+        args=['forums', 'generate', '--threads', '10', '--posts', '5']
+    )
+    assert result.exit_code == 1
+    assert 'Every thread needs a forum and a post.' in result.output
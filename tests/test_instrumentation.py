@@ -0,0 +1,85 @@
+import pytest
+
+from conftest import add_permissions, budget
+from core import cache, db
+from forums.caching import local_cache
+from forums.instrumentation import Counter, ReportBuffer
+
+# The budgets of a request on a cold cache: a number of SQL statements, which
+# must not grow with the page size, and a number of cache calls, which may grow
+# by a few keys per row of the page.
+BUDGETS = {
+    '/forums/1': {'statements': 25, 'cache_calls': 50, 'per_row': 6},
+    '/forums/threads/1': {'statements': 25, 'cache_calls': 50, 'per_row': 6},
+}
+
+
+def test_counter(app, client):
+    with Counter() as outer:
+        db.session.execute('SELECT 1')
+        with Counter() as inner:
+            cache.get('forums_1000')
+    assert outer.statements == ['SELECT 1']
+    assert inner.statements == []
+    assert (outer.statement_count, outer.cache_call_count) == (1, 1)
+    assert outer.cache_calls == inner.cache_calls == [
+        ('misses', 'forums_1000')
+    ]
+    db.session.execute('SELECT 2')
+    assert outer.statements == ['SELECT 1']
+
+
+def test_counter_without_calls(app, client):
+    with Counter(keep_calls=False) as counter:
+        db.session.execute('SELECT 1')
+        cache.get('forums_1000')
+    assert counter.statements == counter.cache_calls == []
+    assert (counter.statement_count, counter.cache_call_count) == (1, 1)
+
+
+def test_report_buffer():
+    reports = ReportBuffer(size=2)
+    ids = [reports.add({'stats': str(i)}) for i in range(3)]
+    assert ids == [1, 2, 3]
+    assert reports.get(1) is None
+    assert reports.get(3) == {'id': 3, 'stats': '2'}
+    assert [r['id'] for r in reports.all()] == [3, 2]
+
+
+def test_budget_lists_statements(app, client):
+    with pytest.raises(AssertionError) as e:
+        with budget(statements=1):
+            db.session.execute('SELECT 1')
+            db.session.execute('SELECT 2')
+    assert str(e.value).startswith(
+        '2 SQL statements, over the budget of 1:\nSELECT 1\nSELECT 2'
+    )
+
+
+@pytest.mark.parametrize('path', list(BUDGETS))
+@pytest.mark.parametrize('limit', [25, 50, 100])
+def test_request_budgets(app, authed_client, path, limit):
+    add_permissions(app, 'forums_view')
+    db.session.execute(
+        """INSERT INTO forums_threads (topic, forum_id, creator_id)
+        SELECT 'Thread ' || i, 1, 1 + MOD(i, 2)
+        FROM generate_series(1, 110) AS i"""
+    )
+    db.session.execute(
+        """INSERT INTO forums_posts (thread_id, user_id, contents)
+        SELECT 1, 1 + MOD(i, 2), 'Post ' || i
+        FROM generate_series(1, 110) AS i"""
+    )
+    db.session.commit()
+    cache.clear()
+    local_cache.clear()
+
+    allowed = BUDGETS[path]
+    with budget(
+        statements=allowed['statements'],
+        cache_calls=allowed['cache_calls'] + allowed['per_row'] * limit,
+    ):
+        response = authed_client.get(path, query_string={'limit': limit})
+    assert response.status_code == 200
+    rows = response.get_json()['response']
+    assert len(rows['threads' if 'threads' in rows else 'posts']) == limit
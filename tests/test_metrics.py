@@ -0,0 +1,71 @@
+import re
+
+import pytest
+
+from conftest import add_permissions
+from forums import routes
+from forums.metrics import Histogram, instrument, request_metrics
+
+
+@pytest.fixture(autouse=True)
+def reset_request_metrics():
+    request_metrics.reset()
+    yield
+    request_metrics.reset()
+
+
+def test_histogram_render():
+    histogram = Histogram('test_seconds', 'Test.', buckets=(0.1, 1.0))
+    labels = (('endpoint', 'a"b'),)
+    for value in (0.05, 0.1, 0.5, 5.0):
+        histogram.observe(labels, value)
+    assert list(histogram.render()) == [
+        '# HELP test_seconds Test.',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{endpoint="a\\"b",le="0.1"} 2',
+        'test_seconds_bucket{endpoint="a\\"b",le="1.0"} 3',
+        'test_seconds_bucket{endpoint="a\\"b",le="+Inf"} 4',
+        'test_seconds_sum{endpoint="a\\"b"} 5.65',
+        'test_seconds_count{endpoint="a\\"b"} 4',
+    ]
+
+
+def test_view_metrics(app, authed_client):
+    add_permissions(app, 'forums_view', 'forums_view_stats')
+    authed_client.get('/forums/1')
+    authed_client.get('/forums/1')
+    authed_client.get('/forums/999')
+    response = authed_client.get('/forums/stats/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    body = response.get_data(as_text=True)
+    labels = '{endpoint="forums.view_forum",status="200"}'
+    assert f'forums_request_seconds_count{labels} 2' in body
+    missing = '{endpoint="forums.view_forum",status="404"}'
+    assert f'forums_request_seconds_count{missing} 1' in body
+    statements = re.search(
+        rf'forums_request_sql_statements_total{re.escape(labels)} (\d+)', body
+    )
+    assert int(statements.group(1)) > 0
+    serialization = re.search(
+        rf'forums_request_serialization_seconds_sum{re.escape(labels)} (\S+)',
+        body,
+    )
+    assert float(serialization.group(1)) > 0
+    assert '# TYPE forums_cache_calls_total counter' in body
+
+
+def test_instrument_twice(app, authed_client):
+    add_permissions(app, 'forums_view', 'forums_view_stats')
+    encoder = app.json_encoder
+    instrument(app, routes.bp)
+    assert app.json_encoder is encoder
+    authed_client.get('/forums/1')
+    body = authed_client.get('/forums/stats/metrics').get_data(as_text=True)
+    labels = '{endpoint="forums.view_forum",status="200"}'
+    assert f'forums_request_seconds_count{labels} 1' in body
+
+
+def test_view_metrics_no_permission(app, authed_client):
+    response = authed_client.get('/forums/stats/metrics')
+    assert response.status_code == 403
@@ -1,6 +1,7 @@
 import pytest
 
-from core import APIException, _403Exception, db
+from core import APIException, _403Exception, cache, db
+from forums.caching import NOT_FOUND
 from forums.models import ForumPoll, ForumPollAnswer, ForumPollChoice
 
 
@@ -14,6 +15,27 @@ def test_forum_poll_from_thread(app, authed_client):
     assert poll.id == 1
 
 
+def test_forum_poll_from_thread_cached(app, authed_client):
+    cache_key = ForumPoll.__cache_key_of_thread__.format(thread_id=1)
+    ForumPoll.from_thread(1)
+    assert cache.get(cache_key) == 1
+    assert ForumPoll.from_thread(1).id == 1
+
+
+def test_forum_poll_from_thread_none_cached(app, authed_client):
+    assert ForumPoll.from_thread(5) is None
+    cache_key = ForumPoll.__cache_key_of_thread__.format(thread_id=5)
+    assert cache.get(cache_key) == NOT_FOUND
+    assert cache.ttl(cache_key) <= 600
+    assert ForumPoll.from_thread(5) is None
+
+
+def test_forum_poll_new_clears_negative_cache(app, authed_client):
+    assert ForumPoll.from_thread(5) is None
+    ForumPoll.new(thread_id=5, question='Una pregunta')
+    assert ForumPoll.from_thread(5).id == 5
+
+
 def test_forum_poll_from_featured(app, authed_client):
     poll = ForumPoll.get_featured()
     assert poll.id == 3
@@ -108,3 +130,100 @@ def test_poll_no_permissions(app, authed_client):
     )
     with pytest.raises(_403Exception):
         ForumPoll.from_pk(3, error=True)
+
+
+def test_poll_choices_populate_answers(app, authed_client):
+    choices = ForumPoll.from_pk(1).choices
+    assert {1: 2, 2: 1, 3: 0} == {c.id: c.answers for c in choices}
+    assert cache.get(ForumPollChoice.__cache_key_answers__.format(id=1)) == 2
+    assert cache.get(ForumPollChoice.__cache_key_answers__.format(id=3)) == 0
+
+
+def test_poll_choices_populate_answers_from_cache(app, authed_client):
+    cache.set(ForumPollChoice.__cache_key_answers__.format(id=4), 7)
+    cache.set(ForumPollChoice.__cache_key_answers__.format(id=5), 3)
+    choices = ForumPoll.from_pk(2).choices
+    assert {4: 7, 5: 3} == {c.id: c.answers for c in choices}
+
+
+def test_poll_answer_vote(app, authed_client):
+    ForumPollChoice.from_pk(6).answers  # cache it
+    assert ForumPollAnswer.vote(user_id=2, choice_id=6) == 3
+    answer = ForumPollAnswer.from_attrs(poll_id=3, user_id=2)
+    assert answer.choice_id == 6
+    assert ForumPollChoice.from_pk(6).answers == 1
+
+
+def test_poll_answer_vote_already_voted(app, authed_client):
+    with pytest.raises(APIException) as e:
+        ForumPollAnswer.vote(user_id=2, choice_id=3)
+    assert e.value.message == 'You have already voted on this poll.'
+    assert ForumPollAnswer.from_attrs(poll_id=1, user_id=2).choice_id == 2
+
+
+def test_poll_answer_vote_nonexistent_choice(app, authed_client):
+    with pytest.raises(APIException) as e:
+        ForumPollAnswer.vote(user_id=2, choice_id=100)
+    assert e.value.message == 'ForumPollChoice 100 does not exist.'
+
+
+def test_poll_results_open(app, authed_client):
+    assert ForumPoll.from_pk(1).results is None
+
+
+def test_poll_results_closed(app, authed_client):
+    db.engine.execute("UPDATE forums_polls SET closed = 't' WHERE id = 1")
+    poll = ForumPoll.from_pk(1)
+    assert poll.results == {
+        'question': 'Question 1',
+        'choices': [
+            {'id': 1, 'choice': 'Choice A', 'answers': 2},
+            {'id': 2, 'choice': 'Choice B', 'answers': 1},
+            {'id': 3, 'choice': 'Choice C', 'answers': 0},
+        ],
+        'total': 3,
+    }
+    assert cache.ttl(ForumPoll.__cache_key_results__.format(id=1)) == -1
+
+
+def test_poll_choices_closed_served_from_results(app, authed_client):
+    cache.set(
+        ForumPoll.__cache_key_results__.format(id=4),
+        {'question': 'Question 4', 'choices': [], 'total': 0},
+        timeout=0,
+    )
+    poll = ForumPoll.from_pk(4)
+    assert poll.choices == []
+    assert poll.results['total'] == 0
+
+
+def test_poll_clear_results(app, authed_client):
+    poll = ForumPoll.from_pk(4)
+    poll.freeze_results()
+    poll.clear_results()
+    assert not cache.get(ForumPoll.__cache_key_results__.format(id=4))
+
+
+def test_poll_answer_vote_closed(app, authed_client):
+    db.engine.execute("UPDATE forums_polls SET closed = 't' WHERE id = 3")
+    with pytest.raises(APIException) as e:
+        ForumPollAnswer.vote(user_id=2, choice_id=6)
+    assert e.value.message == 'You cannot vote on a closed poll.'
+
+
+def test_poll_answer_voted_choices(app, authed_client):
+    assert ForumPollAnswer.voted_choices(1) == {1: 1, 2: 4}
+    assert cache.get(
+        ForumPollAnswer.__cache_key_of_user__.format(user_id=1)
+    ) == {1: 1, 2: 4}
+
+
+def test_poll_answer_voted_choices_updated_on_vote(app, authed_client):
+    assert ForumPollAnswer.voted_choices(2) == {1: 2}
+    ForumPollAnswer.vote(user_id=2, choice_id=6)
+    assert ForumPollAnswer.voted_choices(2) == {1: 2, 3: 6}
+
+
+def test_poll_voted_choice_id(app, authed_client):
+    assert ForumPoll.from_pk(1).voted_choice_id == 1
+    assert ForumPoll.from_pk(3).voted_choice_id is None
@@ -1,9 +1,9 @@
 import pytest
 
 from conftest import add_permissions, check_dictionary
-from core import APIException, NewJSONEncoder, cache
+from core import APIException, NewJSONEncoder, cache, db
 from core.users.models import User
-from forums.models import ForumPost, ForumPostEditHistory
+from forums.models import ForumPost, ForumPostEditHistory, ForumUserStats
 
 
 def test_user_post_count(app, client):
@@ -11,6 +11,28 @@ def test_user_post_count(app, client):
     assert user.forum_post_count == 4
 
 
+def test_user_post_count_new_post(app, authed_client):
+    assert ForumUserStats.from_user(1)['post_count'] == 4
+    ForumPost.new(thread_id=3, user_id=1, contents='NewForumPost')
+    assert ForumUserStats.from_user(1)['post_count'] == 5
+
+
+def test_user_stats_without_row(app, authed_client):
+    assert ForumUserStats.from_user(2) == {'post_count': 4, 'thread_count': 1}
+    assert ForumUserStats.query.get(2) is None
+
+
+def test_user_stats_recompute(app, authed_client):
+    ForumUserStats.recompute([2])
+    db.session.commit()
+    db.engine.execute(
+        'UPDATE forums_users_stats SET post_count = 99 WHERE user_id = 2'
+    )
+    ForumUserStats.recompute([2])
+    db.session.commit()
+    assert ForumUserStats.from_user(2) == {'post_count': 4, 'thread_count': 1}
+
+
 def test_post_from_pk_deleted(app, authed_client):
     assert ForumPost.from_pk(4) is None
 
@@ -51,6 +73,38 @@ def test_post_get_from_thread_cached(app, authed_client):
         raise AssertionError('A real post not called')
 
 
+def test_post_get_from_thread_skips_deleted(app, authed_client):
+    assert [p.id for p in ForumPost.from_thread(4, page=1, limit=1)] == [7]
+    assert [p.id for p in ForumPost.from_thread(4, page=2, limit=1)] == [8]
+    assert ForumPost.get_ids_from_thread(4) == [7, 8]
+
+
+def test_post_get_from_thread_include_dead(app, authed_client):
+    posts = ForumPost.from_thread(4, page=1, limit=2, include_dead=True)
+    assert [p.id for p in posts] == [5, 7]
+
+
+def test_post_delete_invalidates_thread_ids(app, authed_client):
+    assert ForumPost.get_ids_from_thread(4) == [7, 8]
+    ForumPost.from_pk(7).deleted = True
+    db.session.commit()
+    assert ForumPost.get_ids_from_thread(4) == [8]
+    ForumPost.from_pk(5, include_dead=True).deleted = False
+    db.session.commit()
+    assert ForumPost.get_ids_from_thread(4) == [5, 8]
+
+
+def test_post_from_cache_keeps_thread_ids(app, authed_client):
+    cache.cache_model(ForumPost.from_pk(7), timeout=60)
+    assert ForumPost.get_ids_from_thread(4) == [7, 8]
+    db.session.expunge_all()
+    post = ForumPost.from_pk(7)
+    assert post.contents
+    db.session.commit()
+    key = ForumPost.__cache_key_of_thread__.format(id=4)
+    assert isinstance(cache.get(key), dict)
+
+
 def test_new_post(app, authed_client):
     post = ForumPost.new(thread_id=3, user_id=1, contents='NewForumPost')
     assert post.thread_id == 3
@@ -5,11 +5,13 @@ import pytest
 from conftest import add_permissions, check_dictionary, check_json_response
 from core import APIException, NewJSONEncoder, _403Exception, cache, db
 from core.users.models import User
+from forums.caching import NOT_FOUND
 from forums.models import (
     ForumLastViewedPost,
     ForumPost,
     ForumThread,
     ForumThreadSubscription,
+    ForumUserStats,
 )
 
 
@@ -18,6 +20,14 @@ def test_user_thread_count(app, client):
     assert user.forum_thread_count == 4
 
 
+def test_user_thread_count_new_thread(app, authed_client):
+    assert User.from_pk(2).forum_thread_count == 1
+    ForumThread.new(
+        topic='NewThread', forum_id=1, creator_id=2, post_contents='aaaa'
+    )
+    assert ForumUserStats.from_user(2) == {'post_count': 5, 'thread_count': 2}
+
+
 def test_thread_from_pk(app, authed_client):
     thread = ForumThread.from_pk(1)
     assert thread.id == 1
@@ -188,11 +198,20 @@ def test_thread_last_post_already_cached(app, authed_client):
 def test_thread_last_viewed_post_none(app, authed_client):
     thread = ForumThread.from_pk(1)
     assert thread.last_viewed_post is None
-    assert not cache.get(
+    assert NOT_FOUND == cache.get(
         ForumLastViewedPost.__cache_key__.format(thread_id=1, user_id=1)
     )
 
 
+def test_thread_last_viewed_post_none_cached(app, authed_client):
+    cache.set(
+        ForumLastViewedPost.__cache_key__.format(thread_id=3, user_id=1),
+        NOT_FOUND,
+    )
+    thread = ForumThread.from_pk(3)
+    assert thread.last_viewed_post is None
+
+
 def test_thread_last_viewed_post(app, authed_client):
     thread = ForumThread.from_pk(3)
     last_post = thread.last_viewed_post
@@ -0,0 +1,62 @@
+import pytest
+
+from conftest import add_permissions
+from forums.profiling import PROFILE_ID_HEADER, profile_reports
+
+
+@pytest.fixture(autouse=True)
+def clear_profile_reports():
+    profile_reports.clear()
+    yield
+    profile_reports.clear()
+
+
+def test_profile_request(app, authed_client):
+    add_permissions(app, 'forums_view', 'forums_profile_requests')
+    response = authed_client.get(
+        '/forums/threads/4', headers={'X-Forums-Profile': '1'}
+    )
+    assert response.status_code == 200
+    profile_id = response.headers[PROFILE_ID_HEADER]
+
+    report = authed_client.get(f'/forums/stats/profiles/{profile_id}')
+    report = report.get_json()['response']
+    assert report['endpoint'] == 'forums.view_thread'
+    assert report['status'] == 200
+    assert 'function calls' in report['stats']
+    assert set(report['phases']) == {
+        'permissions',
+        'sql',
+        'cache',
+        'serialization',
+        'json_encode',
+    }
+    assert report['phases']['permissions'] > 0
+    assert report['phases']['serialization'] > 0
+
+    summaries = authed_client.get('/forums/stats/profiles').get_json()
+    assert [s['id'] for s in summaries['response']] == [int(profile_id)]
+    assert 'stats' not in summaries['response'][0]
+
+
+def test_profile_request_without_header(app, authed_client):
+    add_permissions(app, 'forums_view', 'forums_profile_requests')
+    response = authed_client.get('/forums/threads/4')
+    assert PROFILE_ID_HEADER not in response.headers
+    assert not profile_reports.all()
+
+
+def test_profile_request_no_permission(app, authed_client):
+    add_permissions(app, 'forums_view')
+    response = authed_client.get(
+        '/forums/threads/4', headers={'X-Forums-Profile': '1'}
+    )
+    assert response.status_code == 200
+    assert PROFILE_ID_HEADER not in response.headers
+    assert authed_client.get('/forums/stats/profiles').status_code == 403
+
+
+def test_view_profile_missing(app, authed_client):
+    add_permissions(app, 'forums_profile_requests')
+    response = authed_client.get('/forums/stats/profiles/99')
+    assert response.status_code == 404
@@ -0,0 +1,195 @@
+import pytest
+
+from conftest import add_permissions
+from core import APIException, db
+from forums.models import ForumPost, ForumThread
+from forums.search import (
+    INDEX_POSTS_KEY,
+    accessible_forum_ids,
+    search_posts,
+    search_threads,
+)
+
+
+def _document(post_id):
+    return db.session.execute(
+        'SELECT search_document FROM forums_posts WHERE id = :id',
+        {'id': post_id},
+    ).scalar()
+
+
+def _remove_forum_permissions():
+    db.engine.execute(
+        "DELETE FROM users_permissions WHERE permission LIKE 'forumaccess%%'"
+    )
+
+
+def test_search_posts(app, authed_client):
+    results, cursor = search_posts('gazelle')
+    assert [r['post'].id for r in results] == [2]  # Post 5 is deleted.
+    assert '<mark>Gazelle</mark>' in results[0]['snippet']
+    assert results[0]['rank'] > 0
+    assert cursor is None
+
+
+def test_search_posts_deleted_thread(app, authed_client):
+    results, _ = search_posts('delete')
+    assert [r['post'].id for r in results] == [7]
+
+
+@pytest.mark.parametrize(
+    'kwargs, expected',
+    [
+        ({'forum_id': 2}, [2]),
+        ({'forum_id': 1}, []),
+        ({'thread_id': 3}, [2]),
+        ({'user_id': 2}, []),
+    ],
+)
+def test_search_posts_filters(app, authed_client, kwargs, expected):
+    results, _ = search_posts('gazelle', **kwargs)
+    assert [r['post'].id for r in results] == expected
+
+
+def test_search_posts_strips_bbcode(app, authed_client):
+    ForumPost.new(thread_id=4, user_id=1, contents='[b]Yacht[/b] party')
+    results, _ = search_posts('yacht')
+    assert [r['post'].id for r in results] == [9]
+    assert '[b]' not in results[0]['snippet']
+    assert '<mark>Yacht</mark>' in results[0]['snippet']
+    assert not search_posts('b')[0]
+
+
+def test_search_posts_skips_quotes(app, authed_client):
+    ForumPost.new(
+        thread_id=4, user_id=1, contents='[quote=user]Yacht[/quote] Agreed'
+    )
+    assert not search_posts('yacht')[0]
+    assert [r['post'].id for r in search_posts('agreed')[0]] == [9]
+
+
+def test_search_posts_snippet_skips_quotes(app, authed_client):
+    ForumPost.new(
+        thread_id=4,
+        user_id=1,
+        contents='[quote=user]Yacht club[/quote] The yacht sank',
+    )
+    results, _ = search_posts('yacht')
+    assert [r['post'].id for r in results] == [9]
+    assert 'The <mark>yacht</mark> sank' in results[0]['snippet']
+    assert 'club' not in results[0]['snippet']
+
+
+def test_search_index_follows_edit(app, authed_client):
+    post = ForumPost.from_pk(2)
+    post.contents = 'Submarines are cool'
+    db.session.commit()
+    assert [r['post'].id for r in search_posts('submarine')[0]] == [2]
+    assert not search_posts('gazelle')[0]
+
+
+def test_search_index_skips_unchanged(app, authed_client):
+    post = ForumPost.from_pk(2)
+    post.contents = post.contents
+    post.sticky = False
+    db.session.flush()
+    assert not db.session.info.get(INDEX_POSTS_KEY)
+
+
+def test_search_index_follows_delete(app, authed_client):
+    ForumPost.from_pk(7).deleted = True
+    db.session.commit()
+    assert not _document(7)
+    assert _document(8)
+
+
+def test_search_index_follows_thread_delete(app, authed_client):
+    ForumThread.from_pk(4).deleted = True
+    db.session.commit()
+    assert not _document(7)
+    assert not _document(8)
+
+
+def test_search_index_dropped_on_rollback(app, authed_client):
+    ForumPost.from_pk(7).deleted = True
+    db.session.flush()
+    assert db.session.info[INDEX_POSTS_KEY] == {7}
+    db.session.rollback()
+    assert INDEX_POSTS_KEY not in db.session.info
+
+
+def test_search_index_kept_on_savepoint_rollback(app, authed_client):
+    ForumPost.from_pk(2).contents = 'Submarines are cool'
+    db.session.flush()
+    db.session.begin_nested().rollback()
+    db.session.commit()
+    assert [r['post'].id for r in search_posts('submarine')[0]] == [2]
+
+
+def test_search_posts_pages(app, authed_client):
+    for contents in ('yacht', 'yacht yacht', 'yacht', 'yacht'):
+        ForumPost.new(thread_id=4, user_id=1, contents=contents)
+    seen, cursor = [], None
+    for _ in range(2):
+        results, cursor = search_posts('yacht', cursor=cursor, limit=2)
+        seen += [r['post'].id for r in results]
+    assert cursor is None
+    assert seen[0] == 10  # The highest ranked post comes first.
+    assert sorted(seen) == [9, 10, 11, 12]
+
+
+def test_search_posts_invalid_cursor(app, authed_client):
+    with pytest.raises(APIException):
+        search_posts('yacht', cursor='abc')
+
+
+def test_search_posts_no_forum_access(app, authed_client):
+    _remove_forum_permissions()
+    add_permissions(app, 'forumaccess_forum_1')
+    assert accessible_forum_ids() == {1}
+    assert not search_posts('gazelle')[0]
+
+
+def test_search_posts_explicit_thread_access(app, authed_client):
+    _remove_forum_permissions()
+    add_permissions(app, 'forumaccess_thread_3')
+    results, _ = search_posts('gazelle')
+    assert [r['post'].id for r in results] == [2]
+
+
+def test_search_posts_ungranted_thread(app, authed_client):
+    _remove_forum_permissions()
+    add_permissions(app, 'forumaccess_forum_2')
+    db.session.execute(
+        """INSERT INTO users_permissions (user_id, permission, granted)
+                       VALUES (1, 'forumaccess_thread_3', 'f')"""
+    )
+    assert not search_posts('gazelle')[0]
+
+
+@pytest.mark.parametrize(
+    'query, expected',
+    [('new', [1]), ('LIT', [4]), ('using p', [3]), ('site', []), ('%', [])],
+)
+def test_search_threads_prefix(app, authed_client, query, expected):
+    assert [t.id for t in search_threads(query)] == expected
+
+
+def test_search_threads_fuzzy(app, authed_client):
+    assert [t.id for t in search_threads('donatoins', fuzzy=True)] == [5]
+    assert not search_threads('donatoins')
+
+
+def test_search_threads_no_access(app, authed_client):
+    _remove_forum_permissions()
+    add_permissions(app, 'forumaccess_forum_2', 'forumaccess_thread_5')
+    assert not search_threads('new')
+    assert [t.id for t in search_threads('donations')] == [5]
+
+
+def test_search_threads_cached(app, authed_client):
+    search_threads('new')
+    ForumThread.new(topic='News', forum_id=1, creator_id=1, post_contents='Hi')
+    assert [t.id for t in search_threads('new')] == [1]
+    assert [t.id for t in search_threads('news')] == [6]
+
@@ -0,0 +1,138 @@
+from array import array
+
+import pytest
+
+from conftest import add_permissions
+from core import db
+from forums.models import ForumPost, ForumThread
+from forums.search import (
+    Access,
+    MemorySearchBackend,
+    SearchDocument,
+    get_search_backend,
+    search_posts,
+    set_search_backend,
+)
+
+
+@pytest.fixture
+def memory_backend(app):
+    previous = get_search_backend()
+    backend = MemorySearchBackend()
+    set_search_backend(backend)
+    backend.load()
+    yield backend
+    set_search_backend(previous)
+
+
+def _remove_forum_permissions():
+    db.engine.execute(
+        "DELETE FROM users_permissions WHERE permission LIKE 'forumaccess%%'"
+    )
+
+
+def test_memory_backend_postings():
+    backend = MemorySearchBackend()
+    backend.index(
+        [
+            SearchDocument(3, 1, 1, 1, '[b]Hello[/b] world'),
+            SearchDocument(1, 1, 1, 1, 'Hello [quote]there[/quote]'),
+        ]
+    )
+    assert backend.postings == {
+        'hello': array('I', [1, 3]),
+        'world': array('I', [3]),
+    }
+    backend.index([SearchDocument(3, 1, 1, 1, None)])
+    assert backend.postings == {'hello': array('I', [1])}
+    backend.unindex_threads([1])
+    assert not backend.postings and not backend.documents
+
+
+def test_memory_backend_access():
+    backend = MemorySearchBackend()
+    backend.index(
+        [
+            SearchDocument(1, 1, 1, 1, 'yacht'),
+            SearchDocument(2, 2, 1, 1, 'yacht'),
+            SearchDocument(3, 3, 2, 1, 'yacht'),
+        ]
+    )
+    access = Access(forum_ids=(1,), thread_ids=(3,), ungranted_ids=(2,))
+    assert [r[0] for r in backend.search('yacht', access)] == [3, 1]
+    assert not backend.search('yacht', Access((), (), ()))
+
+
+def test_memory_backend_snippet():
+    backend = MemorySearchBackend()
+    backend.index(
+        [SearchDocument(1, 1, 1, 1, ' '.join(['word'] * 50 + ['Yacht!']))]
+    )
+    ((_, _, snippet),) = backend.search('yacht', Access((1,), (), ()))
+    assert snippet.endswith('<mark>Yacht</mark>!')
+    assert len(snippet.split()) == 35
+
+
+def test_search_posts_memory(app, authed_client, memory_backend):
+    results, cursor = search_posts('gazelle')
+    assert [r['post'].id for r in results] == [2]  # Post 5 is deleted.
+    assert '<mark>Gazelle</mark>' in results[0]['snippet']
+    assert cursor is None
+    assert [r['post'].id for r in search_posts('delete')[0]] == [7]
+
+
+@pytest.mark.parametrize(
+    'kwargs, expected',
+    [
+        ({'forum_id': 2}, [2]),
+        ({'forum_id': 1}, []),
+        ({'thread_id': 3}, [2]),
+        ({'user_id': 2}, []),
+    ],
+)
+def test_search_posts_memory_filters(
+    app, authed_client, memory_backend, kwargs, expected
+):
+    results, _ = search_posts('gazelle', **kwargs)
+    assert [r['post'].id for r in results] == expected
+
+
+def test_search_memory_follows_changes(app, authed_client, memory_backend):
+    post = ForumPost.from_pk(2)
+    post.contents = 'Submarines are cool'
+    db.session.commit()
+    assert [r['post'].id for r in search_posts('submarines')[0]] == [2]
+    assert not search_posts('gazelle')[0]
+    ForumThread.from_pk(4).deleted = True
+    db.session.commit()
+    assert 4 not in {d.thread_id for d in memory_backend.documents.values()}
+
+
+def test_search_memory_follows_thread_move(app, authed_client, memory_backend):
+    ForumThread.from_pk(3).forum_id = 1
+    db.session.commit()
+    results, _ = search_posts('gazelle', forum_id=1)
+    assert [r['post'].id for r in results] == [2]
+
+
+def test_search_posts_memory_pages(app, authed_client, memory_backend):
+    for contents in ('yacht', 'yacht yacht', 'yacht', 'yacht'):
+        ForumPost.new(thread_id=4, user_id=1, contents=contents)
+    seen, cursor = [], None
+    for _ in range(2):
+        results, cursor = search_posts('yacht', cursor=cursor, limit=2)
+        seen += [r['post'].id for r in results]
+    assert cursor is None
+    assert seen == [10, 12, 11, 9]
+
+
+def test_search_posts_memory_ungranted_thread(
+    app, authed_client, memory_backend
+):
+    _remove_forum_permissions()
+    add_permissions(app, 'forumaccess_forum_2')
+    db.session.execute(
+        """INSERT INTO users_permissions (user_id, permission, granted)
+                       VALUES (1, 'forumaccess_thread_3', 'f')"""
+    )
+    assert not search_posts('gazelle')[0]
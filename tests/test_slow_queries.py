@@ -0,0 +1,83 @@
+import pytest
+
+from conftest import add_permissions
+from core import db
+from forums.models import ForumUserStats
+from forums.slow_queries import slow_queries
+
+
+@pytest.fixture(autouse=True)
+def log_every_query():
+    threshold = slow_queries.threshold
+    slow_queries.clear()
+    slow_queries.threshold = 0
+    yield
+    slow_queries.threshold = threshold
+    slow_queries.clear()
+
+
+def test_slow_query_caller(app, client):
+    ForumUserStats.recompute([1])
+    (query, *_) = slow_queries.queries.all()
+    assert query['caller'].startswith('ForumUserStats.recompute (')
+    assert query['seconds'] >= 0
+    assert query['explain'] is None
+
+
+def test_slow_query_threshold(app, client):
+    slow_queries.threshold = 60
+    db.session.execute('SELECT 1')
+    assert not slow_queries.queries.all()
+
+
+def test_view_slow_queries(app, authed_client):
+    add_permissions(app, 'forums_view_slow_queries')
+    db.session.execute(
+        'SELECT id FROM forums_threads WHERE id = :value', {'value': 7}
+    )
+    response = authed_client.get('/forums/stats/slow-queries')
+    queries = response.get_json()['response']
+    query = next(q for q in queries if q['parameters'] == "{'value': 7}")
+    assert '_parameters' not in query
+
+    response = authed_client.post(
+        f'/forums/stats/slow-queries/{query["id"]}/explain'
+    )
+    assert response.status_code == 200
+    assert 'actual time' in response.get_json()['response']['explain']
+
+
+def test_explain_only_selects(app, authed_client):
+    add_permissions(app, 'forums_view_slow_queries')
+    db.session.execute("UPDATE forums_threads SET topic = 'a' WHERE id = 1")
+    (query, *_) = slow_queries.queries.all()
+    response = authed_client.post(
+        f'/forums/stats/slow-queries/{query["id"]}/explain'
+    )
+    assert response.status_code == 400
+
+
+def test_explain_no_locking_selects(app, authed_client):
+    add_permissions(app, 'forums_view_slow_queries')
+    db.session.execute('SELECT id FROM forums_threads FOR UPDATE')
+    (query, *_) = slow_queries.queries.all()
+    response = authed_client.post(
+        f'/forums/stats/slow-queries/{query["id"]}/explain'
+    )
+    assert response.status_code == 400
+
+
+def test_slow_query_other_tables(app, client):
+    db.session.execute('SELECT id FROM users WHERE id = :id', {'id': 1})
+    assert not slow_queries.queries.all()
+
+
+def test_explain_missing(app, authed_client):
+    add_permissions(app, 'forums_view_slow_queries')
+    response = authed_client.post('/forums/stats/slow-queries/999/explain')
+    assert response.status_code == 404
+
+
+def test_view_slow_queries_no_permission(app, authed_client):
+    response = authed_client.get('/forums/stats/slow-queries')
+    assert response.status_code == 403
@@ -3,15 +3,21 @@ import json
 import pytest
 
 from conftest import add_permissions, check_json_response
-from core import cache
-from forums.models import ForumPoll, ForumPollChoice
+from core import cache, db
+from forums.models import ForumPoll, ForumPollAnswer, ForumPollChoice
 
 
 def test_view_poll(app, authed_client):
     add_permissions(app, 'forums_view')
     response = authed_client.get('/polls/1')
     check_json_response(
-        response, {'id': 1, 'featured': False, 'question': 'Question 1'}
+        response,
+        {
+            'id': 1,
+            'featured': False,
+            'question': 'Question 1',
+            'voted_choice_id': 1,
+        },
     )
     assert response.status_code == 200
     assert len(response.get_json()['response']['choices']) == 3
@@ -34,6 +40,18 @@ def test_modify_poll_closed_featured(app, authed_client):
     assert poll.closed is True
     assert poll.featured is True
     assert ForumPoll.from_pk(3).featured is False
+    results = cache.get(ForumPoll.__cache_key_results__.format(id=1))
+    assert results['total'] == 3
+
+
+def test_modify_poll_reopen(app, authed_client):
+    add_permissions(app, 'forums_view', 'modify_forum_polls')
+    ForumPoll.from_pk(4).freeze_results()
+    response = authed_client.put(
+        '/polls/4', data=json.dumps({'closed': False})
+    )
+    check_json_response(response, {'id': 4, 'closed': False})
+    assert not cache.get(ForumPoll.__cache_key_results__.format(id=4))
 
 
 def test_modify_poll_unfeature(app, authed_client):
@@ -60,6 +78,19 @@ def test_modify_poll_choices(app, authed_client):
     assert {'Choice C', 'a', 'b', 'c'} == {choice.choice for choice in choices}
 
 
+def test_modify_poll_choices_clears_answers(app, authed_client):
+    add_permissions(app, 'forums_view', 'modify_forum_polls')
+    ForumPoll.from_pk(1).choices  # cache the answer counts
+    authed_client.put(
+        '/polls/1', data=json.dumps({'choices': {'delete': [1, 2]}})
+    )
+    assert not cache.get(ForumPollChoice.__cache_key_answers__.format(id=1))
+    assert not cache.get(ForumPollChoice.__cache_key_answers__.format(id=2))
+    assert ForumPollChoice.from_pk(1) is None
+    assert not ForumPollAnswer.from_attrs(poll_id=1, user_id=1)
+    assert ForumPollAnswer.from_attrs(poll_id=2, user_id=1)
+
+
 def test_modify_poll_choices_errors(app, authed_client):
     add_permissions(app, 'forums_view', 'modify_forum_polls')
     response = authed_client.put(
@@ -99,6 +130,16 @@ def test_vote_poll_already_voted(app, authed_client, choice_id):
     check_json_response(response, 'You have already voted on this poll.')
 
 
+def test_vote_poll_no_forum_access(app, authed_client):
+    add_permissions(app, 'forums_view', 'forums_polls_vote')
+    db.engine.execute(
+        "DELETE FROM users_permissions WHERE permission LIKE 'forumaccess%%'"
+    )
+    response = authed_client.post('/polls/votes/6')
+    assert response.status_code == 403
+    assert not ForumPollAnswer.from_attrs(poll_id=3, user_id=1)
+
+
 def test_vote_poll_doesnt_exist(app, authed_client):
     add_permissions(app, 'forums_view', 'forums_polls_vote')
     response = authed_client.post(f'/polls/votes/10')
@@ -0,0 +1,45 @@
+from conftest import add_permissions, check_json_response
+
+
+def test_search_forum_posts(app, authed_client):
+    add_permissions(app, 'forums_view')
+    response = authed_client.get(
+        '/forums/search', query_string={'query': 'gazelle', 'forum_id': 2}
+    ).get_json()['response']
+    assert response['cursor'] is None
+    assert len(response['results']) == 1
+    assert response['results'][0]['post']['id'] == 2
+    assert '<mark>' in response['results'][0]['snippet']
+
+
+def test_search_forum_posts_no_query(app, authed_client):
+    add_permissions(app, 'forums_view')
+    response = authed_client.get('/forums/search')
+    assert response.status_code == 400
+
+
+def test_search_forum_posts_no_permission(app, authed_client):
+    response = authed_client.get(
+        '/forums/search', query_string={'query': 'gazelle'}
+    )
+    check_json_response(
+        response, 'You do not have permission to access this resource.'
+    )
+    assert response.status_code == 403
+
+
+def test_search_forum_threads(app, authed_client):
+    add_permissions(app, 'forums_view')
+    response = authed_client.get(
+        '/forums/search/threads',
+        query_string={'query': 'donatoins', 'mode': 'fuzzy'},
+    )
+    assert [t['id'] for t in response.get_json()['response']] == [5]
+
+
+def test_search_forum_threads_bad_mode(app, authed_client):
+    add_permissions(app, 'forums_view')
+    response = authed_client.get(
+        '/forums/search/threads', query_string={'query': 'a', 'mode': 'regex'}
+    )
+    assert response.status_code == 400
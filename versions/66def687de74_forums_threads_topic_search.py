@@ -0,0 +1,38 @@
+"""forums threads topic search
+
+Revision ID: 66def687de74
+Revises: f4448c64e7bd
+Create Date: 2026-10-19 09:44:52.301967
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '66def687de74'
+down_revision = 'f4448c64e7bd'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # text_pattern_ops lets LIKE 'prefix%' use the index under any collation.
+    op.drop_index('ix_forums_threads_topic', table_name='forums_threads')
+    op.execute(
+        'CREATE INDEX ix_forums_threads_topic ON forums_threads '
+        '(lower(topic) text_pattern_ops)'
+    )
+    op.execute(
+        'CREATE INDEX ix_forums_threads_topic_trgm ON forums_threads '
+        'USING gin (topic gin_trgm_ops)'
+    )
+
+
+def downgrade():
+    op.drop_index('ix_forums_threads_topic_trgm', table_name='forums_threads')
+    op.drop_index('ix_forums_threads_topic', table_name='forums_threads')
+    op.execute(
+        'CREATE INDEX ix_forums_threads_topic ON forums_threads (lower(topic))'
+    )
@@ -0,0 +1,41 @@
+"""forums posts search document plain
+
+Revision ID: 6e588b16b14e
+Revises: 66def687de74
+Create Date: 2026-10-19 09:58:17.436028
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6e588b16b14e'
+down_revision = '66def687de74'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The application now writes the search documents itself. Dropping the
+    # expression keeps the current documents until they are rebuilt with
+    # `flask forums search-backfill --restart`.
+    op.execute(
+        'ALTER TABLE forums_posts ALTER COLUMN search_document DROP EXPRESSION'
+    )
+
+
+def downgrade():
+    op.drop_index('ix_forums_posts_search_document', table_name='forums_posts')
+    op.drop_column('forums_posts', 'search_document')
+    op.execute(
+        "ALTER TABLE forums_posts ADD COLUMN search_document tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('english', regexp_replace("
+        "contents, '\\[/?[a-z*]+(=[^\\]]*)?\\]', ' ', 'gi'))) STORED"
+    )
+    op.create_index(
+        'ix_forums_posts_search_document',
+        'forums_posts',
+        ['search_document'],
+        postgresql_using='gin',
+    )
@@ -0,0 +1,37 @@
+"""forums users stats
+
+Revision ID: 8ad7df7ed767
+Revises: 29040202cb0d
+Create Date: 2026-10-19 09:12:40.218305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8ad7df7ed767'
+down_revision = '29040202cb0d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Rows are created when a user first posts, or all at once with
+    # `flask forums recompute-stats`.
+    op.create_table(
+        'forums_users_stats',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column(
+            'post_count', sa.Integer(), server_default='0', nullable=False
+        ),
+        sa.Column(
+            'thread_count', sa.Integer(), server_default='0', nullable=False
+        ),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('user_id'),
+    )
+
+
+def downgrade():
+    op.drop_table('forums_users_stats')
@@ -0,0 +1,37 @@
+"""forums posts search document
+
+Revision ID: f4448c64e7bd
+Revises: 8ad7df7ed767
+Create Date: 2026-10-19 09:31:05.774120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4448c64e7bd'
+down_revision = '8ad7df7ed767'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The column is not mapped on ForumPost, so that loading and caching
+    # posts never carries it. Postgres fills it in for existing rows.
+    op.execute(
+        "ALTER TABLE forums_posts ADD COLUMN search_document tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('english', regexp_replace("
+        "contents, '\\[/?[a-z*]+(=[^\\]]*)?\\]', ' ', 'gi'))) STORED"
+    )
+    op.create_index(
+        'ix_forums_posts_search_document',
+        'forums_posts',
+        ['search_document'],
+        postgresql_using='gin',
+    )
+
+
+def downgrade():
+    op.drop_index('ix_forums_posts_search_document', table_name='forums_posts')
+    op.drop_column('forums_posts', 'search_document')